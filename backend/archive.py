@@ -0,0 +1,189 @@
+from pymongo import ReplaceOne, DeleteOne
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+from indexes import INDEXES, ensure_collection_indexes
+from occupancy import park_now
+from pagination import paginate, paginate_union
+import asyncio
+import logging
+import os
+import socket
+
+ORDER_ARCHIVE_AFTER_DAYS = int(os.getenv('ORDER_ARCHIVE_AFTER_DAYS', '365'))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '500'))
+# Pause between batches, so the job never competes with live traffic for long
+ARCHIVE_BATCH_PAUSE_SECONDS = float(os.getenv('ARCHIVE_BATCH_PAUSE_SECONDS', '0.5'))
+ARCHIVE_PREFIX = 'orders_archive_'
+TERMINAL_STATUSES = ['approved', 'rejected', 'cancelled', 'refunded']
+RUN_ID = 'orders'
+# A running job that has not checkpointed for this long is considered dead
+STALE_AFTER = timedelta(minutes=5)
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+logger = logging.getLogger(__name__)
+
+class ArchiveBusy(Exception):
+    pass
+
+def archive_collection_for(visit_date: str) -> str:
+    year = (visit_date or '')[:4]
+    return ARCHIVE_PREFIX + (year if year.isdigit() else 'unknown')
+
+async def archive_collections(db) -> list:
+    names = await db.list_collection_names(filter={'name': {'$regex': f'^{ARCHIVE_PREFIX}'}})
+    return sorted(names, reverse=True)  # Most recent seasons first
+
+async def _order_collections(db):
+    """`orders`, then the archive collections; archives are only listed on a miss."""
+    yield db.orders
+    for name in await archive_collections(db):
+        yield db[name]
+
+async def find_order(db, query: dict, projection: dict = None):
+    """(collection, order) for a single-order lookup that must survive archival,
+    e.g. by order_id or ticket_code (indexed in every archive collection)."""
+    async for collection in _order_collections(db):
+        order = await collection.find_one(query, projection)
+        if order is not None:
+            return collection, order
+    return db.orders, None
+
+async def update_order(db, query: dict, update: dict, **kwargs):
+    """find_one_and_update on whichever collection holds the order. Archived
+    orders are updated in place; a later archival run never touches them."""
+    async for collection in _order_collections(db):
+        order = await collection.find_one_and_update(query, update, **kwargs)
+        if order is not None:
+            return order
+    return None
+
+async def orders_everywhere(db, query: dict, projection: dict = None, batch_size: int = 500):
+    """Every matching order, archived seasons (oldest first) before the hot
+    collection, each by created_at; for exports that must include the archive."""
+    names = sorted(await archive_collections(db)) + ['orders']
+    for name in names:
+        cursor = db[name].find(query, projection).sort('created_at', 1).batch_size(batch_size)
+        async for order in cursor:
+            yield order
+
+async def paginate_orders(db, query: dict, limit: int, cursor: str = None, include_archive: bool = False):
+    """Newest-first order pages, optionally spanning the archive collections."""
+    if include_archive:
+        others = await archive_collections(db)
+        return await paginate_union(db.orders, others, query, 'created_at', -1, limit, cursor)
+    return await paginate(db.orders, query, 'created_at', -1, limit, cursor)
+
+async def claim_run(db, older_than_days: int) -> dict:
+    """Take the single archival lease, resuming an interrupted run if there is one."""
+    now = datetime.utcnow()
+    previous = await db.archive_runs.find_one({'_id': RUN_ID}) or {}
+    resume = previous.get('status') == 'failed' or (
+        previous.get('status') == 'running' and previous['heartbeat_at'] < now - STALE_AFTER
+    )
+    if resume:
+        fields = {'cutoff': previous['cutoff'], 'last_id': previous.get('last_id'), 'moved': previous.get('moved', 0)}
+    else:
+        cutoff = (park_now().date() - timedelta(days=older_than_days)).isoformat()
+        fields = {'cutoff': cutoff, 'last_id': None, 'moved': 0, 'started_at': now}
+    try:
+        await db.archive_runs.update_one(
+            {'_id': RUN_ID, '$or': [{'status': {'$ne': 'running'}}, {'heartbeat_at': {'$lt': now - STALE_AFTER}}]},
+            {
+                '$set': {**fields, 'status': 'running', 'worker': WORKER_ID, 'heartbeat_at': now, 'error': None},
+                '$unset': {'finished_at': ''}
+            },
+            upsert=True
+        )
+    except DuplicateKeyError:
+        raise ArchiveBusy(previous.get('worker'))
+    return {**fields, 'resumed': resume}
+
+async def _archive_batch(db, orders: list, ensured: set) -> int:
+    now = datetime.utcnow()
+    by_collection = {}
+    for order in orders:
+        by_collection.setdefault(archive_collection_for(order.get('visit_date')), []).append(order)
+
+    for name, batch in by_collection.items():
+        if name not in ensured:
+            # Same shapes as the hot collection, so archive reads use the same plans
+            await ensure_collection_indexes(db, name, INDEXES['orders'])
+            ensured.add(name)
+        # Upserts make a batch safe to repeat after a crash between copy and delete
+        await db[name].bulk_write(
+            [ReplaceOne({'_id': order['_id']}, {**order, 'archived_at': now}, upsert=True) for order in batch],
+            ordered=False
+        )
+
+    # Only delete orders that did not change since they were copied; a changed
+    # one stays hot and is copied again by the next run.
+    result = await db.orders.bulk_write([
+        DeleteOne({'_id': order['_id'], 'payment_status': order.get('payment_status'), 'updated_at': order.get('updated_at')})
+        for order in orders
+    ], ordered=False)
+
+    if result.deleted_count < len(orders):
+        # Drop the stale copies of those, so no order is ever live and archived at once
+        kept = {order['_id'] async for order in db.orders.find({'_id': {'$in': [order['_id'] for order in orders]}}, {'_id': 1})}
+        for name, batch in by_collection.items():
+            stale = [order['_id'] for order in batch if order['_id'] in kept]
+            if stale:
+                await db[name].delete_many({'_id': {'$in': stale}})
+    return result.deleted_count
+
+async def archive_orders(db, older_than_days: int = ORDER_ARCHIVE_AFTER_DAYS,
+                         batch_size: int = ARCHIVE_BATCH_SIZE, run: dict = None) -> dict:
+    """Move terminal orders whose visit date is older than the cutoff into
+    per-year archive collections, in `_id` order, checkpointing every batch.
+    Pass `run` when the lease was already taken with claim_run()."""
+    run = run or await claim_run(db, older_than_days)
+    query = {'visit_date': {'$lt': run['cutoff']}, 'payment_status': {'$in': TERMINAL_STATUSES}}
+    last_id, moved, ensured = run['last_id'], run['moved'], set()
+    logger.info('Order archival started', extra={'cutoff': run['cutoff'], 'resumed': run['resumed'], 'last_id': str(last_id)})
+
+    try:
+        while True:
+            page = {**query, '_id': {'$gt': last_id}} if last_id is not None else query
+            orders = await db.orders.find(page).sort('_id', 1).limit(batch_size).to_list(batch_size)
+            if not orders:
+                break
+            moved += await _archive_batch(db, orders, ensured)
+            last_id = orders[-1]['_id']
+            await db.archive_runs.update_one(
+                {'_id': RUN_ID, 'worker': WORKER_ID},
+                {'$set': {'last_id': last_id, 'moved': moved, 'heartbeat_at': datetime.utcnow()}}
+            )
+            await asyncio.sleep(ARCHIVE_BATCH_PAUSE_SECONDS)
+    except Exception as e:
+        await db.archive_runs.update_one(
+            {'_id': RUN_ID, 'worker': WORKER_ID},
+            {'$set': {'status': 'failed', 'error': str(e), 'heartbeat_at': datetime.utcnow()}}
+        )
+        logger.exception('Order archival failed', extra={'moved': moved})
+        raise
+
+    await db.archive_runs.update_one(
+        {'_id': RUN_ID, 'worker': WORKER_ID},
+        {'$set': {'status': 'completed', 'moved': moved, 'finished_at': datetime.utcnow()}}
+    )
+    logger.info('Order archival finished', extra={'moved': moved})
+    return {'cutoff': run['cutoff'], 'moved': moved}
+
+if __name__ == '__main__':
+    # python archive.py [older_than_days]
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+    from pathlib import Path
+    import sys
+
+    load_dotenv(Path(__file__).parent / '.env')
+
+    async def main():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        try:
+            days = int(sys.argv[1]) if len(sys.argv) > 1 else ORDER_ARCHIVE_AFTER_DAYS
+            print(await archive_orders(client[os.environ['DB_NAME']], days))
+        finally:
+            client.close()
+
+    asyncio.run(main())
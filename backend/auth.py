@@ -1,17 +1,33 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from pymongo import ReturnDocument
+from metrics import registry
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import asyncio
+import logging
+import math
 import os
+import time
 
 SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-change-in-production-123456789')
 ALGORITHM = 'HS256'
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
+TOKEN_VERSION_REFRESH_SECONDS = int(os.getenv('TOKEN_VERSION_REFRESH_SECONDS', '30'))
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', '32'))
+BCRYPT_TARGET_MS = float(os.getenv('BCRYPT_TARGET_MS', '250'))
+BCRYPT_MIN_ROUNDS = int(os.getenv('BCRYPT_MIN_ROUNDS', '10'))
+BCRYPT_MAX_ROUNDS = int(os.getenv('BCRYPT_MAX_ROUNDS', '15'))
+BCRYPT_ROUNDS = os.getenv('BCRYPT_ROUNDS')  # Skips calibration when set
 
 pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
 security = HTTPBearer()
+logger = logging.getLogger(__name__)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
@@ -19,6 +35,181 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+def verify_password_and_check(plain_password: str, hashed_password: str) -> Tuple[bool, bool]:
+    # (valid, needs_rehash); the rehash check only parses the hash, no bcrypt work
+    valid = pwd_context.verify(plain_password, hashed_password)
+    return valid, valid and pwd_context.needs_update(hashed_password)
+
+def calibrate_bcrypt_rounds(target_ms: float = BCRYPT_TARGET_MS) -> int:
+    """Pick the bcrypt cost whose hash time on this machine is closest to `target_ms`.
+
+    Hashes below the chosen cost are reported by `needs_update` and get
+    upgraded on the next successful login; higher costs are never lowered.
+    """
+    if BCRYPT_ROUNDS:
+        rounds = int(BCRYPT_ROUNDS)
+    else:
+        probe = CryptContext(schemes=['bcrypt'], bcrypt__rounds=BCRYPT_MIN_ROUNDS)
+        probe.hash('calibration')  # Warm up the backend
+        started_at = time.perf_counter()
+        probe.hash('calibration')
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        # Every extra round doubles the cost
+        rounds = BCRYPT_MIN_ROUNDS + round(math.log2(max(target_ms / elapsed_ms, 1)))
+        rounds = max(BCRYPT_MIN_ROUNDS, min(BCRYPT_MAX_ROUNDS, rounds))
+
+    pwd_context.update(bcrypt__rounds=rounds, bcrypt__min_rounds=rounds)
+    return rounds
+
+# ============= PASSWORD EXECUTOR =============
+
+class PasswordExecutor:
+    """Runs bcrypt on a small dedicated thread pool, away from the event loop.
+
+    bcrypt releases the GIL, so a couple of threads keep logins moving while
+    every other request is served. Once `max_pending` calls are queued or
+    running, new ones are rejected with a 503 instead of piling up.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.max_pending_seen = 0
+        self._wait_ms = deque(maxlen=1000)
+        self._run_ms = deque(maxlen=1000)
+
+    def _timed(self, queued_at: float, fn, *args):
+        started_at = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            finished_at = time.perf_counter()
+            self._wait_ms.append((started_at - queued_at) * 1000)
+            self._run_ms.append((finished_at - started_at) * 1000)
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail='Servidor ocupado. Tente novamente em instantes.',
+                headers={'Retry-After': '1'}
+            )
+        self.pending += 1
+        self.max_pending_seen = max(self.max_pending_seen, self.pending)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._timed, time.perf_counter(), fn, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    @staticmethod
+    def _percentiles(samples) -> dict:
+        ordered = sorted(samples)
+        if not ordered:
+            return {'p50': None, 'p95': None, 'max': None}
+        return {
+            'p50': round(ordered[len(ordered) // 2], 2),
+            'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+            'max': round(ordered[-1], 2)
+        }
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'pending': self.pending,
+            'max_pending_seen': self.max_pending_seen,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'queue_wait_ms': self._percentiles(self._wait_ms),
+            'hash_ms': self._percentiles(self._run_ms)
+        }
+
+password_executor = PasswordExecutor(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
+registry.callback_gauge(
+    'password_hash_pending', 'bcrypt calls queued or running',
+    lambda: {(): password_executor.pending}
+)
+registry.callback_gauge(
+    'password_hash_rejected', 'bcrypt calls rejected because the executor was saturated',
+    lambda: {(): password_executor.rejected}
+)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, bool]:
+    return await password_executor.run(verify_password_and_check, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await password_executor.run(get_password_hash, password)
+
+async def upgrade_password_hash(collection, document_id, old_hash: str, password: str):
+    """Background task: re-hash a password stored below the calibrated cost."""
+    try:
+        new_hash = await get_password_hash_async(password)
+        # Only replace the hash we verified, in case the password changed meanwhile
+        await collection.update_one(
+            {'_id': document_id, 'hashed_password': old_hash},
+            {'$set': {'hashed_password': new_hash}}
+        )
+    except Exception:
+        logger.exception('Failed to upgrade password hash for %s', document_id)
+
+# ============= TOKEN VERSIONS =============
+
+class TokenVersionCache:
+    """In-memory copy of the `token_versions` collection.
+
+    Every token carries the version its principal had when it was issued
+    (`ver` claim). Bumping the stored version revokes all older tokens, and
+    checking it costs a dict lookup instead of a query per request.
+    """
+
+    def __init__(self):
+        self._versions = {}
+
+    @staticmethod
+    def key(principal_type: str, principal_id: str) -> str:
+        return f'{principal_type}:{principal_id}'
+
+    def get(self, principal_type: str, principal_id: str) -> int:
+        return self._versions.get(self.key(principal_type, principal_id), 0)
+
+    async def load(self, db):
+        versions = {}
+        async for doc in db.token_versions.find({}):
+            versions[doc['_id']] = doc['version']
+        self._versions = versions
+
+    async def revoke(self, db, principal_type: str, principal_id: str) -> int:
+        key = self.key(principal_type, principal_id)
+        doc = await db.token_versions.find_one_and_update(
+            {'_id': key},
+            {'$inc': {'version': 1}, '$set': {'updated_at': datetime.utcnow()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._versions[key] = doc['version']
+        return doc['version']
+
+    async def refresh_forever(self, db, interval: int = TOKEN_VERSION_REFRESH_SECONDS):
+        # Picks up revocations made by other workers
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.load(db)
+            except Exception:
+                logger.exception('Failed to refresh token versions')
+
+token_versions = TokenVersionCache()
+
+# ============= TOKENS =============
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -26,6 +217,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({'exp': expire})
+    if 'type' in to_encode and 'id' in to_encode:
+        to_encode['ver'] = token_versions.get(to_encode['type'], to_encode['id'])
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -36,6 +229,32 @@ def decode_access_token(token: str):
     except JWTError:
         return None
 
+def decode_principal_token(token: str, principal_type: str) -> Optional[dict]:
+    payload = decode_access_token(token)
+    if not payload or payload.get('type') != principal_type:
+        return None
+    if not payload.get('sub') or not payload.get('id'):
+        return None
+    if payload.get('ver', 0) < token_versions.get(principal_type, payload['id']):
+        return None
+    return payload
+
+def require_principal(principal_type: str):
+    async def get_current_principal(request: Request) -> dict:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            raise HTTPException(status_code=401, detail='Token não fornecido')
+
+        payload = decode_principal_token(auth_header.split(' ')[1], principal_type)
+        if payload is None:
+            raise HTTPException(status_code=401, detail='Token inválido')
+        return payload
+
+    return get_current_principal
+
+get_current_staff = require_principal('staff')
+get_current_customer = require_principal('customer')
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -43,14 +262,19 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         headers={'WWW-Authenticate': 'Bearer'},
     )
     token = credentials.credentials
-    payload = decode_access_token(token)
+    payload = decode_principal_token(token, 'admin')
     if payload is None:
         raise credentials_exception
-    email: str = payload.get('sub')
-    if email is None:
-        raise credentials_exception
-    return {'email': email}
+    return {
+        'id': payload['id'],
+        'email': payload['sub'],
+        'is_admin': payload.get('is_admin', False)
+    }
 
 async def get_current_admin_user(current_user: dict = Depends(get_current_user)):
-    # In production, check if user is admin from database
-    return current_user
\ No newline at end of file
+    if not current_user['is_admin']:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail='Acesso negado. Apenas administradores podem acessar.'
+        )
+    return current_user
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+from occupancy import PARK_TIMEZONE
+from metrics import ticket_holds
+import os
+
+ENTRY_SLOT_GRACE_BEFORE_MINUTES = int(os.getenv('ENTRY_SLOT_GRACE_BEFORE_MINUTES', '15'))
+ENTRY_SLOT_GRACE_AFTER_MINUTES = int(os.getenv('ENTRY_SLOT_GRACE_AFTER_MINUTES', '60'))
+
+def find_slot(availability: dict, start: str):
+    return next((slot for slot in availability.get('slots') or [] if slot['start'] == start), None)
+
+def slot_remaining(slot: dict) -> int:
+    return slot['capacity'] - slot.get('tickets_sold', 0)
+
+def public_slots(availability: dict) -> list:
+    return [
+        {'start': slot['start'], 'capacity': slot['capacity'], 'remaining': slot_remaining(slot)}
+        for slot in availability.get('slots') or []
+    ]
+
+def merge_slots(new_slots: list, existing_slots: list) -> list:
+    # Keep what was already sold when the admin edits a date's slots
+    sold = {slot['start']: slot.get('tickets_sold', 0) for slot in existing_slots or []}
+    return sorted(
+        [{**slot, 'tickets_sold': sold.get(slot['start'], 0)} for slot in new_slots],
+        key=lambda slot: slot['start']
+    )
+
+async def reserve_tickets(db, date: str, quantity: int, entry_slot: str = None) -> bool:
+    """Atomically take `quantity` tickets from the date and, if given, one of its slots."""
+    fits = [{'$lte': [{'$add': ['$tickets_sold', quantity]}, '$total_tickets']}]
+    update = {'$inc': {'tickets_sold': quantity}}
+    array_filters = None
+    if entry_slot:
+        fits.append({'$anyElementTrue': [{'$map': {
+            'input': {'$ifNull': ['$slots', []]},
+            'as': 'slot',
+            'in': {'$and': [
+                {'$eq': ['$$slot.start', entry_slot]},
+                {'$lte': [{'$add': ['$$slot.tickets_sold', quantity]}, '$$slot.capacity']}
+            ]}
+        }}]})
+        update['$inc']['slots.$[slot].tickets_sold'] = quantity
+        array_filters = [{'slot.start': entry_slot}]
+
+    result = await db.ticket_availability.update_one(
+        {'date': date, 'is_active': True, '$expr': {'$and': fits}},
+        update,
+        array_filters=array_filters
+    )
+    reserved = result.modified_count == 1
+    ticket_holds.inc('reserved' if reserved else 'rejected')
+    return reserved
+
+async def release_tickets(db, date: str, quantity: int, entry_slot: str = None):
+    ticket_holds.inc('released')
+    update = {'$inc': {'tickets_sold': -quantity}}
+    array_filters = None
+    if entry_slot:
+        update['$inc']['slots.$[slot].tickets_sold'] = -quantity
+        array_filters = [{'slot.start': entry_slot}]
+    await db.ticket_availability.update_one({'date': date}, update, array_filters=array_filters)
+
+def slot_window(visit_date: str, entry_slot: str):
+    start = datetime.strptime(f'{visit_date} {entry_slot}', '%Y-%m-%d %H:%M').replace(tzinfo=PARK_TIMEZONE)
+    return (
+        start - timedelta(minutes=ENTRY_SLOT_GRACE_BEFORE_MINUTES),
+        start + timedelta(minutes=ENTRY_SLOT_GRACE_AFTER_MINUTES)
+    )
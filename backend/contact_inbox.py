@@ -0,0 +1,24 @@
+from datetime import datetime
+import os
+
+CONTACT_STATUSES = ('new', 'read', 'replied', 'archived')
+# Closed messages are deleted this many days after being closed. Only
+# 'archived' by default: a replied message may still get an answer back
+CONTACT_RETENTION_DAYS = int(os.getenv('CONTACT_RETENTION_DAYS', '180'))
+RESOLVED_CONTACT_STATUSES = set(os.getenv('RESOLVED_CONTACT_STATUSES', 'archived').split(','))
+CONTACT_TEXT_LANGUAGE = 'portuguese'
+
+def status_update(new_status: str) -> dict:
+    """$set/$unset for a status change. `resolved_at` is what the TTL index
+    expires on, so reopening a message also cancels its deletion."""
+    if new_status in RESOLVED_CONTACT_STATUSES:
+        return {'$set': {'status': new_status, 'resolved_at': datetime.utcnow()}}
+    return {'$set': {'status': new_status}, '$unset': {'resolved_at': ''}}
+
+def search_query(q: str = None, status: str = None) -> dict:
+    query = {}
+    if q:
+        query['$text'] = {'$search': q, '$language': CONTACT_TEXT_LANGUAGE}
+    if status:
+        query['status'] = status
+    return query
@@ -1,14 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, Query, BackgroundTasks
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from customer_models import CustomerCreate, CustomerLogin, Customer, MercadoPagoConfig
 from models import Order, OrderCreate
-from auth import verify_password, get_password_hash, create_access_token
+from login_throttle import login_throttle, client_ip
+from metrics import checkouts, webhooks
+from availability import find_slot, slot_remaining, reserve_tickets, release_tickets
+from pagination import set_next_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from dashboard_counters import bump
+from archive import paginate_orders, update_order
+from sales_rollups import ORDER_PROJECTION as ROLLUP_PROJECTION, approval_change, apply_order
+from order_schema import new_order_document, new_ticket_code, order_view
+from order_search import normalize_cpf
+from auth import (
+    verify_password_async, get_password_hash_async, upgrade_password_hash,
+    create_access_token, get_current_customer
+)
 from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import uuid
 import os
+import logging
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 async def get_database(request: Request) -> AsyncIOMotorDatabase:
     return request.app.db
@@ -20,33 +36,41 @@ async def register_customer(
     customer_data: CustomerCreate,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    # Check if email already exists
-    existing = await db.customers.find_one({'email': customer_data.email})
-    if existing:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail='Email já cadastrado'
-        )
+    customer_dict = customer_data.dict()
+    customer_dict['document'] = normalize_cpf(customer_data.document)
     
-    # Check if document already exists
-    existing_doc = await db.customers.find_one({'document': customer_data.document})
-    if existing_doc:
+    # Checked before hashing so duplicates cost no bcrypt work; the unique
+    # indexes on email and document still reject the ones that race past it
+    existing = await db.customers.find_one(
+        {'$or': [{'email': customer_data.email}, {'document': customer_dict['document']}]},
+        {'email': 1}
+    )
+    if existing:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail='CPF já cadastrado'
+            detail='Email já cadastrado' if existing['email'] == customer_data.email else 'CPF já cadastrado'
         )
     
-    # Create customer
-    customer_dict = customer_data.dict()
-    customer_dict['hashed_password'] = get_password_hash(customer_data.password)
+    customer_dict['hashed_password'] = await get_password_hash_async(customer_data.password)
     del customer_dict['password']
     customer_dict['created_at'] = datetime.utcnow()
     
-    result = await db.customers.insert_one(customer_dict)
+    try:
+        result = await db.customers.insert_one(customer_dict)
+    except DuplicateKeyError as e:
+        duplicated = (e.details or {}).get('keyPattern', {})
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='CPF já cadastrado' if 'document' in duplicated else 'Email já cadastrado'
+        )
     customer_dict['_id'] = str(result.inserted_id)
     
-    # Create access token
-    access_token = create_access_token(data={'sub': customer_data.email, 'type': 'customer'})
+    # Create access token; identity only, the profile is read from the database
+    access_token = create_access_token(data={
+        'sub': customer_data.email,
+        'type': 'customer',
+        'id': str(result.inserted_id)
+    })
     
     return {
         'access_token': access_token,
@@ -62,16 +86,32 @@ async def register_customer(
 @router.post('/api/customers/login')
 async def login_customer(
     login_data: CustomerLogin,
+    request: Request,
+    background_tasks: BackgroundTasks,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
+    # Throttled before any lookup or bcrypt work
+    ip = client_ip(request)
+    account = f'customer:{login_data.email.lower()}'
+    await login_throttle.check(db, ip, account)
+    
     customer = await db.customers.find_one({'email': login_data.email})
-    if not customer or not verify_password(login_data.password, customer['hashed_password']):
+    valid, needs_rehash = await verify_password_async(login_data.password, customer['hashed_password']) if customer else (False, False)
+    if not valid:
+        await login_throttle.record_failure(db, ip, account)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail='Email ou senha incorretos'
         )
     
-    access_token = create_access_token(data={'sub': customer['email'], 'type': 'customer'})
+    await login_throttle.record_success(db, account)
+    if needs_rehash:
+        background_tasks.add_task(upgrade_password_hash, db.customers, customer['_id'], customer['hashed_password'], login_data.password)
+    access_token = create_access_token(data={
+        'sub': customer['email'],
+        'type': 'customer',
+        'id': str(customer['_id'])
+    })
     
     return {
         'access_token': access_token,
@@ -86,52 +126,40 @@ async def login_customer(
 
 @router.get('/api/customers/me')
 async def get_customer_info(
-    request: Request,
+    customer: dict = Depends(get_current_customer),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        raise HTTPException(status_code=401, detail='Token não fornecido')
-    
-    token = auth_header.split(' ')[1]
-    from auth import decode_access_token
-    payload = decode_access_token(token)
-    
-    if not payload or payload.get('type') != 'customer':
-        raise HTTPException(status_code=401, detail='Token inválido')
-    
-    customer = await db.customers.find_one({'email': payload['sub']})
-    if not customer:
-        raise HTTPException(status_code=404, detail='Cliente não encontrado')
-    
+    profile = await db.customers.find_one(
+        {'_id': ObjectId(customer['id'])},
+        {'name': 1, 'email': 1, 'phone': 1, 'document': 1}
+    )
+    if not profile:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Cliente não encontrado')
     return {
-        'id': str(customer['_id']),
-        'name': customer['name'],
-        'email': customer['email'],
-        'phone': customer['phone'],
-        'document': customer['document']
+        'id': customer['id'],
+        'name': profile['name'],
+        'email': profile['email'],
+        'phone': profile['phone'],
+        'document': profile['document']
     }
 
 # ============= CUSTOMER ORDERS =============
 
 @router.get('/api/customers/my-orders')
 async def get_customer_orders(
-    request: Request,
+    response: Response,
+    cursor: str = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    include_archive: bool = False,
+    customer: dict = Depends(get_current_customer),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        raise HTTPException(status_code=401, detail='Token não fornecido')
-    
-    token = auth_header.split(' ')[1]
-    from auth import decode_access_token
-    payload = decode_access_token(token)
-    
-    if not payload or payload.get('type') != 'customer':
-        raise HTTPException(status_code=401, detail='Token inválido')
-    
-    # Get customer orders
-    orders = await db.orders.find({'customer.email': payload['sub']}).sort('created_at', -1).to_list(100)
+    # Get customer orders; past seasons only when asked for
+    orders, next_cursor = await paginate_orders(
+        db, {'customer.email': customer['sub']}, limit, cursor, include_archive
+    )
+    set_next_cursor(response, next_cursor)
+    orders = [order_view(order) for order in orders]
     for order in orders:
         order['_id'] = str(order['_id'])
     
@@ -184,6 +212,8 @@ async def create_payment_preference(
     order_data: OrderCreate,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
+    reserved = False
+    result = None
     try:
         # Check ticket availability for the date
         availability = await db.ticket_availability.find_one({
@@ -191,10 +221,19 @@ async def create_payment_preference(
             'is_active': True
         })
         
+        total_quantity = sum(item['quantity'] for item in order_data.items)
+        entry_slot = None
         if availability:
-            total_quantity = sum(item['quantity'] for item in order_data.items)
             available_tickets = availability['total_tickets'] - availability['tickets_sold']
             
+            # Dates with timed entry need a slot with room for the whole order
+            if availability.get('slots'):
+                slot = find_slot(availability, order_data.entry_slot) if order_data.entry_slot else None
+                if not slot:
+                    raise HTTPException(status_code=400, detail='Selecione um horário de entrada válido')
+                entry_slot = slot['start']
+                available_tickets = min(available_tickets, slot_remaining(slot))
+            
             if available_tickets < total_quantity:
                 raise HTTPException(
                     status_code=400,
@@ -215,27 +254,25 @@ async def create_payment_preference(
         import mercadopago
         sdk = mercadopago.SDK(config['access_token'])
         
+        # Reserve ticket availability (atomic, so concurrent checkouts cannot oversell)
+        if availability:
+            reserved = await reserve_tickets(db, order_data.visit_date, total_quantity, entry_slot)
+            if not reserved:
+                raise HTTPException(status_code=400, detail='Ingressos esgotados para esta data ou horário')
+        
         # Create order in database with unique ticket code
         order_id = f"ORDER-{uuid.uuid4().hex[:8].upper()}"
-        ticket_code = f"TKT-{uuid.uuid4().hex[:12].upper()}"
+        ticket_code = new_ticket_code()
         
-        order_dict = order_data.dict()
+        account = await db.customers.find_one({'email': order_data.customer.get('email')}, {'_id': 1})
+        order_dict = new_order_document(order_data.dict(), account['_id'] if account else None)
         order_dict['order_id'] = order_id
         order_dict['ticket_code'] = ticket_code
+        order_dict['entry_slot'] = entry_slot
         order_dict['payment_status'] = 'pending'
-        order_dict['validated'] = False
-        order_dict['created_at'] = datetime.utcnow()
-        order_dict['updated_at'] = datetime.utcnow()
         
         result = await db.orders.insert_one(order_dict)
-        
-        # Update ticket availability
-        if availability:
-            total_quantity = sum(item['quantity'] for item in order_data.items)
-            await db.ticket_availability.update_one(
-                {'date': order_data.visit_date},
-                {'$inc': {'tickets_sold': total_quantity}}
-            )
+        await bump(db, total_orders=1)
         
         # Get ticket names
         ticket_items = []
@@ -278,6 +315,7 @@ async def create_payment_preference(
             {'$set': {'mercado_pago_preference_id': preference['id']}}
         )
         
+        checkouts.inc('created')
         return {
             'order_id': order_id,
             'preference_id': preference['id'],
@@ -285,8 +323,22 @@ async def create_payment_preference(
             'sandbox_init_point': preference.get('sandbox_init_point', preference['init_point'])
         }
         
+    except HTTPException:
+        checkouts.inc('rejected')
+        if reserved:
+            await release_tickets(db, order_data.visit_date, total_quantity, entry_slot)
+        raise
     except Exception as e:
-        print(f"Error creating payment preference: {str(e)}")
+        checkouts.inc('error')
+        if reserved:
+            await release_tickets(db, order_data.visit_date, total_quantity, entry_slot)
+            if result:
+                # The order never reached Mercado Pago, so it no longer holds tickets
+                await db.orders.update_one(
+                    {'_id': result.inserted_id},
+                    {'$set': {'payment_status': 'cancelled', 'updated_at': datetime.utcnow()}}
+                )
+        logger.exception("Error creating payment preference")
         raise HTTPException(status_code=500, detail=f'Erro ao criar preferência de pagamento: {str(e)}')
 
 # ============= MERCADO PAGO WEBHOOK =============
@@ -306,6 +358,7 @@ async def mercadopago_webhook(
             # Get Mercado Pago config
             config = await db.mercadopago_config.find_one({})
             if not config:
+                webhooks.inc('no_config')
                 return {'status': 'error', 'message': 'Config not found'}
             
             import mercadopago
@@ -326,19 +379,33 @@ async def mercadopago_webhook(
                     'refunded': 'refunded'
                 }
                 
-                await db.orders.update_one(
+                payment_status = status_map.get(payment['status'], 'pending')
+                # Archived orders too, so a late refund or chargeback still reverses the rollups
+                before = await update_order(
+                    db,
                     {'order_id': order_id},
                     {
                         '$set': {
-                            'payment_status': status_map.get(payment['status'], 'pending'),
+                            'payment_status': payment_status,
                             'payment_id': str(payment_id),
                             'updated_at': datetime.utcnow()
                         }
-                    }
+                    },
+                    projection=ROLLUP_PROJECTION,
+                    return_document=ReturnDocument.BEFORE
                 )
+                # The document as it was tells whether this webhook moved it into or out of approved
+                if before:
+                    await apply_order(db, before, approval_change(before.get('payment_status'), payment_status))
+                webhooks.inc(payment_status)
+            else:
+                webhooks.inc('no_reference')
+        else:
+            webhooks.inc('ignored')
         
         return {'status': 'success'}
         
     except Exception as e:
-        print(f"Webhook error: {str(e)}")
+        webhooks.inc('error')
+        logger.exception("Webhook error")
         return {'status': 'error', 'message': str(e)}
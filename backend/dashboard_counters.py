@@ -0,0 +1,80 @@
+from datetime import datetime
+from archive import archive_collections
+import asyncio
+import logging
+import os
+
+DASHBOARD_RECONCILE_SECONDS = float(os.getenv('DASHBOARD_RECONCILE_SECONDS', '3600'))
+COUNTERS_ID = 'dashboard'
+
+# Counter name -> (collection, filter) it mirrors
+COUNTED = {
+    'total_attractions': ('attractions', {'is_active': True}),
+    'total_tickets': ('tickets', {'is_active': True}),
+    'total_orders': ('orders', {}),
+    'total_contacts': ('contacts', {}),
+    'new_contacts': ('contacts', {'status': 'new'}),
+}
+
+RECENT_ORDER_PROJECTION = {
+    'order_id': 1, 'customer.name': 1, 'customer.email': 1, 'total_amount': 1,
+    'payment_status': 1, 'visit_date': 1, 'created_at': 1
+}
+
+logger = logging.getLogger(__name__)
+
+async def bump(db, **deltas):
+    """Atomically apply counter deltas, e.g. bump(db, total_orders=1)."""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    await db.counters.update_one(
+        {'_id': COUNTERS_ID},
+        {'$inc': deltas, '$set': {'updated_at': datetime.utcnow()}},
+        upsert=True
+    )
+
+def active_delta(before: dict, after_active) -> int:
+    """+1/-1/0 for an is_active change, given the document as it was before the write."""
+    if before is None or after_active is None:
+        return 0
+    return int(bool(after_active)) - int(bool(before.get('is_active')))
+
+async def reconcile(db) -> dict:
+    """Recount every counter from its collection and overwrite the document.
+
+    Writes landing between a count and the $set can be off by one until the
+    next pass; the write paths keep the counters exact the rest of the time.
+    """
+    counts = {}
+    for name, (collection, query) in COUNTED.items():
+        counts[name] = await db[collection].count_documents(query)
+    # Archiving moves orders out of `orders`; the total still counts them
+    for name in await archive_collections(db):
+        counts['total_orders'] += await db[name].estimated_document_count()
+    previous = await db.counters.find_one({'_id': COUNTERS_ID}) or {}
+    drift = {name: value - previous.get(name, 0) for name, value in counts.items() if value != previous.get(name, 0)}
+    await db.counters.update_one(
+        {'_id': COUNTERS_ID},
+        {'$set': {**counts, 'updated_at': datetime.utcnow(), 'reconciled_at': datetime.utcnow()}},
+        upsert=True
+    )
+    if drift and previous:
+        logger.warning('Dashboard counters drifted', extra={'drift': drift})
+    return {'counters': counts, 'drift': drift}
+
+async def ensure_counters(db):
+    if await db.counters.find_one({'_id': COUNTERS_ID}, {'_id': 1}) is None:
+        await reconcile(db)
+
+async def reconcile_forever(db):
+    while True:
+        await asyncio.sleep(DASHBOARD_RECONCILE_SECONDS)
+        try:
+            await reconcile(db)
+        except Exception:
+            logger.exception('Dashboard counter reconciliation failed')
+
+async def read_counters(db) -> dict:
+    document = await db.counters.find_one({'_id': COUNTERS_ID}) or {}
+    return {name: document.get(name, 0) for name in COUNTED}
@@ -0,0 +1,76 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from auth import get_current_admin_user
+from scan_events import parse_range
+from archive import orders_everywhere
+from exports import (
+    EXPORT_BATCH_SIZE, EXPORT_MEDIA_TYPES, ORDER_COLUMNS, ORDER_PROJECTION,
+    CONTACT_COLUMNS, CONTACT_PROJECTION, export_chunks
+)
+from datetime import datetime
+
+router = APIRouter()
+
+async def get_database(request: Request) -> AsyncIOMotorDatabase:
+    return request.app.db
+
+def _created_range(start: str, end: str) -> dict:
+    """created_at filter for park-time dates or datetimes; either bound may be omitted."""
+    if not start and not end:
+        return {}
+    try:
+        low, high = parse_range(start or '2000-01-01', end or '2100-01-01')
+    except ValueError:
+        raise HTTPException(status_code=400, detail='Período inválido')
+    return {'created_at': {'$gte': low, '$lt': high}}
+
+def _export_response(request: Request, cursor, columns, fmt: str, name: str) -> StreamingResponse:
+    if fmt not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail='Formato inválido. Use csv ou ndjson')
+    compress = 'gzip' in request.headers.get('accept-encoding', '')
+    headers = {
+        'Content-Disposition': f'attachment; filename="{name}-{datetime.utcnow():%Y%m%d-%H%M%S}.{fmt}"'
+    }
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    return StreamingResponse(
+        export_chunks(cursor, columns, fmt, compress),
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers=headers
+    )
+
+# ============= EXPORTS (ADMIN) =============
+
+@router.get('/api/admin/exports/orders')
+async def export_orders(
+    request: Request,
+    format: str = 'csv',
+    start: str = None,
+    end: str = None,
+    payment_status: str = None,
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    query = _created_range(start, end)
+    if payment_status:
+        query['payment_status'] = payment_status
+    # Archived seasons included, so finance exports never lose an order
+    cursor = orders_everywhere(db, query, ORDER_PROJECTION, EXPORT_BATCH_SIZE)
+    return _export_response(request, cursor, ORDER_COLUMNS, format, 'pedidos')
+
+@router.get('/api/admin/exports/contacts')
+async def export_contacts(
+    request: Request,
+    format: str = 'csv',
+    start: str = None,
+    end: str = None,
+    status: str = None,
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    query = _created_range(start, end)
+    if status:
+        query['status'] = status
+    cursor = db.contacts.find(query, CONTACT_PROJECTION).sort('created_at', 1).batch_size(EXPORT_BATCH_SIZE)
+    return _export_response(request, cursor, CONTACT_COLUMNS, format, 'mensagens')
@@ -0,0 +1,103 @@
+from occupancy import order_quantity
+import csv
+import io
+import json
+import os
+import zlib
+
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '500'))
+# Rows are buffered up to this many bytes before a chunk is sent
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+EXPORT_MEDIA_TYPES = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+
+def _customer(field):
+    return lambda doc: (doc.get('customer') or {}).get(field)
+
+ORDER_COLUMNS = [
+    ('order_id', lambda doc: doc.get('order_id')),
+    ('ticket_code', lambda doc: doc.get('ticket_code')),
+    ('created_at', lambda doc: doc.get('created_at')),
+    ('visit_date', lambda doc: doc.get('visit_date')),
+    ('entry_slot', lambda doc: doc.get('entry_slot')),
+    ('payment_status', lambda doc: doc.get('payment_status')),
+    ('payment_id', lambda doc: doc.get('payment_id')),
+    ('customer_name', _customer('name')),
+    ('customer_email', _customer('email')),
+    ('customer_phone', _customer('phone')),
+    ('customer_document', _customer('document')),
+    ('quantity', order_quantity),
+    ('total_amount', lambda doc: doc.get('total_amount')),
+    ('validated', lambda doc: bool(doc.get('validated'))),
+    ('validated_at', lambda doc: doc.get('validated_at')),
+]
+
+ORDER_PROJECTION = {
+    '_id': 0, 'order_id': 1, 'ticket_code': 1, 'created_at': 1, 'visit_date': 1, 'entry_slot': 1,
+    'payment_status': 1, 'payment_id': 1, 'customer': 1, 'v': 1, 'items.quantity': 1, 'items.q': 1,
+    'total_amount': 1, 'validated': 1, 'validated_at': 1
+}
+
+CONTACT_COLUMNS = [
+    ('created_at', lambda doc: doc.get('created_at')),
+    ('name', lambda doc: doc.get('name')),
+    ('email', lambda doc: doc.get('email')),
+    ('phone', lambda doc: doc.get('phone')),
+    ('subject', lambda doc: doc.get('subject')),
+    ('message', lambda doc: doc.get('message')),
+    ('status', lambda doc: doc.get('status')),
+]
+
+CONTACT_PROJECTION = {'_id': 0, **{name: 1 for name, _ in CONTACT_COLUMNS}}
+
+def _cell(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    value = str(value)
+    # Spreadsheets run cells starting with these as formulas
+    if value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return value
+
+def _json_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+async def export_chunks(cursor, columns, fmt: str, compress: bool):
+    """Async generator of response chunks for a Motor cursor.
+
+    Only one cursor batch and one output chunk are held at a time, so memory
+    stays flat whatever the size of the export. With `compress` the chunks
+    are a single gzip stream.
+    """
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+
+    def take() -> bytes:
+        data = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        return gzip.compress(data) if gzip else data
+
+    if writer:
+        buffer.write('\ufeff')  # Lets Excel detect UTF-8
+        writer.writerow([name for name, _ in columns])
+
+    async for doc in cursor:
+        if writer:
+            writer.writerow([_cell(getter(doc)) for _, getter in columns])
+        else:
+            row = {name: _json_value(getter(doc)) for name, getter in columns}
+            buffer.write(json.dumps(row, ensure_ascii=False, default=str) + '\n')
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            chunk = take()
+            if chunk:
+                yield chunk
+
+    tail = take()
+    if gzip:
+        tail += gzip.flush()
+    if tail:
+        yield tail
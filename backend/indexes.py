@@ -0,0 +1,193 @@
+from pymongo import IndexModel, ASCENDING, DESCENDING, TEXT
+from pymongo.errors import OperationFailure
+from contact_inbox import CONTACT_RETENTION_DAYS, CONTACT_TEXT_LANGUAGE
+import logging
+import os
+
+INDEX_SELF_CHECK = os.getenv('INDEX_SELF_CHECK', '1') == '1'
+INDEX_OPTIONS_CONFLICT = 85
+INDEX_KEY_SPECS_CONFLICT = 86
+INDEX_NOT_FOUND = 27
+
+logger = logging.getLogger(__name__)
+
+# Every index the application relies on, by collection. Applied on startup;
+# creating an index that already exists with the same spec is a no-op.
+# Names are left to MongoDB so they match indexes created before the registry.
+INDEXES = {
+    'orders': [
+        IndexModel('order_id', unique=True),
+        # Partial, so orders without a ticket code (none are written any more) never collide on null
+        IndexModel('ticket_code', unique=True, partialFilterExpression={'ticket_code': {'$type': 'string'}}),
+        IndexModel([('customer.email', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)]),
+        IndexModel([('created_at', DESCENDING), ('_id', DESCENDING)]),
+        IndexModel([('payment_status', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)]),
+        IndexModel([('customer.document', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)]),
+        IndexModel([('visit_date', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)]),
+    ],
+    'contacts': [
+        IndexModel([('created_at', DESCENDING), ('_id', DESCENDING)]),
+        IndexModel([('status', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)]),
+        IndexModel(
+            [('subject', TEXT), ('message', TEXT), ('name', TEXT)],
+            default_language=CONTACT_TEXT_LANGUAGE,
+            weights={'subject': 5, 'name': 3, 'message': 1}
+        ),
+    ] + ([
+        # Only closed (archived) messages carry resolved_at; 0 days disables the retention
+        IndexModel('resolved_at', expireAfterSeconds=CONTACT_RETENTION_DAYS * 24 * 60 * 60),
+    ] if CONTACT_RETENTION_DAYS > 0 else []),
+    'daily_sales': [
+        IndexModel([('visit_date', ASCENDING), ('sale_date', ASCENDING), ('ticket_id', ASCENDING)], unique=True),
+        IndexModel([('sale_date', ASCENDING)]),
+    ],
+    'faqs': [
+        IndexModel([('is_active', ASCENDING), ('order', ASCENDING), ('_id', ASCENDING)]),
+    ],
+    'ticket_availability': [
+        IndexModel('date', unique=True),
+    ],
+    'customers': [
+        IndexModel('email', unique=True),
+        IndexModel('document', unique=True),
+    ],
+    'staff_users': [
+        IndexModel('email', unique=True),
+    ],
+    'voucher_jobs': [
+        IndexModel('job_id', unique=True),
+    ],
+    'login_attempts': [
+        IndexModel('expires_at', expireAfterSeconds=0),
+    ],
+    'request_profiles': [
+        IndexModel('expires_at', expireAfterSeconds=0),
+        IndexModel('profile_id', unique=True),
+    ],
+}
+
+# Indexes that must not exist in the current configuration: (collection, name).
+# Turning retention off has to drop the TTL index, or it keeps deleting.
+DROPPED_INDEXES = [('contacts', 'resolved_at_1')] if CONTACT_RETENTION_DAYS <= 0 else []
+
+# Hot queries that must never scan a whole collection: (collection, filter, sort)
+CHECKED_QUERIES = [
+    ('orders', {'ticket_code': ''}, None),
+    ('orders', {'order_id': ''}, None),
+    ('orders', {'customer.email': ''}, {'created_at': -1, '_id': -1}),
+    ('orders', {}, {'created_at': -1, '_id': -1}),
+    ('orders', {'customer.document': ''}, {'created_at': -1, '_id': -1}),
+    ('orders', {'customer.email': {'$regex': '^abc'}}, {'created_at': -1, '_id': -1}),
+    ('orders', {'visit_date': ''}, {'created_at': -1, '_id': -1}),
+    ('contacts', {}, {'created_at': -1, '_id': -1}),
+    ('ticket_availability', {'date': ''}, None),
+    ('customers', {'email': ''}, None),
+    ('staff_users', {'email': ''}, None),
+]
+
+# Indexes this worker could not create at startup, by (collection, name)
+index_failures = {}
+
+async def _replace_index(db, collection: str, model: IndexModel):
+    # Same name, changed definition (e.g. made partial): rebuild it
+    await db[collection].drop_index(model.document['name'])
+    await db[collection].create_indexes([model])
+
+async def ensure_collection_indexes(db, collection: str, models: list):
+    """Create `models` on `collection`. A conflicting or unbuildable index is
+    logged, recorded in index_failures and skipped, so the app keeps serving."""
+    for model in models:
+        name = model.document['name']
+        try:
+            await db[collection].create_indexes([model])
+            index_failures.pop((collection, name), None)
+            continue
+        except OperationFailure as e:
+            if e.code in (INDEX_OPTIONS_CONFLICT, INDEX_KEY_SPECS_CONFLICT) and 'expireAfterSeconds' not in model.document:
+                try:
+                    await _replace_index(db, collection, model)
+                    index_failures.pop((collection, name), None)
+                    continue
+                except OperationFailure as replace_error:
+                    e = replace_error
+            elif e.code == INDEX_OPTIONS_CONFLICT and 'expireAfterSeconds' in model.document:
+                # A changed retention period is applied in place instead of rebuilding
+                try:
+                    await db.command('collMod', collection, index={
+                        'keyPattern': model.document['key'],
+                        'expireAfterSeconds': model.document['expireAfterSeconds']
+                    })
+                    index_failures.pop((collection, name), None)
+                    continue
+                except OperationFailure as collmod_error:
+                    e = collmod_error
+            index_failures[(collection, name)] = str(e)
+            if model.document.get('unique'):
+                # Usually legacy duplicates: the write paths still check before
+                # inserting, but nothing enforces uniqueness until they are merged
+                logger.critical(
+                    'Could not create unique index',
+                    extra={'collection': collection, 'index': name, 'error': str(e)}
+                )
+            else:
+                logger.error(
+                    'Could not create index',
+                    extra={'collection': collection, 'index': name, 'error': str(e)}
+                )
+
+async def ensure_indexes(db):
+    """Apply the registry on startup. Failures are logged and reported by
+    index_report(); they never stop the app from starting."""
+    for collection, models in INDEXES.items():
+        await ensure_collection_indexes(db, collection, models)
+    for collection, name in DROPPED_INDEXES:
+        try:
+            await db[collection].drop_index(name)
+            logger.info('Dropped index', extra={'collection': collection, 'index': name})
+        except OperationFailure as e:
+            if e.code != INDEX_NOT_FOUND:
+                logger.error('Could not drop index', extra={'collection': collection, 'index': name, 'error': str(e)})
+
+async def index_report(db) -> dict:
+    """Registry indexes missing from the database, read live so the answer
+    does not depend on which worker serves the request."""
+    missing = []
+    for collection, models in INDEXES.items():
+        existing = {index['name'] async for index in db[collection].list_indexes()}
+        for model in models:
+            name = model.document['name']
+            if name not in existing:
+                missing.append({
+                    'collection': collection,
+                    'index': name,
+                    'unique': bool(model.document.get('unique')),
+                    'error': index_failures.get((collection, name))
+                })
+    return {'healthy': not missing, 'missing': missing}
+
+def _stages(plan: dict):
+    yield plan.get('stage')
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get('inputStages', []):
+        yield from _stages(child)
+
+async def check_query_plans(db):
+    """Warn about registered hot queries whose winning plan is a COLLSCAN."""
+    if not INDEX_SELF_CHECK:
+        return
+    for collection, query, sort in CHECKED_QUERIES:
+        command = {'find': collection, 'filter': query}
+        if sort:
+            command['sort'] = sort
+        try:
+            explained = await db.command('explain', command, verbosity='queryPlanner')
+        except OperationFailure as e:
+            logger.warning('Could not explain query', extra={'collection': collection, 'error': str(e)})
+            continue
+        if 'COLLSCAN' in _stages(explained['queryPlanner']['winningPlan']):
+            logger.warning(
+                'Query plan uses a collection scan',
+                extra={'collection': collection, 'filter': list(query), 'sort': list(sort or {})}
+            )
@@ -0,0 +1,171 @@
+from metrics import registry
+import json
+import math
+import os
+import time
+
+# Hard ceiling on requests in flight across all groups; Motor's default pool has 100 connections
+MAX_IN_FLIGHT = int(os.getenv('MAX_IN_FLIGHT', '100'))
+LOAD_SHED_RETRY_AFTER_SECONDS = int(os.getenv('LOAD_SHED_RETRY_AFTER_SECONDS', '2'))
+
+# Long-lived streams would hold a slot for their whole life and skew latency
+UNLIMITED_PATHS = {'/api/health', '/api/admin/occupancy/stream'}
+# bcrypt alone takes BCRYPT_TARGET_MS, so logins get their own group instead of
+# pulling the latency signal of the group their prefix belongs to
+LOGIN_PATHS = {'/api/staff/login', '/api/auth/login', '/api/customers/login'}
+
+shed_requests = registry.counter('load_shed_requests_total', 'Requests rejected by the concurrency limiter', ('group',))
+
+class AIMDLimit:
+    """In-flight limit for one route group, adapted from observed latency.
+
+    Every request answered within the target latency while the limit is
+    actually in use adds 1/limit (about +1 per round of requests). A request
+    slower than the target cuts the limit by `backoff`, at most once per
+    target interval so a burst of slow completions counts as one signal.
+    """
+
+    def __init__(self, name: str, priority: int, share: float, target_seconds: float,
+                 initial: int, min_limit: int, max_limit: int, backoff: float = 0.8):
+        self.name = name
+        self.priority = priority
+        self.share = share
+        self.target = target_seconds
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.in_flight = 0
+        self.rejected = 0
+        self.latency_ewma = None
+        self._last_decrease = 0.0
+
+    def on_complete(self, latency: float, in_flight: int):
+        self.latency_ewma = latency if self.latency_ewma is None else 0.9 * self.latency_ewma + 0.1 * latency
+        now = time.monotonic()
+        if latency > self.target:
+            if now - self._last_decrease >= self.target:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+        elif in_flight * 2 >= self.limit:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def stats(self) -> dict:
+        return {
+            'priority': self.priority,
+            'limit': math.floor(self.limit),
+            'in_flight': self.in_flight,
+            'rejected': self.rejected,
+            'target_ms': self.target * 1000,
+            'latency_ewma_ms': round(self.latency_ewma * 1000, 1) if self.latency_ewma is not None else None
+        }
+
+class ConcurrencyLimiter:
+    """Per-group adaptive limits under one shared, priority-aware ceiling.
+
+    A group only gets `share` of the global ceiling, so when every group is
+    busy the lower-priority ones are shed first and gate scanning keeps the
+    headroom reserved above them.
+    """
+
+    def __init__(self, max_in_flight: int, groups: list):
+        self.max_in_flight = max_in_flight
+        self.groups = {group.name: group for group in groups}
+        self.in_flight = 0
+
+    def group_for(self, path: str) -> AIMDLimit:
+        if path in LOGIN_PATHS:
+            return self.groups['login']
+        if path.startswith('/api/staff/'):
+            return self.groups['staff']
+        if path.startswith(('/api/admin/', '/api/auth/', '/api/upload')):
+            return self.groups['admin']
+        if path.startswith(('/api/create-payment-preference', '/api/customers/', '/api/webhooks/', '/api/orders')):
+            return self.groups['checkout']
+        return self.groups['public']
+
+    def try_acquire(self, group: AIMDLimit) -> bool:
+        if group.in_flight >= math.floor(group.limit) or self.in_flight >= self.max_in_flight * group.share:
+            group.rejected += 1
+            shed_requests.inc(group.name)
+            return False
+        group.in_flight += 1
+        self.in_flight += 1
+        return True
+
+    def release(self, group: AIMDLimit, latency: float):
+        group.on_complete(latency, group.in_flight)
+        group.in_flight -= 1
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            'max_in_flight': self.max_in_flight,
+            'in_flight': self.in_flight,
+            'groups': {name: group.stats() for name, group in self.groups.items()}
+        }
+
+concurrency_limiter = ConcurrencyLimiter(MAX_IN_FLIGHT, [
+    AIMDLimit('staff', priority=0, share=1.0, target_seconds=0.3, initial=20, min_limit=5, max_limit=100),
+    AIMDLimit('checkout', priority=1, share=0.9, target_seconds=2.0, initial=20, min_limit=2, max_limit=80),
+    AIMDLimit('admin', priority=2, share=0.8, target_seconds=1.0, initial=10, min_limit=2, max_limit=40),
+    AIMDLimit('public', priority=3, share=0.7, target_seconds=0.5, initial=40, min_limit=4, max_limit=100),
+    AIMDLimit('login', priority=4, share=0.6, target_seconds=1.5, initial=10, min_limit=2, max_limit=40),
+])
+
+_REJECTION_BODY = json.dumps({'detail': 'Servidor sobrecarregado. Tente novamente em instantes.'}).encode()
+
+class LoadSheddingMiddleware:
+    """Pure ASGI middleware answering 503 right away once a group is at its limit.
+
+    Latency is measured up to the response start, which is what backend
+    pressure shows up in; the slot is held until the body is sent.
+    """
+
+    def __init__(self, app, limiter: ConcurrencyLimiter = concurrency_limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] in UNLIMITED_PATHS or scope['method'] == 'OPTIONS':
+            await self.app(scope, receive, send)
+            return
+
+        group = self.limiter.group_for(scope['path'])
+        if not self.limiter.try_acquire(group):
+            await send({
+                'type': 'http.response.start',
+                'status': 503,
+                'headers': [
+                    (b'content-type', b'application/json'),
+                    (b'content-length', str(len(_REJECTION_BODY)).encode()),
+                    (b'retry-after', str(LOAD_SHED_RETRY_AFTER_SECONDS).encode())
+                ]
+            })
+            await send({'type': 'http.response.body', 'body': _REJECTION_BODY})
+            return
+
+        started_at = time.perf_counter()
+        latency = None
+
+        async def send_wrapper(message):
+            nonlocal latency
+            if message['type'] == 'http.response.start':
+                latency = time.perf_counter() - started_at
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.limiter.release(group, latency if latency is not None else time.perf_counter() - started_at)
+
+registry.callback_gauge(
+    'concurrency_limit', 'Current adaptive in-flight limit by route group',
+    lambda: {(name,): math.floor(group.limit) for name, group in concurrency_limiter.groups.items()},
+    ('group',)
+)
+registry.callback_gauge(
+    'concurrency_in_flight', 'Requests holding a concurrency slot by route group',
+    lambda: {(name,): group.in_flight for name, group in concurrency_limiter.groups.items()},
+    ('group',)
+)
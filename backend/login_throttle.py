@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+from fastapi import HTTPException, Request, status
+from pymongo import ReturnDocument
+import math
+import os
+import time
+
+LOGIN_WINDOW_SECONDS = int(os.getenv('LOGIN_WINDOW_SECONDS', '900'))
+LOGIN_MAX_FAILURES_ACCOUNT = int(os.getenv('LOGIN_MAX_FAILURES_ACCOUNT', '5'))
+LOGIN_MAX_FAILURES_IP = int(os.getenv('LOGIN_MAX_FAILURES_IP', '20'))
+LOGIN_BACKOFF_BASE_SECONDS = int(os.getenv('LOGIN_BACKOFF_BASE_SECONDS', '30'))
+LOGIN_BACKOFF_MAX_SECONDS = int(os.getenv('LOGIN_BACKOFF_MAX_SECONDS', '3600'))
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', '1'))
+
+# How long a "not blocked" answer from Mongo is trusted before asking again
+FRONT_CACHE_SECONDS = 2
+FRONT_CACHE_MAX_KEYS = 10000
+
+def client_ip(request: Request) -> str:
+    forwarded = request.headers.get('X-Forwarded-For')
+    if forwarded and TRUSTED_PROXY_HOPS > 0:
+        hops = [hop.strip() for hop in forwarded.split(',')]
+        return hops[max(0, len(hops) - TRUSTED_PROXY_HOPS)]
+    return request.client.host if request.client else 'unknown'
+
+class LoginThrottle:
+    """Sliding-window login failure limits per IP and per account.
+
+    State lives in the `login_attempts` collection so every worker sees the
+    same blocks; each worker keeps blocks (and recent "not blocked" answers)
+    in memory so attack traffic is turned away before Mongo or bcrypt.
+    """
+
+    def __init__(self):
+        self._blocked_until = {}
+        self._checked_at = {}
+
+    @staticmethod
+    def _keys(ip: str, account: str):
+        return [(f'ip:{ip}', LOGIN_MAX_FAILURES_IP), (f'account:{account}', LOGIN_MAX_FAILURES_ACCOUNT)]
+
+    def _prune(self, now: datetime):
+        if len(self._blocked_until) > FRONT_CACHE_MAX_KEYS:
+            self._blocked_until = {k: v for k, v in self._blocked_until.items() if v > now}
+        if len(self._checked_at) > FRONT_CACHE_MAX_KEYS:
+            self._checked_at = {}
+
+    @staticmethod
+    def _reject(blocked_until: datetime, now: datetime):
+        retry_after = max(1, math.ceil((blocked_until - now).total_seconds()))
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail='Muitas tentativas de login. Tente novamente mais tarde.',
+            headers={'Retry-After': str(retry_after)}
+        )
+
+    async def check(self, db, ip: str, account: str):
+        now = datetime.utcnow()
+        keys = [key for key, _ in self._keys(ip, account)]
+        for key in keys:
+            blocked_until = self._blocked_until.get(key)
+            if blocked_until and blocked_until > now:
+                self._reject(blocked_until, now)
+
+        fresh_after = time.monotonic() - FRONT_CACHE_SECONDS
+        if all(self._checked_at.get(key, 0) > fresh_after for key in keys):
+            return
+
+        self._prune(now)
+        docs = await db.login_attempts.find(
+            {'_id': {'$in': keys}, 'blocked_until': {'$gt': now}},
+            {'blocked_until': 1}
+        ).to_list(len(keys))
+        checked_at = time.monotonic()
+        for key in keys:
+            self._checked_at[key] = checked_at
+        for doc in docs:
+            self._blocked_until[doc['_id']] = doc['blocked_until']
+        if docs:
+            self._reject(max(doc['blocked_until'] for doc in docs), now)
+
+    async def record_failure(self, db, ip: str, account: str):
+        now = datetime.utcnow()
+        window_start = now - timedelta(seconds=LOGIN_WINDOW_SECONDS)
+        expires_at = now + timedelta(seconds=LOGIN_WINDOW_SECONDS + LOGIN_BACKOFF_MAX_SECONDS)
+        for key, limit in self._keys(ip, account):
+            doc = await db.login_attempts.find_one_and_update(
+                {'_id': key},
+                {
+                    '$push': {'failures': {'$each': [now], '$slice': -(limit * 4)}},
+                    '$set': {'expires_at': expires_at}
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            excess = sum(1 for failed_at in doc['failures'] if failed_at > window_start) - limit
+            if excess < 0:
+                continue
+            # Each failure past the limit doubles the lockout
+            delay = min(LOGIN_BACKOFF_BASE_SECONDS * 2 ** excess, LOGIN_BACKOFF_MAX_SECONDS)
+            blocked_until = now + timedelta(seconds=delay)
+            await db.login_attempts.update_one({'_id': key}, {'$set': {'blocked_until': blocked_until}})
+            self._blocked_until[key] = blocked_until
+
+    async def record_success(self, db, account: str):
+        key = f'account:{account}'
+        self._blocked_until.pop(key, None)
+        await db.login_attempts.delete_one({'_id': key})
+
+login_throttle = LoginThrottle()
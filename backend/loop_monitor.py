@@ -0,0 +1,131 @@
+from collections import Counter, deque
+from request_context import task_scopes, route_template
+from metrics import registry
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+LOOP_LAG_INTERVAL_MS = float(os.getenv('LOOP_LAG_INTERVAL_MS', '100'))
+LOOP_LAG_THRESHOLD_MS = float(os.getenv('LOOP_LAG_THRESHOLD_MS', '100'))
+LOOP_LAG_LOG_INTERVAL_SECONDS = float(os.getenv('LOOP_LAG_LOG_INTERVAL_SECONDS', '30'))
+STACK_DEPTH = 15
+
+logger = logging.getLogger(__name__)
+
+class LoopMonitor:
+    """Measures event-loop lag and catches the code that blocks it.
+
+    A heartbeat coroutine sleeps for a fixed interval and records how late
+    it wakes up. A watchdog thread watches that heartbeat; when it stalls
+    past the threshold, the thread grabs the loop thread's current stack
+    and the task's route while the blocking call is still running.
+    """
+
+    def __init__(self, interval_ms: float, threshold_ms: float):
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self._lags_ms = deque(maxlen=600)
+        self.max_lag_ms = 0.0
+        self.blocked_by_route = Counter()
+        self.recent_blocks = deque(maxlen=20)
+        self._last_logged = {}
+        self._loop = None
+        self._loop_thread_id = None
+        self._beat = time.perf_counter()
+        self._captured_beat = None
+        self._stop = threading.Event()
+        self._task = None
+        self._thread = None
+
+    # ----- heartbeat (event loop) -----
+
+    async def _heartbeat(self):
+        while True:
+            started_at = time.perf_counter()
+            self._beat = started_at
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (time.perf_counter() - started_at - self.interval) * 1000)
+            self._lags_ms.append(lag_ms)
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+
+    # ----- watchdog (thread) -----
+
+    def _watchdog(self):
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._beat
+            stalled_for = time.perf_counter() - beat - self.interval
+            if stalled_for > self.threshold and self._captured_beat != beat:
+                self._captured_beat = beat  # One capture per stall
+                self._capture(stalled_for)
+
+    def _capture(self, stalled_for: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = traceback.format_list(traceback.extract_stack(frame)[-STACK_DEPTH:])
+        task = asyncio.current_task(self._loop)
+        route = route_template(task_scopes.get(task)) if task else 'loop'
+
+        self.blocked_by_route[route] += 1
+        self.recent_blocks.append({
+            'route': route,
+            'stalled_ms': round(stalled_for * 1000, 1),
+            'at': time.time(),
+            'stack': stack
+        })
+
+        now = time.monotonic()
+        if now - self._last_logged.get(route, 0) >= LOOP_LAG_LOG_INTERVAL_SECONDS:
+            self._last_logged[route] = now
+            logger.warning(
+                'Event loop blocked for %.0f ms in %s\n%s',
+                stalled_for * 1000, route, ''.join(stack)
+            )
+
+    # ----- lifecycle -----
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.perf_counter()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watchdog, name='loop-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    @property
+    def last_lag_ms(self):
+        return self._lags_ms[-1] if self._lags_ms else None
+
+    def stats(self) -> dict:
+        ordered = sorted(self._lags_ms)
+        return {
+            'interval_ms': self.interval * 1000,
+            'threshold_ms': self.threshold * 1000,
+            'current_lag_ms': round(self.last_lag_ms, 2) if self._lags_ms else None,
+            'p95_lag_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2) if ordered else None,
+            'max_lag_ms': round(self.max_lag_ms, 2),
+            'blocked_by_route': dict(self.blocked_by_route),
+            'recent_blocks': list(self.recent_blocks)
+        }
+
+loop_monitor = LoopMonitor(LOOP_LAG_INTERVAL_MS, LOOP_LAG_THRESHOLD_MS)
+
+registry.callback_gauge(
+    'event_loop_lag_seconds', 'Most recent event-loop lag sample',
+    lambda: {(): loop_monitor.last_lag_ms / 1000 if loop_monitor.last_lag_ms is not None else None}
+)
+registry.callback_gauge(
+    'event_loop_blocked', 'Event-loop stalls past the threshold, by route',
+    lambda: {(route,): count for route, count in loop_monitor.blocked_by_route.items()},
+    ('route',)
+)
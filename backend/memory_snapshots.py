@@ -0,0 +1,213 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import asyncio
+import logging
+import os
+import socket
+import sys
+import tracemalloc
+import uuid
+
+MAX_SNAPSHOTS = 5
+# Line-level sites kept per snapshot, largest first; keeps the document small
+MAX_LINE_SITES = 5000
+# The tracing worker renews its lease and picks up snapshot requests this often
+LEASE_MINUTES = 5
+LEASE_POLL_SECONDS = 5
+GROUPINGS = ('module', 'package', 'line')
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+logger = logging.getLogger(__name__)
+
+class MemoryTracingBusy(Exception):
+    pass
+
+class MemoryTracingInactive(Exception):
+    pass
+
+def _module_index() -> dict:
+    index = {}
+    for name, module in list(sys.modules.items()):
+        filename = getattr(module, '__file__', None)
+        if filename:
+            index[filename] = name
+    return index
+
+def _group_key(filename: str, lineno: int, group_by: str, modules: dict) -> str:
+    if group_by == 'line':
+        return f'{filename}:{lineno}'
+    module = modules.get(filename, filename)
+    if group_by == 'package':
+        return module.split('.')[0]
+    return module
+
+def _grouped(statistics, group_by: str) -> dict:
+    modules = _module_index()
+    groups = defaultdict(lambda: [0, 0])
+    for stat in statistics:
+        frame = stat.traceback[0]
+        group = groups[_group_key(frame.filename, frame.lineno, group_by, modules)]
+        group[0] += stat.size
+        group[1] += stat.count
+    return groups
+
+def _rows(groups: dict, limit: int = None) -> list:
+    rows = sorted(groups.items(), key=lambda item: -item[1][0])[:limit]
+    return [{'site': site, 'size_bytes': size, 'count': count} for site, (size, count) in rows]
+
+class MemorySnapshots:
+    """tracemalloc control, usable from any worker.
+
+    Tracing costs memory and CPU on every allocation, so it is off until an
+    admin starts it, and a lease in Mongo keeps it to one worker at a time.
+    Snapshot requests are queued on the lease for that worker to pick up,
+    and snapshots are stored in Mongo already grouped, so any worker can
+    list, compare and show them. Grouping runs on a thread, not the event loop.
+    """
+
+    def __init__(self):
+        self._watch_task = None
+
+    async def start(self, db, frames: int):
+        now = datetime.utcnow()
+        try:
+            await db.runtime_leases.update_one(
+                {'_id': 'tracemalloc', '$or': [{'worker': WORKER_ID}, {'expires_at': {'$lt': now}}]},
+                {
+                    '$set': {'worker': WORKER_ID, 'expires_at': now + timedelta(minutes=LEASE_MINUTES)},
+                    '$setOnInsert': {'pending_snapshots': []}
+                },
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # The upsert collided with a live lease held by another worker
+            lease = await db.runtime_leases.find_one({'_id': 'tracemalloc'})
+            raise MemoryTracingBusy(lease['worker'])
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.create_task(self._watch_lease(db))
+
+    async def _watch_lease(self, db):
+        while tracemalloc.is_tracing():
+            await asyncio.sleep(LEASE_POLL_SECONDS)
+            try:
+                # Renews the lease and reads the queued snapshot requests in one write
+                lease = await db.runtime_leases.find_one_and_update(
+                    {'_id': 'tracemalloc', 'worker': WORKER_ID},
+                    {'$set': {'expires_at': datetime.utcnow() + timedelta(minutes=LEASE_MINUTES)}},
+                    return_document=ReturnDocument.AFTER
+                )
+            except Exception:
+                logger.exception('Could not renew the tracemalloc lease')
+                continue
+            if lease is None:
+                # Stopped from another worker, or renewals failed until it expired
+                logger.warning('tracemalloc lease lost, stopping tracing', extra={'worker': WORKER_ID})
+                tracemalloc.stop()
+                return
+            for snapshot_id in lease.get('pending_snapshots', []):
+                try:
+                    try:
+                        await self.take(db, snapshot_id)
+                    finally:
+                        # Dequeued only once stored, so the id never looks unknown in between
+                        await db.runtime_leases.update_one({'_id': 'tracemalloc'}, {'$pull': {'pending_snapshots': snapshot_id}})
+                except Exception:
+                    logger.exception('Could not take a requested memory snapshot')
+
+    async def stop(self, db):
+        # Whichever worker traces sees its lease gone within LEASE_POLL_SECONDS
+        await db.runtime_leases.delete_one({'_id': 'tracemalloc'})
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    async def _lease(self, db):
+        return await db.runtime_leases.find_one({'_id': 'tracemalloc', 'expires_at': {'$gte': datetime.utcnow()}})
+
+    async def status(self, db) -> dict:
+        tracing = tracemalloc.is_tracing()
+        current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        lease = await self._lease(db) or {}
+        snapshots = await db.memory_snapshots.find({}, {'groups': 0}).sort('taken_at', -1).to_list(MAX_SNAPSHOTS)
+        return {
+            'worker': WORKER_ID,
+            'tracing': tracing,
+            'tracing_worker': lease.get('worker'),
+            'traced_bytes': current,
+            'peak_bytes': peak,
+            'pending_snapshots': lease.get('pending_snapshots', []),
+            'snapshots': [
+                {'snapshot_id': snapshot['_id'], 'worker': snapshot['worker'], 'taken_at': snapshot['taken_at']}
+                for snapshot in snapshots
+            ]
+        }
+
+    async def request(self, db) -> dict:
+        """Take a snapshot here when this worker traces, else queue it for the
+        worker holding the lease."""
+        snapshot_id = uuid.uuid4().hex[:12]
+        if tracemalloc.is_tracing():
+            await self.take(db, snapshot_id)
+            return {'snapshot_id': snapshot_id, 'pending': False}
+        result = await db.runtime_leases.update_one(
+            {'_id': 'tracemalloc', 'expires_at': {'$gte': datetime.utcnow()}},
+            {'$push': {'pending_snapshots': snapshot_id}}
+        )
+        if result.matched_count == 0:
+            raise MemoryTracingInactive()
+        return {'snapshot_id': snapshot_id, 'pending': True}
+
+    async def take(self, db, snapshot_id: str):
+        groups = await asyncio.to_thread(self._take_grouped)
+        await db.memory_snapshots.insert_one({
+            '_id': snapshot_id, 'worker': WORKER_ID, 'taken_at': datetime.utcnow(), 'groups': groups
+        })
+        old = await db.memory_snapshots.find({}, {'_id': 1}).sort('taken_at', -1).skip(MAX_SNAPSHOTS).to_list(None)
+        if old:
+            await db.memory_snapshots.delete_many({'_id': {'$in': [snapshot['_id'] for snapshot in old]}})
+
+    @staticmethod
+    def _take_grouped() -> dict:
+        statistics = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        )).statistics('lineno')
+        return {
+            group_by: _rows(_grouped(statistics, group_by), MAX_LINE_SITES if group_by == 'line' else None)
+            for group_by in GROUPINGS
+        }
+
+    async def get(self, db, snapshot_id: str):
+        return await db.memory_snapshots.find_one({'_id': snapshot_id})
+
+    @staticmethod
+    def top(snapshot: dict, group_by: str, limit: int) -> list:
+        return snapshot['groups'][group_by][:limit]
+
+    @staticmethod
+    def diff(base: dict, target: dict, group_by: str, limit: int) -> list:
+        # Line-level sites past MAX_LINE_SITES count as zero on the side that dropped them
+        before = {row['site']: row for row in base['groups'][group_by]}
+        after = {row['site']: row for row in target['groups'][group_by]}
+        empty = {'size_bytes': 0, 'count': 0}
+        rows = []
+        for site in set(before) | set(after):
+            old, new = before.get(site, empty), after.get(site, empty)
+            rows.append({
+                'site': site,
+                'size_bytes': new['size_bytes'],
+                'size_diff_bytes': new['size_bytes'] - old['size_bytes'],
+                'count_diff': new['count'] - old['count']
+            })
+        rows.sort(key=lambda row: -abs(row['size_diff_bytes']))
+        return rows[:limit]
+
+memory_snapshots = MemorySnapshots()
@@ -0,0 +1,174 @@
+from bisect import bisect_left
+from request_context import route_template
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Recording from the event loop needs no locks: each metric is a dict lookup
+# and an add on the hot path. Writers on other threads (the Mongo command
+# profiler) serialise among themselves, and rendering snapshots the dicts.
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def header(self) -> list:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        return self.header() + [
+            f'{self.name}{_format_labels(self.label_names, labels)} {value}'
+            for labels, value in list(self._values.items())
+        ]
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, *labels, value: float):
+        self._values[labels] = value
+
+    def dec(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+class CallbackGauge(_Metric):
+    """Gauge read from `callback()` at scrape time: {label values tuple: value}."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback, labels=()):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+
+    def render(self) -> list:
+        return self.header() + [
+            f'{self.name}{_format_labels(self.label_names, labels)} {value}'
+            for labels, value in self.callback().items() if value is not None
+        ]
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        # Non-cumulative per-bucket counts; cumulated when rendering
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list:
+        lines = self.header()
+        for labels, (counts, total, count) in list(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                bucket_labels = _format_labels(self.label_names, labels, 'le="%s"' % le)
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.label_names, labels)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.label_names, labels)} {count}')
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def callback_gauge(self, name, documentation, callback, labels=()) -> CallbackGauge:
+        return self.register(CallbackGauge(name, documentation, callback, labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+# ============= HTTP =============
+
+http_requests = registry.counter('http_requests_total', 'HTTP requests served', ('route', 'status'))
+http_request_duration = registry.histogram('http_request_duration_seconds', 'HTTP request latency', ('route',))
+http_in_flight = registry.gauge('http_requests_in_flight', 'HTTP requests being served')
+
+# ============= DOMAIN =============
+
+checkouts = registry.counter('acquapark_checkouts_total', 'Checkout attempts by outcome', ('outcome',))
+ticket_holds = registry.counter('acquapark_ticket_holds_total', 'Ticket availability holds by outcome', ('outcome',))
+webhooks = registry.counter('acquapark_webhooks_total', 'Mercado Pago webhook outcomes', ('outcome',))
+scans = registry.counter('acquapark_scans_total', 'Ticket scans by outcome and gate', ('outcome', 'gate'))
+
+def metric_route(scope) -> str:
+    # Unrouted paths (404s, scanners) would explode label cardinality
+    if scope.get('endpoint') is None:
+        return 'unmatched'
+    return route_template(scope)
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording count, latency and in-flight requests."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        http_in_flight.inc()
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = metric_route(scope)
+            http_request_duration.observe(time.perf_counter() - started_at, route)
+            http_requests.inc(route, status_code)
+            http_in_flight.dec()
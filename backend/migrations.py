@@ -0,0 +1,289 @@
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from datetime import datetime, timedelta
+from order_schema import v2_updates, new_ticket_code
+from order_search import normalize_cpf
+import asyncio
+import logging
+import os
+import socket
+import time
+
+MIGRATION_BATCH_SIZE = int(os.getenv('MIGRATION_BATCH_SIZE', '500'))
+MIGRATION_PAUSE_SECONDS = float(os.getenv('MIGRATION_PAUSE_SECONDS', '0.2'))
+# Share of wall time a migration may spend on its own batches; after a slow
+# batch it sleeps long enough to stay under it, so a loaded primary gets room.
+# Clamped to 0.05-1: 0 would mean never running at all
+MIGRATION_MAX_DUTY = min(1.0, max(0.05, float(os.getenv('MIGRATION_MAX_DUTY', '0.5'))))
+# A running migration that has not checkpointed for this long is considered dead
+STALE_AFTER = timedelta(minutes=5)
+MAX_RECORDED_CONFLICTS = 20
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+logger = logging.getLogger(__name__)
+
+class MigrationBusy(Exception):
+    pass
+
+class MigrationLeaseLost(Exception):
+    """Another worker took over the migration; this one must stop writing."""
+
+class Migration:
+    """An idempotent rewrite of the documents of one collection matching `query`.
+
+    `build(db, documents)` returns (_id, update) pairs for a batch of documents
+    read with `projection`. Updates are applied with `query` as part of their
+    filter, and a migrated document must stop matching it: that is what makes
+    a batch safe to repeat and the migration safe to run next to live writes.
+    """
+
+    def __init__(self, name: str, collection: str, query: dict, build, projection: dict = None, description: str = ''):
+        self.name = name
+        self.collection = collection
+        self.query = query
+        self.build = build
+        self.projection = projection
+        self.description = description
+
+# ============= MIGRATIONS =============
+
+async def _ticket_codes(db, orders: list) -> list:
+    # Orders written before every writer set a code; the unique index rejects the odd collision
+    return [(order['_id'], {'$set': {'ticket_code': new_ticket_code()}}) for order in orders]
+
+async def _validated_flags(db, orders: list) -> list:
+    return [(order['_id'], {'$set': {'validated': True}}) for order in orders]
+
+def _cpf_updates(field: str):
+    async def build(db, documents: list) -> list:
+        updates = []
+        for document in documents:
+            value = document
+            for part in field.split('.'):
+                value = (value or {}).get(part)
+            if normalize_cpf(value) != value:
+                updates.append((document['_id'], {'$set': {field: normalize_cpf(value)}}))
+        return updates
+    return build
+
+# Values normalize_cpf() can fix: 11 digits plus at least one separator. Others
+# (typos, foreign documents) must not match, or the migration never finishes.
+FIXABLE_CPF = {'$regex': r'^(?=.*\D)\D*(?:\d\D*){11}$'}
+
+# Applied in this order by run_pending()
+MIGRATIONS = [
+    Migration(
+        'orders_ticket_code', 'orders', {'ticket_code': {'$exists': False}}, _ticket_codes, {'_id': 1},
+        'Gera ticket_code para pedidos antigos'
+    ),
+    Migration(
+        'customers_document_digits', 'customers', {'document': FIXABLE_CPF},
+        _cpf_updates('document'), {'document': 1},
+        'Armazena o CPF dos clientes apenas com dígitos'
+    ),
+    Migration(
+        'orders_document_digits', 'orders', {'customer.document': FIXABLE_CPF},
+        _cpf_updates('customer.document'), {'customer.document': 1},
+        'Armazena o CPF dos pedidos apenas com dígitos'
+    ),
+    Migration(
+        'orders_validated', 'orders', {'validated_at': {'$ne': None}, 'validated': {'$ne': True}},
+        _validated_flags, {'_id': 1},
+        'Marca como validados os pedidos com validated_at'
+    ),
+    Migration(
+        'orders_v2', 'orders', {'v': {'$exists': False}}, v2_updates, {'customer.email': 1},
+        'Converte pedidos para o esquema compacto v2'
+    ),
+]
+
+MIGRATIONS_BY_NAME = {migration.name: migration for migration in MIGRATIONS}
+
+# ============= RUNNER =============
+
+def _pause(batch_seconds: float) -> float:
+    return max(MIGRATION_PAUSE_SECONDS, batch_seconds * (1 - MIGRATION_MAX_DUTY) / MIGRATION_MAX_DUTY)
+
+async def _read_batch(db, migration: Migration, last_id, batch_size: int) -> list:
+    query = {**migration.query, '_id': {'$gt': last_id}} if last_id is not None else migration.query
+    return await db[migration.collection].find(query, migration.projection).sort('_id', 1).limit(batch_size).to_list(batch_size)
+
+async def claim(db, migration: Migration) -> dict:
+    """Take the migration's lease, resuming from its checkpoint when a previous
+    run failed or died. Completed migrations run again from the start."""
+    now = datetime.utcnow()
+    previous = await db.migrations.find_one({'_id': migration.name}) or {}
+    resume = previous.get('status') == 'failed' or (
+        previous.get('status') == 'running' and previous['heartbeat_at'] < now - STALE_AFTER
+    )
+    if resume:
+        fields = {key: previous.get(key, 0) for key in ('processed', 'modified', 'conflicts')}
+        fields['last_id'] = previous.get('last_id')
+    else:
+        fields = {'last_id': None, 'processed': 0, 'modified': 0, 'conflicts': 0, 'started_at': now}
+    try:
+        await db.migrations.update_one(
+            {'_id': migration.name, '$or': [{'status': {'$ne': 'running'}}, {'heartbeat_at': {'$lt': now - STALE_AFTER}}]},
+            {
+                '$set': {
+                    **fields, 'collection': migration.collection, 'status': 'running',
+                    'worker': WORKER_ID, 'heartbeat_at': now, 'error': None
+                },
+                '$unset': {'finished_at': ''}
+            },
+            upsert=True
+        )
+    except DuplicateKeyError:
+        raise MigrationBusy(previous.get('worker'))
+    return {**fields, 'resumed': resume}
+
+async def _apply(db, migration: Migration, documents: list) -> tuple:
+    """Write one batch; returns (modified, ids rejected by a unique index)."""
+    updates = await migration.build(db, documents)
+    if not updates:
+        return 0, []
+    operations = [UpdateOne({**migration.query, '_id': _id}, update) for _id, update in updates]
+    try:
+        result = await db[migration.collection].bulk_write(operations, ordered=False)
+        return result.modified_count, []
+    except BulkWriteError as e:
+        # Unordered, so every other write of the batch went through
+        errors = e.details.get('writeErrors', [])
+        if any(error.get('code') != 11000 for error in errors):
+            raise
+        return e.details.get('nModified', 0), [updates[error['index']][0] for error in errors]
+
+async def _checkpoint(db, name: str, update: dict):
+    # Only while this worker still holds the lease; after a takeover, stop
+    # before writing another batch next to the new holder
+    result = await db.migrations.update_one({'_id': name, 'worker': WORKER_ID, 'status': 'running'}, update)
+    if result.matched_count == 0:
+        raise MigrationLeaseLost(name)
+
+async def run_migration(db, name: str, batch_size: int = MIGRATION_BATCH_SIZE, dry_run: bool = False, run: dict = None) -> dict:
+    """Run one migration in `_id` order, checkpointing after every batch.
+
+    A dry run writes nothing: it counts the matching documents, times reading
+    and preparing one batch and estimates the whole run from it (writes not
+    included, so the estimate is a lower bound). Pass `run` when the lease was
+    already taken with claim().
+    """
+    migration = MIGRATIONS_BY_NAME[name]
+    collection = db[migration.collection]
+
+    if dry_run:
+        pending = await collection.count_documents(migration.query)
+        started = time.monotonic()
+        sample = await _read_batch(db, migration, None, batch_size)
+        updates = await migration.build(db, sample) if sample else []
+        sample_seconds = time.monotonic() - started
+        batches = -(-pending // batch_size)
+        return {
+            'migration': name,
+            'collection': migration.collection,
+            'pending': pending,
+            'updates_in_first_batch': len(updates),
+            'batches': batches,
+            'estimated_seconds': round(batches * (sample_seconds + _pause(sample_seconds)), 1)
+        }
+
+    run = run or await claim(db, migration)
+    last_id, processed, modified, conflicts = run['last_id'], run['processed'], run['modified'], run['conflicts']
+    logger.info('Migration started', extra={'migration': name, 'resumed': run['resumed'], 'last_id': str(last_id)})
+
+    try:
+        while True:
+            started = time.monotonic()
+            documents = await _read_batch(db, migration, last_id, batch_size)
+            if not documents:
+                break
+            await _checkpoint(db, name, {'$set': {'heartbeat_at': datetime.utcnow()}})
+            changed, rejected = await _apply(db, migration, documents)
+            processed += len(documents)
+            modified += changed
+            conflicts += len(rejected)
+            last_id = documents[-1]['_id']
+            checkpoint = {'$set': {
+                'last_id': last_id, 'processed': processed, 'modified': modified,
+                'conflicts': conflicts, 'heartbeat_at': datetime.utcnow()
+            }}
+            if rejected:
+                # Left unmigrated for someone to merge by hand; they still match the query
+                checkpoint['$push'] = {'conflict_ids': {'$each': rejected, '$slice': -MAX_RECORDED_CONFLICTS}}
+                logger.warning('Migration writes rejected by a unique index', extra={'migration': name, 'count': len(rejected)})
+            await _checkpoint(db, name, checkpoint)
+            await asyncio.sleep(_pause(time.monotonic() - started))
+    except MigrationLeaseLost:
+        logger.error('Migration lease lost, stopping', extra={'migration': name, 'processed': processed})
+        raise
+    except Exception as e:
+        await db.migrations.update_one(
+            {'_id': name, 'worker': WORKER_ID, 'status': 'running'},
+            {'$set': {'status': 'failed', 'error': str(e), 'heartbeat_at': datetime.utcnow()}}
+        )
+        logger.exception('Migration failed', extra={'migration': name, 'processed': processed})
+        raise
+
+    await _checkpoint(db, name, {'$set': {
+        'status': 'completed', 'processed': processed, 'modified': modified, 'finished_at': datetime.utcnow()
+    }})
+    logger.info('Migration finished', extra={'migration': name, 'processed': processed, 'modified': modified})
+    return {'migration': name, 'processed': processed, 'modified': modified, 'conflicts': conflicts}
+
+async def run_pending(db, dry_run: bool = False) -> list:
+    """Every migration that has not completed, or dry-run reports for them."""
+    completed = {
+        state['_id'] async for state in db.migrations.find({'status': 'completed'}, {'_id': 1})
+    }
+    results = []
+    for migration in MIGRATIONS:
+        if migration.name not in completed:
+            results.append(await run_migration(db, migration.name, dry_run=dry_run))
+    return results
+
+async def migration_status(db) -> list:
+    states = {state['_id']: state async for state in db.migrations.find({})}
+    status = []
+    for migration in MIGRATIONS:
+        state = states.get(migration.name, {})
+        state.pop('_id', None)
+        if state.get('last_id') is not None:
+            state['last_id'] = str(state['last_id'])
+        state['conflict_ids'] = [str(_id) for _id in state.get('conflict_ids', [])]
+        status.append({
+            'name': migration.name,
+            'collection': migration.collection,
+            'description': migration.description,
+            'status': state.pop('status', 'pending'),
+            **state
+        })
+    return status
+
+if __name__ == '__main__':
+    # python migrations.py status
+    # python migrations.py dry-run [name ...]
+    # python migrations.py run [name ...]     (no names: every pending migration)
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+    from pathlib import Path
+    import sys
+
+    load_dotenv(Path(__file__).parent / '.env')
+
+    async def main():
+        command, names = (sys.argv[1:2] or ['status'])[0], sys.argv[2:]
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        db = client[os.environ['DB_NAME']]
+        try:
+            if command == 'status':
+                results = await migration_status(db)
+            elif names:
+                results = [await run_migration(db, name, dry_run=command == 'dry-run') for name in names]
+            else:
+                results = await run_pending(db, dry_run=command == 'dry-run')
+            for result in results:
+                print(result)
+        finally:
+            client.close()
+
+    asyncio.run(main())
@@ -214,6 +214,7 @@ class Order(BaseModel):
     items: List[dict]
     total_amount: float
     visit_date: str
+    entry_slot: Optional[str] = None  # HH:MM
     payment_status: str = 'pending'
     payment_id: Optional[str] = None
     mercado_pago_preference_id: Optional[str] = None
@@ -229,4 +230,11 @@ class OrderCreate(BaseModel):
     customer: dict
     items: List[dict]
     total_amount: float
-    visit_date: str
\ No newline at end of file
+    visit_date: str
+    entry_slot: Optional[str] = None
+
+class ProfilerSession(BaseModel):
+    routes: List[str] = []  # e.g. 'GET /api/admin/orders'
+    sample_percent: float = 0
+    duration_seconds: int = 300
+    max_profiles: int = 20
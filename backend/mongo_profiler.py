@@ -0,0 +1,147 @@
+from pymongo import monitoring
+from request_context import current_route
+from metrics import registry
+import json
+import logging
+import os
+import threading
+import time
+
+MONGO_SLOW_MS = float(os.getenv('MONGO_SLOW_MS', '100'))
+MONGO_SLOW_LOG_INTERVAL_SECONDS = float(os.getenv('MONGO_SLOW_LOG_INTERVAL_SECONDS', '10'))
+SHAPE_MAX_LENGTH = 300
+
+# Handshake and session housekeeping, not application queries
+IGNORED_COMMANDS = {'hello', 'ismaster', 'isMaster', 'ping', 'endSessions', 'saslStart', 'saslContinue', 'buildInfo', 'getMore', 'killCursors'}
+
+# Where each command keeps the document filter worth describing
+FILTER_FIELDS = {
+    'find': ('filter', 'sort', 'projection'),
+    'aggregate': ('pipeline',),
+    'count': ('query',),
+    'distinct': ('key', 'query'),
+    'findAndModify': ('query', 'sort'),
+}
+
+logger = logging.getLogger(__name__)
+
+def redact(value):
+    """Keep field names and operators, drop every literal value."""
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, list):
+        if value and all(isinstance(item, dict) for item in value):
+            return [redact(item) for item in value]
+        return '?'
+    return '?'
+
+def command_shape(command_name: str, command: dict) -> str:
+    if command_name in ('update', 'delete'):
+        statements = command.get('updates' if command_name == 'update' else 'deletes') or [{}]
+        shape = {'q': redact(statements[0].get('q', {}))}
+    elif command_name == 'distinct':
+        shape = {'key': command.get('key'), 'query': redact(command.get('query', {}))}
+    else:
+        shape = {field: redact(command[field]) for field in FILTER_FIELDS.get(command_name, ()) if field in command}
+    return json.dumps(shape, sort_keys=True, default=str)[:SHAPE_MAX_LENGTH]
+
+class CommandProfiler(monitoring.CommandListener):
+    """Per-collection command timings, slow-command log and route attribution.
+
+    Motor runs pymongo on executor threads (with the caller's contextvars),
+    so the callbacks below run off the event loop and share state under a lock.
+    """
+
+    def __init__(self, slow_ms: float):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._stats = {}
+        self._last_logged = {}
+        self.duration = registry.histogram(
+            'mongodb_command_duration_seconds', 'MongoDB command latency',
+            ('collection', 'command'),
+            buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+        )
+        self.slow_commands = registry.counter(
+            'mongodb_slow_commands_total', 'MongoDB commands above MONGO_SLOW_MS', ('collection', 'command')
+        )
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            return
+        key = (event.connection_id, event.request_id)
+        info = (collection, event.command_name, command_shape(event.command_name, event.command), current_route())
+        with self._lock:
+            self._pending[key] = info
+
+    def _finish(self, event, failed: bool):
+        with self._lock:
+            info = self._pending.pop((event.connection_id, event.request_id), None)
+        if info is None:
+            return
+        collection, command_name, shape, route = info
+        seconds = event.duration_micros / 1_000_000
+        slow = seconds * 1000 >= self.slow_ms
+
+        with self._lock:
+            self.duration.observe(seconds, collection, command_name)
+            stats = self._stats.get((collection, command_name, shape))
+            if stats is None:
+                stats = self._stats[(collection, command_name, shape)] = {
+                    'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'slow': 0, 'failed': 0, 'routes': {}
+                }
+            stats['count'] += 1
+            stats['total_ms'] += seconds * 1000
+            stats['max_ms'] = max(stats['max_ms'], seconds * 1000)
+            stats['routes'][route] = stats['routes'].get(route, 0) + 1
+            if failed:
+                stats['failed'] += 1
+            if slow:
+                stats['slow'] += 1
+                self.slow_commands.inc(collection, command_name)
+
+        if slow:
+            now = time.monotonic()
+            log_key = (collection, command_name, shape)
+            if now - self._last_logged.get(log_key, 0) >= MONGO_SLOW_LOG_INTERVAL_SECONDS:
+                self._last_logged[log_key] = now
+                logger.warning(
+                    'Slow MongoDB %s on %s: %.1f ms from %s shape=%s',
+                    command_name, collection, seconds * 1000, route, shape
+                )
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def report(self, limit: int = 50) -> list:
+        with self._lock:
+            rows = [
+                {
+                    'collection': collection,
+                    'command': command_name,
+                    'shape': shape,
+                    'count': stats['count'],
+                    'total_ms': round(stats['total_ms'], 2),
+                    'avg_ms': round(stats['total_ms'] / stats['count'], 2),
+                    'max_ms': round(stats['max_ms'], 2),
+                    'slow': stats['slow'],
+                    'failed': stats['failed'],
+                    'routes': dict(sorted(stats['routes'].items(), key=lambda item: -item[1]))
+                }
+                for (collection, command_name, shape), stats in self._stats.items()
+            ]
+        rows.sort(key=lambda row: -row['total_ms'])
+        return rows[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+command_profiler = CommandProfiler(MONGO_SLOW_MS)
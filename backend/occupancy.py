@@ -0,0 +1,148 @@
+from collections import Counter
+from datetime import datetime, time, timezone
+from zoneinfo import ZoneInfo
+from order_schema import order_items
+import asyncio
+import json
+import logging
+import os
+
+PARK_TIMEZONE_NAME = os.getenv('PARK_TIMEZONE', 'America/Sao_Paulo')
+PARK_TIMEZONE = ZoneInfo(PARK_TIMEZONE_NAME)
+DEFAULT_GATE = 'principal'
+# How often each worker re-reads today's entries, picking up other workers' scans
+OCCUPANCY_REFRESH_SECONDS = float(os.getenv('OCCUPANCY_REFRESH_SECONDS', '2'))
+
+logger = logging.getLogger(__name__)
+
+def park_now() -> datetime:
+    return datetime.now(PARK_TIMEZONE)
+
+def to_park_time(moment: datetime) -> datetime:
+    # Datetimes are stored as naive UTC (datetime.utcnow())
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(PARK_TIMEZONE)
+
+def park_day_start_utc(day) -> datetime:
+    start = datetime.combine(day, time.min, PARK_TIMEZONE)
+    return start.astimezone(timezone.utc).replace(tzinfo=None)
+
+def order_quantity(order: dict) -> int:
+    return sum(item['quantity'] for item in order_items(order)) or 1
+
+class OccupancyTracker:
+    """Today's park entries, rebuilt from the accepted scans in scan_events.
+
+    Validations on this worker are added at once; refresh_forever() replaces
+    the counts every few seconds so scans made on other workers show up too.
+    Viewers never touch the database: they wait on an in-memory version
+    counter and all of them share one serialised snapshot per change.
+    """
+
+    def __init__(self):
+        self._reset(park_now().date())
+        self._version = 0
+        self._changed = asyncio.Event()
+        self._payload = None
+        self._payload_version = -1
+
+    def _reset(self, day):
+        self.day = day
+        self.total_entries = 0
+        self.by_gate = Counter()
+        self.by_staff = Counter()
+        self.by_hour = Counter()
+        self.staff_names = {}
+
+    def _roll_over(self, day):
+        if day != self.day:
+            self._reset(day)
+            self._publish()
+
+    def _add(self, gate: str, staff_id: str, staff_name: str, hour: int, quantity: int):
+        self.total_entries += quantity
+        self.by_gate[gate] += quantity
+        self.by_staff[staff_id] += quantity
+        self.by_hour[f'{hour:02d}'] += quantity
+        if staff_name:
+            self.staff_names[staff_id] = staff_name
+
+    def _publish(self):
+        self._version += 1
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def record(self, gate: str, staff_id: str, staff_name: str, quantity: int, validated_at: datetime):
+        local_time = to_park_time(validated_at)
+        self._roll_over(local_time.date())
+        self._add(gate or DEFAULT_GATE, staff_id, staff_name, local_time.hour, quantity)
+        self._publish()
+
+    def snapshot(self) -> dict:
+        self._roll_over(park_now().date())
+        return {
+            'date': self.day.isoformat(),
+            'total_entries': self.total_entries,
+            'by_gate': dict(self.by_gate),
+            'by_staff': [
+                {'id': staff_id, 'name': self.staff_names.get(staff_id), 'entries': entries}
+                for staff_id, entries in self.by_staff.most_common()
+            ],
+            'by_hour': dict(sorted(self.by_hour.items()))
+        }
+
+    def payload(self) -> str:
+        # Serialised once per change, shared by every connected viewer
+        snapshot = self.snapshot()
+        if self._payload_version != self._version:
+            self._payload = json.dumps(snapshot)
+            self._payload_version = self._version
+        return self._payload
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    async def wait_for_change(self, since_version: int, timeout: float) -> bool:
+        if self._version != since_version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def refresh(self, db):
+        today = park_now().date()
+        pipeline = [
+            # Written by scan_events.record_scan(); the time series is bucketed by scanned_at
+            {'$match': {'scanned_at': {'$gte': park_day_start_utc(today)}, 'meta.outcome': 'accepted'}},
+            {'$group': {
+                '_id': {
+                    'gate': '$meta.gate',
+                    'staff_id': '$meta.staff_id',
+                    'hour': {'$hour': {'date': '$scanned_at', 'timezone': PARK_TIMEZONE_NAME}}
+                },
+                'staff_name': {'$last': '$staff_name'},
+                'entries': {'$sum': '$quantity'}
+            }}
+        ]
+        rows = await db.scan_events.aggregate(pipeline).to_list(None)
+        before = self.snapshot()
+        self._reset(today)
+        for row in rows:
+            key = row['_id']
+            self._add(key['gate'] or DEFAULT_GATE, key['staff_id'], row.get('staff_name'), key['hour'], row['entries'])
+        if self.snapshot() != before:
+            self._publish()
+
+    async def refresh_forever(self, db, interval: float = OCCUPANCY_REFRESH_SECONDS):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh(db)
+            except Exception:
+                logger.exception('Failed to refresh occupancy')
+
+occupancy = OccupancyTracker()
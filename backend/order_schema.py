@@ -0,0 +1,209 @@
+# Order document versions.
+#
+# v1 (no `v` field) stored the customer dict and the `items` dicts exactly as
+# the client sent them, plus `validated: False` and an `updated_at` equal to
+# `created_at` on every insert.
+#
+# v2 keeps every queried and indexed field where it was (order_id,
+# ticket_code, visit_date, payment_status, created_at, customer.email,
+# customer.document), so one query serves both versions, and compacts the rest:
+#
+#     customer: {id, name, email, phone, document}   # reference + what is shown
+#     items:    [{t: ticket_id, n: name, q: int quantity, p: float unit price}]
+#
+# `validated` and `updated_at` are only written once they carry information.
+# API responses keep the v1 shape; order_view() converts. The rewrite itself is
+# the `orders_v2` migration in migrations.py.
+
+from order_search import normalize_cpf
+from datetime import datetime
+import time
+import uuid
+
+ORDER_SCHEMA_VERSION = 2
+
+CUSTOMER_FIELDS = ('name', 'email', 'phone', 'document')
+
+# ============= READING =============
+
+def order_items(order: dict) -> list:
+    """Line items of either version as {ticket_id, name, quantity, unit_price}."""
+    if order.get('v') == 2:
+        return [
+            {'ticket_id': item.get('t'), 'name': item.get('n'), 'quantity': item.get('q', 0), 'unit_price': item.get('p', 0.0)}
+            for item in order.get('items', [])
+        ]
+    return [
+        {
+            'ticket_id': item.get('ticketId'),
+            'name': item.get('ticketName') or item.get('name'),
+            'quantity': int(item.get('quantity', 0)),
+            'unit_price': float(item.get('unitPrice', 0) or 0)
+        }
+        for item in order.get('items', [])
+    ]
+
+def order_view(order: dict) -> dict:
+    """An order of either version in the shape the API has always returned."""
+    if order.get('v') != 2:
+        return order
+    view = dict(order)
+    view['items'] = [
+        {'ticketId': item['ticket_id'], 'ticketName': item['name'], 'quantity': item['quantity'], 'unitPrice': item['unit_price']}
+        for item in order_items(order)
+    ]
+    customer = dict(order.get('customer') or {})
+    if customer.get('id') is not None:
+        customer['id'] = str(customer['id'])
+    view['customer'] = customer
+    view.setdefault('validated', False)
+    view.setdefault('updated_at', order.get('created_at'))
+    view.pop('v', None)
+    return view
+
+# Aggregation expressions reading either version, for pipelines over orders
+ITEM_QUANTITIES = {'$cond': [{'$eq': ['$v', 2]}, '$items.q', '$items.quantity']}
+
+def item_expression(v1_field: str, v2_field: str, item: str = '$items') -> dict:
+    return {'$cond': [{'$eq': ['$v', 2]}, f'{item}.{v2_field}', f'{item}.{v1_field}']}
+
+# ============= WRITING =============
+
+def compact_customer(customer: dict, customer_id=None) -> dict:
+    compact = {'id': customer_id}
+    compact.update({field: customer.get(field) for field in CUSTOMER_FIELDS if customer.get(field) is not None})
+    if 'document' in compact:
+        compact['document'] = normalize_cpf(compact['document'])
+    return compact
+
+def compact_items(items: list) -> list:
+    return [
+        {
+            't': item.get('ticketId'),
+            'n': item.get('ticketName'),
+            'q': int(item.get('quantity', 0)),
+            'p': float(item.get('unitPrice', 0) or 0)
+        }
+        for item in items
+    ]
+
+def new_ticket_code() -> str:
+    return f"TKT-{uuid.uuid4().hex[:12].upper()}"
+
+def new_order_document(order_data: dict, customer_id=None) -> dict:
+    """v2 document for an OrderCreate payload; the caller adds ids and status."""
+    document = {key: value for key, value in order_data.items() if key not in ('customer', 'items')}
+    document['v'] = ORDER_SCHEMA_VERSION
+    document['customer'] = compact_customer(order_data['customer'], customer_id)
+    document['items'] = compact_items(order_data['items'])
+    document['created_at'] = datetime.utcnow()
+    return document
+
+# ============= MIGRATION =============
+
+def _cpf_expression(path: str) -> dict:
+    """normalize_cpf() as an aggregation expression: the digits when there are 11."""
+    digits = {'$reduce': {
+        'input': {'$regexFindAll': {'input': {'$ifNull': [{'$toString': path}, '']}, 'regex': r'\d'}},
+        'initialValue': '',
+        'in': {'$concat': ['$$value', '$$this.match']}
+    }}
+    return {'$let': {
+        'vars': {'digits': digits},
+        'in': {'$cond': [{'$eq': [{'$strLenCP': '$$digits'}, 11]}, '$$digits', path]}
+    }}
+
+def _v2_pipeline(customer_id) -> list:
+    """Server-side v1 -> v2 rewrite. Running inside the update makes it atomic
+    with concurrent webhook and validation writes to the same order."""
+    return [
+        {'$set': {
+            'v': ORDER_SCHEMA_VERSION,
+            'customer': {
+                'id': {'$literal': customer_id},
+                **{field: f'$customer.{field}' for field in CUSTOMER_FIELDS},
+                # Stored like new_order_document() does, whether or not the CPF migration ran
+                'document': _cpf_expression('$customer.document')
+            },
+            'items': {'$map': {
+                'input': {'$ifNull': ['$items', []]},
+                'as': 'item',
+                'in': {
+                    't': '$$item.ticketId',
+                    'n': {'$ifNull': ['$$item.ticketName', '$$item.name']},
+                    'q': {'$toInt': {'$ifNull': ['$$item.quantity', 0]}},
+                    'p': {'$toDouble': {'$ifNull': ['$$item.unitPrice', 0]}}
+                }
+            }},
+            'validated': {'$cond': [{'$eq': ['$validated', True]}, True, '$$REMOVE']},
+            # v1 set both from separate utcnow() calls, so "never updated" is within a second
+            'updated_at': {'$cond': [
+                {'$lte': [{'$abs': {'$subtract': ['$updated_at', '$created_at']}}, 1000]},
+                '$$REMOVE', '$updated_at'
+            ]}
+        }}
+    ]
+
+async def v2_updates(db, orders: list) -> list:
+    """(_id, update) pairs rewriting v1 orders (at least _id and customer.email) as v2."""
+    emails = list({(order.get('customer') or {}).get('email') for order in orders} - {None})
+    customer_ids = {
+        customer['email']: customer['_id']
+        async for customer in db.customers.find({'email': {'$in': emails}}, {'email': 1})
+    }
+    return [
+        (order['_id'], _v2_pipeline(customer_ids.get((order.get('customer') or {}).get('email'))))
+        for order in orders
+    ]
+
+# Same shape as the admin order list, the hottest read returning whole orders
+SAMPLE_PAGE_SIZE = 100
+VERSION_FILTERS = {1: {'v': {'$exists': False}}, 2: {'v': ORDER_SCHEMA_VERSION}}
+
+async def _page_read_ms(db, version: int) -> float:
+    started = time.perf_counter()
+    cursor = db.orders.find(VERSION_FILTERS[version]).sort([('created_at', -1), ('_id', -1)])
+    await cursor.limit(SAMPLE_PAGE_SIZE).to_list(SAMPLE_PAGE_SIZE)
+    return round((time.perf_counter() - started) * 1000, 1)
+
+async def order_size_stats(db) -> list:
+    """Document count, average BSON size and the time to read a page of the
+    most recent orders, per schema version, to compare before and after."""
+    pipeline = [
+        {'$group': {
+            '_id': {'$ifNull': ['$v', 1]},
+            'orders': {'$sum': 1},
+            'avg_bytes': {'$avg': {'$bsonSize': '$$ROOT'}}
+        }},
+        {'$sort': {'_id': 1}}
+    ]
+    rows = await db.orders.aggregate(pipeline).to_list(None)
+    return [
+        {
+            'version': row['_id'],
+            'orders': row['orders'],
+            'avg_bytes': round(row['avg_bytes']),
+            'page_read_ms': await _page_read_ms(db, row['_id'])
+        }
+        for row in rows
+    ]
+
+if __name__ == '__main__':
+    # python order_schema.py
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+    from pathlib import Path
+    import asyncio
+    import os
+
+    load_dotenv(Path(__file__).parent / '.env')
+
+    async def main():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        db = client[os.environ['DB_NAME']]
+        try:
+            print(await order_size_stats(db))
+        finally:
+            client.close()
+
+    asyncio.run(main())
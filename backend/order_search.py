@@ -0,0 +1,64 @@
+from fastapi import HTTPException
+import re
+
+MIN_PREFIX_LENGTH = 3
+
+# Search field -> order document path
+SEARCH_FIELDS = {
+    'email': 'customer.email',
+    'document': 'customer.document',
+    'order_id': 'order_id',
+    'ticket_code': 'ticket_code',
+}
+
+def _digits(value: str) -> str:
+    return re.sub(r'\D', '', value)
+
+def normalize_cpf(value: str) -> str:
+    """CPFs are stored as bare digits; anything that is not a CPF is kept as typed."""
+    digits = _digits(value or '')
+    return digits if len(digits) == 11 else value
+
+def _cpf_variants(value: str) -> list:
+    """Orders from before the `orders_document_digits` migration hold CPFs as typed
+    (and archived ones keep them), so match both the bare and the formatted form."""
+    digits = _digits(value)
+    if len(digits) != 11:
+        return [value]
+    return list(dict.fromkeys([value, digits, f'{digits[:3]}.{digits[3:6]}.{digits[6:9]}-{digits[9:]}']))
+
+def _term(field: str, value: str, prefix: bool):
+    value = value.strip()
+    if field in ('order_id', 'ticket_code'):
+        value = value.upper()  # Generated in upper case
+    if not prefix:
+        if field == 'document':
+            return {'$in': _cpf_variants(value)}
+        return value
+    if len(value) < MIN_PREFIX_LENGTH:
+        raise HTTPException(
+            status_code=400,
+            detail=f'Informe ao menos {MIN_PREFIX_LENGTH} caracteres para busca por prefixo'
+        )
+    # Anchored, case-sensitive and without metacharacters, so it is an index range scan
+    return {'$regex': '^' + re.escape(value)}
+
+def order_search_query(email: str = None, document: str = None, order_id: str = None,
+                       ticket_code: str = None, prefix: bool = False, visit_date: str = None,
+                       visit_from: str = None, visit_to: str = None, payment_status: str = None) -> dict:
+    query = {}
+    terms = {'email': email, 'document': document, 'order_id': order_id, 'ticket_code': ticket_code}
+    for name, value in terms.items():
+        if value:
+            query[SEARCH_FIELDS[name]] = _term(name, value, prefix)
+    if visit_date:
+        query['visit_date'] = visit_date
+    elif visit_from or visit_to:
+        query['visit_date'] = {}
+        if visit_from:
+            query['visit_date']['$gte'] = visit_from
+        if visit_to:
+            query['visit_date']['$lte'] = visit_to
+    if payment_status:
+        query['payment_status'] = payment_status
+    return query
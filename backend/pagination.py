@@ -0,0 +1,82 @@
+from fastapi import HTTPException, Response
+from bson import json_util
+import base64
+import binascii
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+def encode_cursor(values: list) -> str:
+    raw = json_util.dumps(values).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json_util.loads(raw)
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail='Cursor inválido')
+    if not isinstance(values, list):
+        raise HTTPException(status_code=400, detail='Cursor inválido')
+    return values
+
+def _field_value(document: dict, field: str):
+    for part in field.split('.'):
+        document = (document or {}).get(part)
+    return document
+
+def _keyset(query: dict, sort_field: str, direction: int, cursor: str):
+    sort = [(sort_field, direction)] if sort_field == '_id' else [(sort_field, direction), ('_id', direction)]
+    op = '$lt' if direction < 0 else '$gt'
+
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(sort):
+            raise HTTPException(status_code=400, detail='Cursor inválido')
+        if sort_field == '_id':
+            after = {'_id': {op: values[0]}}
+        else:
+            after = {'$or': [
+                {sort_field: {op: values[0]}},
+                {sort_field: values[0], '_id': {op: values[1]}}
+            ]}
+        query = {'$and': [query, after]} if query else after
+    return query, sort
+
+def _page(documents: list, sort: list, limit: int):
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        last = documents[-1]
+        next_cursor = encode_cursor([_field_value(last, field) for field, _ in sort])
+    return documents, next_cursor
+
+async def paginate(collection, query: dict, sort_field: str = '_id', direction: int = -1,
+                   limit: int = DEFAULT_PAGE_SIZE, cursor: str = None, projection: dict = None):
+    """Keyset pagination over `sort_field`, with `_id` breaking ties.
+
+    The cursor holds the sort key and `_id` of the last document served, so
+    every page is an index range scan instead of a growing skip(). Returns
+    the page and the cursor of the next one (None on the last page).
+    """
+    query, sort = _keyset(query, sort_field, direction, cursor)
+    documents = await collection.find(query, projection).sort(sort).limit(limit + 1).to_list(limit + 1)
+    return _page(documents, sort, limit)
+
+async def paginate_union(collection, others: list, query: dict, sort_field: str = '_id', direction: int = -1,
+                         limit: int = DEFAULT_PAGE_SIZE, cursor: str = None):
+    """paginate() over `collection` plus the collections named in `others`
+    ($unionWith), for reads that span live and archived documents. Each
+    branch reads at most one page through its own indexes before the merge."""
+    query, sort = _keyset(query, sort_field, direction, cursor)
+    branch = [{'$match': query}, {'$sort': dict(sort)}, {'$limit': limit + 1}]
+    pipeline = branch + [{'$unionWith': {'coll': name, 'pipeline': branch}} for name in others]
+    pipeline += [{'$sort': dict(sort)}, {'$limit': limit + 1}]
+    documents = await collection.aggregate(pipeline).to_list(limit + 1)
+    return _page(documents, sort, limit)
+
+def set_next_cursor(response: Response, next_cursor: str):
+    # Sent as a header so list responses stay plain JSON arrays
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
@@ -0,0 +1,64 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from auth import get_current_admin_user
+from sales_rollups import ROLLUP_COLLECTION, report_pipeline, rebuild
+
+router = APIRouter()
+
+REPORT_DATE_FIELDS = ('visit_date', 'sale_date')
+
+async def get_database(request: Request) -> AsyncIOMotorDatabase:
+    return request.app.db
+
+def _date_field(by: str) -> str:
+    if by not in REPORT_DATE_FIELDS:
+        raise HTTPException(status_code=400, detail='Agrupamento inválido. Use visit_date ou sale_date')
+    return by
+
+# ============= SALES REPORTS (ADMIN) =============
+
+@router.get('/api/admin/reports/daily-sales')
+async def get_daily_sales(
+    start: str = None,
+    end: str = None,
+    by: str = 'sale_date',
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    by = _date_field(by)
+    rows = await db[ROLLUP_COLLECTION].aggregate(report_pipeline(by, start, end, False)).to_list(None)
+    return [{'date': row['_id'], 'tickets': row['tickets'], 'revenue': round(row['revenue'], 2)} for row in rows]
+
+@router.get('/api/admin/reports/ticket-types')
+async def get_ticket_type_sales(
+    start: str = None,
+    end: str = None,
+    by: str = 'sale_date',
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    by = _date_field(by)
+    rows = await db[ROLLUP_COLLECTION].aggregate(report_pipeline(by, start, end, True)).to_list(None)
+    names = {
+        ticket['ticket_id']: ticket.get('name')
+        async for ticket in db.tickets.find({'ticket_id': {'$in': [row['_id'] for row in rows]}}, {'ticket_id': 1, 'name': 1})
+    }
+    return [
+        {
+            'ticket_id': row['_id'],
+            'name': names.get(row['_id']),
+            'orders': row['orders'],
+            'tickets': row['tickets'],
+            'revenue': round(row['revenue'], 2)
+        }
+        for row in rows
+    ]
+
+@router.post('/api/admin/reports/daily-sales/rebuild')
+async def rebuild_daily_sales(
+    visit_from: str = None,
+    visit_to: str = None,
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    return await rebuild(db, visit_from, visit_to)
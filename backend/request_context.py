@@ -0,0 +1,69 @@
+from contextvars import ContextVar
+import asyncio
+import re
+import uuid
+
+# ASGI scope of the request being served by the current task
+scope_var: ContextVar = ContextVar('scope', default=None)
+
+# Correlation id of the request, echoed back as X-Request-ID
+request_id_var: ContextVar = ContextVar('request_id', default=None)
+
+_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# Same information keyed by task, for readers on other threads
+task_scopes = {}
+
+_route_templates = {}
+
+def route_template(scope) -> str:
+    """'GET /api/orders/{order_id}' for a routed request, raw path otherwise."""
+    if scope is None:
+        return 'background'
+    method = scope.get('method', '')
+    endpoint = scope.get('endpoint')
+    if endpoint is None:
+        return f"{method} {scope.get('path', '')}"
+    template = _route_templates.get(endpoint)
+    if template is None:
+        app = scope.get('app')
+        routes = getattr(app, 'routes', [])
+        template = next(
+            (route.path for route in routes if getattr(route, 'endpoint', None) is endpoint),
+            scope.get('path', '')
+        )
+        _route_templates[endpoint] = template
+    return f'{method} {template}'
+
+def current_route() -> str:
+    return route_template(scope_var.get())
+
+class RequestContextMiddleware:
+    """Pure ASGI middleware, so the endpoint runs in the task registered here."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        incoming = next((value.decode('latin-1') for name, value in scope['headers'] if name == b'x-request-id'), '')
+        request_id = incoming if _REQUEST_ID.match(incoming) else uuid.uuid4().hex
+
+        async def send_with_request_id(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', [])) + [(b'x-request-id', request_id.encode())]
+            await send(message)
+
+        task = asyncio.current_task()
+        token = scope_var.set(scope)
+        id_token = request_id_var.set(request_id)
+        task_scopes[task] = scope
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            task_scopes.pop(task, None)
+            request_id_var.reset(id_token)
+            scope_var.reset(token)
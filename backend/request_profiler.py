@@ -0,0 +1,201 @@
+from collections import Counter, deque
+from datetime import datetime, timedelta
+from starlette.routing import Match
+import asyncio
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+
+PROFILE_INTERVAL_MS = 5
+PROFILE_MAX_CONCURRENT = 2
+PROFILE_MAX_PER_MINUTE = 10
+PROFILE_MAX_DEPTH = 64
+PROFILE_RETENTION_DAYS = 7
+
+logger = logging.getLogger(__name__)
+
+def _frame_name(frame) -> str:
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}"
+
+def _collapse(frames) -> str:
+    # Outermost first, as in Brendan Gregg's folded stack format
+    return ';'.join(_frame_name(frame) for frame in frames[-PROFILE_MAX_DEPTH:])
+
+def _frames_from(frame) -> list:
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+class _Collector:
+    def __init__(self, route: str):
+        self.route = route
+        self.samples = Counter()
+        self.started_at = time.perf_counter()
+
+class RequestProfiler:
+    """Admin-controlled statistical profiler for individual requests.
+
+    While a profiling session is active, a sampler thread looks at the event
+    loop every PROFILE_INTERVAL_MS. For each profiled request it records the
+    running stack when that request holds the loop, or its suspended
+    coroutine stack (ending in `(await)`) otherwise, giving a wall-clock
+    profile in folded format. With no session the middleware costs one
+    attribute check. Sessions are per worker.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.routes = set()
+        self.sample_rate = 0.0
+        self.expires_at = 0.0
+        self.remaining = 0
+        self._active = {}
+        self._recent = deque()
+        self._loop = None
+        self._loop_thread_id = None
+        self._thread = None
+
+    def configure(self, routes, sample_percent: float, duration_seconds: int, max_profiles: int):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self.routes = set(routes)
+        self.sample_rate = sample_percent / 100
+        self.expires_at = time.monotonic() + duration_seconds
+        self.remaining = max_profiles
+        self.enabled = True
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._sample_loop, name='request-profiler', daemon=True)
+            self._thread.start()
+
+    def disable(self):
+        self.enabled = False
+
+    def status(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'routes': sorted(self.routes),
+            'sample_percent': self.sample_rate * 100,
+            'expires_in_seconds': max(0, round(self.expires_at - time.monotonic())) if self.enabled else 0,
+            'remaining_profiles': self.remaining,
+            'active': len(self._active)
+        }
+
+    def _should_profile(self, route: str) -> bool:
+        now = time.monotonic()
+        if now > self.expires_at or self.remaining <= 0:
+            self.enabled = False
+            return False
+        if self.routes and route not in self.routes:
+            return False
+        if not self.routes and random.random() >= self.sample_rate:
+            return False
+        if len(self._active) >= PROFILE_MAX_CONCURRENT:
+            return False
+        while self._recent and now - self._recent[0] > 60:
+            self._recent.popleft()
+        if len(self._recent) >= PROFILE_MAX_PER_MINUTE:
+            return False
+        self._recent.append(now)
+        self.remaining -= 1
+        return True
+
+    def _sample_loop(self):
+        interval = PROFILE_INTERVAL_MS / 1000
+        while self.enabled or self._active:
+            time.sleep(interval)
+            if self.enabled and time.monotonic() > self.expires_at:
+                self.enabled = False
+            if not self._active:
+                continue
+            running = asyncio.current_task(self._loop)
+            for task, collector in list(self._active.items()):
+                try:
+                    if task is running:
+                        frame = sys._current_frames().get(self._loop_thread_id)
+                        stack = _collapse(_frames_from(frame)) if frame else ''
+                    else:
+                        stack = _collapse(task.get_stack(limit=PROFILE_MAX_DEPTH)) + ';(await)'
+                except Exception:
+                    continue  # The task moved on while we looked
+                if stack:
+                    collector.samples[stack] += 1
+
+    @staticmethod
+    def _route_for(scope) -> str:
+        for route in getattr(scope.get('app'), 'routes', []):
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return f"{scope['method']} {route.path}"
+        return f"{scope['method']} {scope['path']}"
+
+    def start_request(self, scope):
+        route = self._route_for(scope)
+        if not self._should_profile(route):
+            return None
+        collector = _Collector(route)
+        self._active[asyncio.current_task()] = collector
+        return collector
+
+    def finish_request(self, collector) -> dict:
+        self._active.pop(asyncio.current_task(), None)
+        duration_ms = (time.perf_counter() - collector.started_at) * 1000
+        return {
+            'profile_id': uuid.uuid4().hex,
+            'route': collector.route,
+            'duration_ms': round(duration_ms, 2),
+            'interval_ms': PROFILE_INTERVAL_MS,
+            'samples': sum(collector.samples.values()),
+            'folded': '\n'.join(f'{stack} {count}' for stack, count in collector.samples.most_common()),
+            'created_at': datetime.utcnow(),
+            'expires_at': datetime.utcnow() + timedelta(days=PROFILE_RETENTION_DAYS)
+        }
+
+request_profiler = RequestProfiler()
+
+async def _save_profile(db, profile: dict):
+    try:
+        await db.request_profiles.insert_one(profile)
+    except Exception:
+        logger.exception('Failed to store request profile', extra={'route': profile['route']})
+
+class ProfilerMiddleware:
+    def __init__(self, app):
+        self.app = app
+        # Saves in flight; PROFILE_MAX_PER_MINUTE already keeps this small
+        self._saving = set()
+
+    async def __call__(self, scope, receive, send):
+        if not request_profiler.enabled or scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        collector = request_profiler.start_request(scope)
+        if collector is None:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profile = request_profiler.finish_request(collector)
+            profile['status'] = status_code
+            profile['path'] = scope['path']
+            # Stored in the background: a failed or slow insert must neither
+            # replace the request's own exception nor hold the request open
+            task = asyncio.create_task(_save_profile(scope['app'].db, profile))
+            self._saving.add(task)
+            task.add_done_callback(self._saving.discard)
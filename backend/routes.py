@@ -1,14 +1,39 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, Query, UploadFile, File, BackgroundTasks
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from models import (
     UserLogin, Token, Attraction, AttractionCreate, AttractionUpdate,
     Ticket, TicketCreate, TicketUpdate, ParkInfo, ParkInfoUpdate,
     Testimonial, TestimonialCreate, TestimonialUpdate,
-    FAQ, FAQCreate, FAQUpdate, Contact, ContactCreate, Order, OrderCreate
+    FAQ, FAQCreate, FAQUpdate, Contact, ContactCreate, Order, OrderCreate,
+    ProfilerSession
+)
+from auth import (
+    verify_password_async, upgrade_password_hash, create_access_token,
+    get_current_admin_user, password_executor
+)
+from loop_monitor import loop_monitor
+from load_shedding import concurrency_limiter
+from mongo_profiler import command_profiler
+from request_profiler import request_profiler
+from memory_snapshots import memory_snapshots, MemoryTracingBusy, MemoryTracingInactive
+from fastapi.responses import PlainTextResponse
+from login_throttle import login_throttle, client_ip
+from pagination import paginate, set_next_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from dashboard_counters import bump, active_delta, reconcile, read_counters, RECENT_ORDER_PROJECTION
+from pymongo import ReturnDocument
+from order_search import order_search_query
+from order_schema import new_order_document, new_ticket_code, order_view, order_size_stats
+from archive import (
+    paginate_orders, find_order, archive_orders, archive_collections, claim_run, ArchiveBusy, ORDER_ARCHIVE_AFTER_DAYS
+)
+from contact_inbox import CONTACT_STATUSES, status_update, search_query as contact_search_query
+from indexes import index_report
+from migrations import (
+    MIGRATIONS_BY_NAME, MIGRATION_BATCH_SIZE, MigrationBusy, claim, run_migration, migration_status
 )
-from auth import verify_password, create_access_token, get_current_admin_user
 from datetime import datetime, timedelta
 from bson import ObjectId
+import asyncio
 import uuid
 import os
 import shutil
@@ -22,9 +47,21 @@ async def get_database(request: Request) -> AsyncIOMotorDatabase:
 # ============= AUTH ROUTES =============
 
 @router.post('/api/auth/login', response_model=Token)
-async def login(user_data: UserLogin, db: AsyncIOMotorDatabase = Depends(get_database)):
+async def login(
+    user_data: UserLogin,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    # Throttled before any lookup or bcrypt work
+    ip = client_ip(request)
+    account = f'admin:{user_data.email.lower()}'
+    await login_throttle.check(db, ip, account)
+    
     user = await db.users.find_one({'email': user_data.email})
-    if not user or not verify_password(user_data.password, user['hashed_password']):
+    valid, needs_rehash = await verify_password_async(user_data.password, user['hashed_password']) if user else (False, False)
+    if not valid:
+        await login_throttle.record_failure(db, ip, account)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail='Email ou senha incorretos'
@@ -36,18 +73,20 @@ async def login(user_data: UserLogin, db: AsyncIOMotorDatabase = Depends(get_dat
             detail='Acesso negado. Apenas administradores podem acessar.'
         )
     
-    access_token = create_access_token(data={'sub': user['email']})
+    await login_throttle.record_success(db, account)
+    if needs_rehash:
+        background_tasks.add_task(upgrade_password_hash, db.users, user['_id'], user['hashed_password'], user_data.password)
+    access_token = create_access_token(data={
+        'sub': user['email'],
+        'type': 'admin',
+        'id': str(user['_id']),
+        'is_admin': True
+    })
     return {'access_token': access_token, 'token_type': 'bearer'}
 
 @router.get('/api/auth/me')
-async def get_current_user_info(
-    current_user: dict = Depends(get_current_admin_user),
-    db: AsyncIOMotorDatabase = Depends(get_database)
-):
-    user = await db.users.find_one({'email': current_user['email']})
-    if not user:
-        raise HTTPException(status_code=404, detail='Usuário não encontrado')
-    return {'email': user['email'], 'is_admin': user.get('is_admin', False)}
+async def get_current_user_info(current_user: dict = Depends(get_current_admin_user)):
+    return {'email': current_user['email'], 'is_admin': current_user['is_admin']}
 
 # ============= FILE UPLOAD =============
 
@@ -77,6 +116,9 @@ async def upload_file(
 
 @router.get('/api/attractions')
 async def get_attractions(
+    response: Response,
+    cursor: str = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
     category: str = None,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
@@ -84,7 +126,8 @@ async def get_attractions(
     if category and category != 'all':
         query['category'] = category
     
-    attractions = await db.attractions.find(query).to_list(100)
+    attractions, next_cursor = await paginate(db.attractions, query, '_id', 1, limit, cursor)
+    set_next_cursor(response, next_cursor)
     for attraction in attractions:
         attraction['_id'] = str(attraction['_id'])
     return attractions
@@ -112,6 +155,7 @@ async def create_attraction(
     attraction_dict['updated_at'] = datetime.utcnow()
     
     result = await db.attractions.insert_one(attraction_dict)
+    await bump(db, total_attractions=1)
     return {'id': str(result.inserted_id), 'message': 'Atração criada com sucesso'}
 
 @router.put('/api/admin/attractions/{attraction_id}')
@@ -124,14 +168,17 @@ async def update_attraction(
     update_data = {k: v for k, v in attraction.dict().items() if v is not None}
     update_data['updated_at'] = datetime.utcnow()
     
-    result = await db.attractions.update_one(
+    before = await db.attractions.find_one_and_update(
         {'_id': ObjectId(attraction_id)},
-        {'$set': update_data}
+        {'$set': update_data},
+        projection={'is_active': 1},
+        return_document=ReturnDocument.BEFORE
     )
     
-    if result.matched_count == 0:
+    if before is None:
         raise HTTPException(status_code=404, detail='Atração não encontrada')
     
+    await bump(db, total_attractions=active_delta(before, update_data.get('is_active')))
     return {'message': 'Atração atualizada com sucesso'}
 
 @router.delete('/api/admin/attractions/{attraction_id}')
@@ -140,21 +187,30 @@ async def delete_attraction(
     current_user: dict = Depends(get_current_admin_user),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    result = await db.attractions.update_one(
+    before = await db.attractions.find_one_and_update(
         {'_id': ObjectId(attraction_id)},
-        {'$set': {'is_active': False, 'updated_at': datetime.utcnow()}}
+        {'$set': {'is_active': False, 'updated_at': datetime.utcnow()}},
+        projection={'is_active': 1},
+        return_document=ReturnDocument.BEFORE
     )
     
-    if result.matched_count == 0:
+    if before is None:
         raise HTTPException(status_code=404, detail='Atração não encontrada')
     
+    await bump(db, total_attractions=active_delta(before, False))
     return {'message': 'Atração removida com sucesso'}
 
 # ============= TICKETS ROUTES =============
 
 @router.get('/api/tickets')
-async def get_tickets(db: AsyncIOMotorDatabase = Depends(get_database)):
-    tickets = await db.tickets.find({'is_active': True}).to_list(100)
+async def get_tickets(
+    response: Response,
+    cursor: str = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    tickets, next_cursor = await paginate(db.tickets, {'is_active': True}, '_id', 1, limit, cursor)
+    set_next_cursor(response, next_cursor)
     for ticket in tickets:
         ticket['_id'] = str(ticket['_id'])
     return tickets
@@ -187,6 +243,7 @@ async def create_ticket(
     ticket_dict['updated_at'] = datetime.utcnow()
     
     result = await db.tickets.insert_one(ticket_dict)
+    await bump(db, total_tickets=1)
     return {'id': str(result.inserted_id), 'message': 'Ingresso criado com sucesso'}
 
 @router.put('/api/admin/tickets/{ticket_id}')
@@ -199,14 +256,17 @@ async def update_ticket(
     update_data = {k: v for k, v in ticket.dict().items() if v is not None}
     update_data['updated_at'] = datetime.utcnow()
     
-    result = await db.tickets.update_one(
+    before = await db.tickets.find_one_and_update(
         {'ticket_id': ticket_id},
-        {'$set': update_data}
+        {'$set': update_data},
+        projection={'is_active': 1},
+        return_document=ReturnDocument.BEFORE
     )
     
-    if result.matched_count == 0:
+    if before is None:
         raise HTTPException(status_code=404, detail='Ingresso não encontrado')
     
+    await bump(db, total_tickets=active_delta(before, update_data.get('is_active')))
     return {'message': 'Ingresso atualizado com sucesso'}
 
 @router.delete('/api/admin/tickets/{ticket_id}')
@@ -215,14 +275,18 @@ async def delete_ticket(
     current_user: dict = Depends(get_current_admin_user),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    result = await db.tickets.update_one(
+    before = await db.tickets.find_one_and_update(
         {'ticket_id': ticket_id},
-        {'$set': {'is_active': False, 'updated_at': datetime.utcnow()}}
+        {'$set': {'is_active': False, 'updated_at': datetime.utcnow()}},
+        projection={'is_active': 1},
+        return_document=ReturnDocument.BEFORE
     )
     
-    if result.matched_count == 0:
+    if before is None:
         raise HTTPException(status_code=404, detail='Ingresso não encontrado')
     
+    await bump(db, total_tickets=active_delta(before, False))
+    
     return {'message': 'Ingresso removido com sucesso'}
 
 # ============= PARK INFO ROUTES =============
@@ -257,8 +321,14 @@ async def update_park_info(
 # ============= TESTIMONIALS ROUTES =============
 
 @router.get('/api/testimonials')
-async def get_testimonials(db: AsyncIOMotorDatabase = Depends(get_database)):
-    testimonials = await db.testimonials.find({'is_active': True}).to_list(100)
+async def get_testimonials(
+    response: Response,
+    cursor: str = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    testimonials, next_cursor = await paginate(db.testimonials, {'is_active': True}, '_id', 1, limit, cursor)
+    set_next_cursor(response, next_cursor)
     for testimonial in testimonials:
         testimonial['_id'] = str(testimonial['_id'])
     return testimonials
@@ -314,8 +384,14 @@ async def delete_testimonial(
 # ============= FAQ ROUTES =============
 
 @router.get('/api/faqs')
-async def get_faqs(db: AsyncIOMotorDatabase = Depends(get_database)):
-    faqs = await db.faqs.find({'is_active': True}).sort('order', 1).to_list(100)
+async def get_faqs(
+    response: Response,
+    cursor: str = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    faqs, next_cursor = await paginate(db.faqs, {'is_active': True}, 'order', 1, limit, cursor)
+    set_next_cursor(response, next_cursor)
     for faq in faqs:
         faq['_id'] = str(faq['_id'])
     return faqs
@@ -380,14 +456,39 @@ async def create_contact(
     contact_dict['created_at'] = datetime.utcnow()
     
     result = await db.contacts.insert_one(contact_dict)
+    await bump(db, total_contacts=1, new_contacts=1)
     return {'id': str(result.inserted_id), 'message': 'Mensagem enviada com sucesso!'}
 
 @router.get('/api/admin/contacts')
 async def get_contacts(
+    response: Response,
+    cursor: str = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    status: str = None,
     current_user: dict = Depends(get_current_admin_user),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    contacts = await db.contacts.find({}).sort('created_at', -1).to_list(100)
+    query = {'status': status} if status else {}
+    contacts, next_cursor = await paginate(db.contacts, query, 'created_at', -1, limit, cursor)
+    set_next_cursor(response, next_cursor)
+    for contact in contacts:
+        contact['_id'] = str(contact['_id'])
+    return contacts
+
+@router.get('/api/admin/contacts/search')
+async def search_contacts(
+    response: Response,
+    q: str = None,
+    status: str = None,
+    cursor: str = None,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    query = contact_search_query(q, status)
+    projection = {'score': {'$meta': 'textScore'}} if q else None
+    contacts, next_cursor = await paginate(db.contacts, query, 'created_at', -1, limit, cursor, projection)
+    set_next_cursor(response, next_cursor)
     for contact in contacts:
         contact['_id'] = str(contact['_id'])
     return contacts
@@ -399,14 +500,20 @@ async def update_contact_status(
     current_user: dict = Depends(get_current_admin_user),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    result = await db.contacts.update_one(
+    if status.get('status') not in CONTACT_STATUSES:
+        raise HTTPException(status_code=400, detail=f'Status inválido. Use {", ".join(CONTACT_STATUSES)}')
+    
+    before = await db.contacts.find_one_and_update(
         {'_id': ObjectId(contact_id)},
-        {'$set': {'status': status['status']}}
+        status_update(status['status']),
+        projection={'status': 1},
+        return_document=ReturnDocument.BEFORE
     )
     
-    if result.matched_count == 0:
+    if before is None:
         raise HTTPException(status_code=404, detail='Mensagem não encontrada')
     
+    await bump(db, new_contacts=int(status['status'] == 'new') - int(before.get('status') == 'new'))
     return {'message': 'Status atualizado com sucesso'}
 
 # ============= ORDERS ROUTES =============
@@ -417,21 +524,62 @@ async def create_order(
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     order_id = f"ORDER-{uuid.uuid4().hex[:8].upper()}"
-    order_dict = order.dict()
+    order_dict = new_order_document(order.dict())
     order_dict['order_id'] = order_id
+    order_dict['ticket_code'] = new_ticket_code()
     order_dict['payment_status'] = 'pending'
-    order_dict['created_at'] = datetime.utcnow()
-    order_dict['updated_at'] = datetime.utcnow()
     
     result = await db.orders.insert_one(order_dict)
+    await bump(db, total_orders=1)
     return {'order_id': order_id, 'id': str(result.inserted_id), 'message': 'Pedido criado com sucesso'}
 
 @router.get('/api/admin/orders')
 async def get_orders(
+    response: Response,
+    cursor: str = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    payment_status: str = None,
+    visit_date: str = None,
     current_user: dict = Depends(get_current_admin_user),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    orders = await db.orders.find({}).sort('created_at', -1).to_list(100)
+    query = {}
+    if payment_status:
+        query['payment_status'] = payment_status
+    if visit_date:
+        query['visit_date'] = visit_date
+    orders, next_cursor = await paginate(db.orders, query, 'created_at', -1, limit, cursor)
+    set_next_cursor(response, next_cursor)
+    orders = [order_view(order) for order in orders]
+    for order in orders:
+        order['_id'] = str(order['_id'])
+    return orders
+
+@router.get('/api/admin/orders/search')
+async def search_orders(
+    response: Response,
+    email: str = None,
+    document: str = None,
+    order_id: str = None,
+    ticket_code: str = None,
+    prefix: bool = False,
+    visit_date: str = None,
+    visit_from: str = None,
+    visit_to: str = None,
+    payment_status: str = None,
+    include_archive: bool = False,
+    cursor: str = None,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    query = order_search_query(
+        email, document, order_id, ticket_code, prefix,
+        visit_date, visit_from, visit_to, payment_status
+    )
+    orders, next_cursor = await paginate_orders(db, query, limit, cursor, include_archive)
+    set_next_cursor(response, next_cursor)
+    orders = [order_view(order) for order in orders]
     for order in orders:
         order['_id'] = str(order['_id'])
     return orders
@@ -441,12 +589,109 @@ async def get_order(
     order_id: str,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    order = await db.orders.find_one({'order_id': order_id})
+    _, order = await find_order(db, {'order_id': order_id})
     if not order:
         raise HTTPException(status_code=404, detail='Pedido não encontrado')
+    order = order_view(order)
     order['_id'] = str(order['_id'])
     return order
 
+@router.get('/api/admin/orders/schema-stats')
+async def get_order_schema_stats(
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    # Orders and average document size per schema version, to follow the v2 migration
+    return await order_size_stats(db)
+
+# ============= ORDER ARCHIVE (ADMIN) =============
+
+_archive_tasks = set()
+
+@router.post('/api/admin/archive/orders')
+async def start_order_archival(
+    older_than_days: int = Query(ORDER_ARCHIVE_AFTER_DAYS, ge=30),
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    try:
+        run = await claim_run(db, older_than_days)
+    except ArchiveBusy as e:
+        raise HTTPException(status_code=409, detail=f'Arquivamento já em andamento ({e})')
+    
+    task = asyncio.create_task(archive_orders(db, run=run))
+    _archive_tasks.add(task)
+    task.add_done_callback(_archive_tasks.discard)
+    
+    return {
+        'cutoff': run['cutoff'],
+        'resumed': run['resumed'],
+        'message': 'Arquivamento retomado' if run['resumed'] else 'Arquivamento iniciado'
+    }
+
+@router.get('/api/admin/archive/orders')
+async def get_order_archival(
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    run = await db.archive_runs.find_one({'_id': 'orders'}) or {}
+    run.pop('_id', None)
+    if run.get('last_id') is not None:
+        run['last_id'] = str(run['last_id'])
+    collections = {
+        name: await db[name].estimated_document_count()
+        for name in await archive_collections(db)
+    }
+    return {'run': run, 'collections': collections}
+
+# ============= DATA MIGRATIONS (ADMIN) =============
+
+_migration_tasks = set()
+
+@router.get('/api/admin/migrations')
+async def get_migrations(
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    return await migration_status(db)
+
+@router.post('/api/admin/migrations/{name}')
+async def start_migration(
+    name: str,
+    dry_run: bool = True,
+    batch_size: int = Query(MIGRATION_BATCH_SIZE, ge=1, le=5000),
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    if name not in MIGRATIONS_BY_NAME:
+        raise HTTPException(status_code=404, detail='Migração não encontrada')
+    if dry_run:
+        return await run_migration(db, name, batch_size, dry_run=True)
+    
+    try:
+        run = await claim(db, MIGRATIONS_BY_NAME[name])
+    except MigrationBusy as e:
+        raise HTTPException(status_code=409, detail=f'Migração já em andamento ({e})')
+    
+    task = asyncio.create_task(run_migration(db, name, batch_size, run=run))
+    _migration_tasks.add(task)
+    task.add_done_callback(_migration_tasks.discard)
+    
+    return {
+        'migration': name,
+        'resumed': run['resumed'],
+        'message': 'Migração retomada' if run['resumed'] else 'Migração iniciada'
+    }
+
+# ============= INDEXES (ADMIN) =============
+
+@router.get('/api/admin/indexes')
+async def get_index_health(
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    return await index_report(db)
+
 # ============= DASHBOARD STATS =============
 
 @router.get('/api/admin/dashboard-stats')
@@ -454,22 +699,177 @@ async def get_dashboard_stats(
     current_user: dict = Depends(get_current_admin_user),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    total_attractions = await db.attractions.count_documents({'is_active': True})
-    total_tickets = await db.tickets.count_documents({'is_active': True})
-    total_orders = await db.orders.count_documents({})
-    total_contacts = await db.contacts.count_documents({})
-    new_contacts = await db.contacts.count_documents({'status': 'new'})
+    # Counters are maintained by the write paths, so this is a single read
+    counters = await read_counters(db)
     
     # Recent orders
-    recent_orders = await db.orders.find({}).sort('created_at', -1).limit(5).to_list(5)
+    recent_orders = await db.orders.find({}, RECENT_ORDER_PROJECTION).sort('created_at', -1).limit(5).to_list(5)
     for order in recent_orders:
         order['_id'] = str(order['_id'])
     
-    return {
-        'total_attractions': total_attractions,
-        'total_tickets': total_tickets,
-        'total_orders': total_orders,
-        'total_contacts': total_contacts,
-        'new_contacts': new_contacts,
-        'recent_orders': recent_orders
-    }
\ No newline at end of file
+    return {**counters, 'recent_orders': recent_orders}
+
+@router.post('/api/admin/dashboard-stats/reconcile')
+async def reconcile_dashboard_stats(
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    return await reconcile(db)
+
+# ============= RUNTIME METRICS =============
+
+@router.get('/api/admin/metrics/password-hashing')
+async def get_password_hashing_metrics(current_user: dict = Depends(get_current_admin_user)):
+    return password_executor.stats()
+
+@router.get('/api/admin/metrics/event-loop')
+async def get_event_loop_metrics(current_user: dict = Depends(get_current_admin_user)):
+    return loop_monitor.stats()
+
+@router.get('/api/admin/metrics/concurrency')
+async def get_concurrency_metrics(current_user: dict = Depends(get_current_admin_user)):
+    return concurrency_limiter.stats()
+
+@router.get('/api/admin/metrics/mongodb')
+async def get_mongodb_report(
+    limit: int = 50,
+    current_user: dict = Depends(get_current_admin_user)
+):
+    return {'slow_ms': command_profiler.slow_ms, 'commands': command_profiler.report(limit)}
+
+@router.delete('/api/admin/metrics/mongodb')
+async def reset_mongodb_report(current_user: dict = Depends(get_current_admin_user)):
+    command_profiler.reset()
+    return {'message': 'Estatísticas do MongoDB reiniciadas'}
+
+# ============= REQUEST PROFILER (ADMIN) =============
+
+@router.post('/api/admin/profiler')
+async def start_profiler(
+    session: ProfilerSession,
+    current_user: dict = Depends(get_current_admin_user)
+):
+    if not session.routes and not 0 < session.sample_percent <= 100:
+        raise HTTPException(status_code=400, detail='Informe as rotas ou uma porcentagem de amostragem')
+    if not 0 < session.duration_seconds <= 3600 or not 0 < session.max_profiles <= 100:
+        raise HTTPException(status_code=400, detail='Duração ou quantidade de perfis inválida')
+    
+    request_profiler.configure(session.routes, session.sample_percent, session.duration_seconds, session.max_profiles)
+    return request_profiler.status()
+
+@router.get('/api/admin/profiler')
+async def get_profiler_status(current_user: dict = Depends(get_current_admin_user)):
+    return request_profiler.status()
+
+@router.delete('/api/admin/profiler')
+async def stop_profiler(current_user: dict = Depends(get_current_admin_user)):
+    request_profiler.disable()
+    return {'message': 'Profiler desativado'}
+
+@router.get('/api/admin/profiler/profiles')
+async def get_profiles(
+    route: str = None,
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    query = {'route': route} if route else {}
+    profiles = await db.request_profiles.find(query, {'folded': 0}).sort('created_at', -1).to_list(100)
+    for profile in profiles:
+        profile['_id'] = str(profile['_id'])
+    return profiles
+
+@router.get('/api/admin/profiler/profiles/{profile_id}')
+async def download_profile(
+    profile_id: str,
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    profile = await db.request_profiles.find_one({'profile_id': profile_id}, {'folded': 1})
+    if not profile:
+        raise HTTPException(status_code=404, detail='Perfil não encontrado')
+    return PlainTextResponse(
+        profile['folded'],
+        headers={'Content-Disposition': f'attachment; filename="{profile_id}.folded"'}
+    )
+
+# ============= MEMORY SNAPSHOTS (ADMIN) =============
+
+MEMORY_GROUPS = ('module', 'package', 'line')
+
+def _memory_group(group_by: str) -> str:
+    if group_by not in MEMORY_GROUPS:
+        raise HTTPException(status_code=400, detail=f'Agrupamento inválido. Use {", ".join(MEMORY_GROUPS)}')
+    return group_by
+
+async def _memory_snapshot(db, snapshot_id: str) -> dict:
+    snapshot = await memory_snapshots.get(db, snapshot_id)
+    if snapshot is None:
+        if snapshot_id in (await memory_snapshots.status(db))['pending_snapshots']:
+            raise HTTPException(status_code=409, detail='Snapshot ainda não foi tirado pelo worker rastreado')
+        raise HTTPException(status_code=404, detail='Snapshot não encontrado')
+    return snapshot
+
+@router.get('/api/admin/memory')
+async def get_memory_status(
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    return await memory_snapshots.status(db)
+
+@router.post('/api/admin/memory/start')
+async def start_memory_tracing(
+    frames: int = 10,
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    if not 1 <= frames <= 50:
+        raise HTTPException(status_code=400, detail='Quantidade de frames inválida')
+    try:
+        await memory_snapshots.start(db, frames)
+    except MemoryTracingBusy as busy:
+        raise HTTPException(status_code=409, detail=f'Rastreamento de memória já ativo no worker {busy}')
+    return await memory_snapshots.status(db)
+
+@router.post('/api/admin/memory/stop')
+async def stop_memory_tracing(
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    await memory_snapshots.stop(db)
+    return await memory_snapshots.status(db)
+
+@router.post('/api/admin/memory/snapshots')
+async def take_memory_snapshot(
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    # Served by any worker: queued for the traced one when it is not this one
+    try:
+        snapshot = await memory_snapshots.request(db)
+    except MemoryTracingInactive:
+        raise HTTPException(status_code=409, detail='Rastreamento de memória não está ativo')
+    return {**snapshot, **await memory_snapshots.status(db)}
+
+@router.get('/api/admin/memory/snapshots/{snapshot_id}/top')
+async def get_memory_top(
+    snapshot_id: str,
+    group_by: str = 'module',
+    limit: int = 25,
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    snapshot = await _memory_snapshot(db, snapshot_id)
+    return memory_snapshots.top(snapshot, _memory_group(group_by), limit)
+
+@router.get('/api/admin/memory/diff')
+async def get_memory_diff(
+    base: str,
+    target: str,
+    group_by: str = 'module',
+    limit: int = 25,
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    base_snapshot = await _memory_snapshot(db, base)
+    target_snapshot = await _memory_snapshot(db, target)
+    return memory_snapshots.diff(base_snapshot, target_snapshot, _memory_group(group_by), limit)
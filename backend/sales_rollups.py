@@ -0,0 +1,164 @@
+from pymongo import UpdateOne
+from occupancy import PARK_TIMEZONE_NAME, to_park_time
+from order_schema import order_items, item_expression
+from archive import archive_collections
+from datetime import datetime
+import logging
+
+ROLLUP_COLLECTION = 'daily_sales'
+APPROVED = 'approved'
+
+# Only what the rollup needs from an order
+ORDER_PROJECTION = {'v': 1, 'visit_date': 1, 'created_at': 1, 'items': 1, 'payment_status': 1}
+
+logger = logging.getLogger(__name__)
+
+def sale_date(created_at: datetime) -> str:
+    return to_park_time(created_at).date().isoformat()
+
+def _lines(order: dict) -> dict:
+    """ticket_id -> (tickets, revenue) for an order's items."""
+    lines = {}
+    for item in order_items(order):
+        ticket_id = item['ticket_id'] or 'unknown'
+        quantity = item['quantity']
+        revenue = quantity * item['unit_price']
+        tickets, total = lines.get(ticket_id, (0, 0.0))
+        lines[ticket_id] = (tickets + quantity, total + revenue)
+    return lines
+
+def approval_change(before_status: str, after_status: str) -> int:
+    """+1 when an order enters `approved`, -1 when it leaves, 0 otherwise."""
+    return int(after_status == APPROVED) - int(before_status == APPROVED)
+
+async def apply_order(db, order: dict, sign: int):
+    """Add (sign=1) or remove (sign=-1) one order's lines from the rollups."""
+    if not sign or not order.get('created_at'):
+        return
+    visit_date = order.get('visit_date')
+    sold_on = sale_date(order['created_at'])
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {'visit_date': visit_date, 'sale_date': sold_on, 'ticket_id': ticket_id},
+            {
+                '$inc': {'orders': sign, 'tickets': sign * tickets, 'revenue': sign * revenue},
+                '$set': {'updated_at': now}
+            },
+            upsert=True
+        )
+        for ticket_id, (tickets, revenue) in _lines(order).items()
+    ]
+    if operations:
+        await db[ROLLUP_COLLECTION].bulk_write(operations, ordered=False)
+
+def rebuild_pipeline(match: dict, archives: list = ()) -> list:
+    """Rollups for the approved orders in `orders` and in the `archives` collections."""
+    match = {**match, 'payment_status': APPROVED}
+    return [{'$match': match}] + [
+        {'$unionWith': {'coll': name, 'pipeline': [{'$match': match}]}} for name in archives
+    ] + [
+        {'$unwind': '$items'},
+        # Both order schema versions, under the v1 item field names
+        {'$set': {
+            'items.ticketId': item_expression('ticketId', 't'),
+            'items.quantity': item_expression('quantity', 'q'),
+            'items.unitPrice': item_expression('unitPrice', 'p')
+        }},
+        {'$group': {
+            '_id': {
+                'visit_date': '$visit_date',
+                'sale_date': {'$dateToString': {
+                    'date': '$created_at', 'format': '%Y-%m-%d', 'timezone': PARK_TIMEZONE_NAME
+                }},
+                'ticket_id': {'$ifNull': ['$items.ticketId', 'unknown']}
+            },
+            'order_ids': {'$addToSet': '$_id'},
+            'tickets': {'$sum': {'$toInt': '$items.quantity'}},
+            'revenue': {'$sum': {'$multiply': [
+                {'$toInt': '$items.quantity'}, {'$toDouble': {'$ifNull': ['$items.unitPrice', 0]}}
+            ]}}
+        }},
+        {'$project': {
+            '_id': 0,
+            'visit_date': '$_id.visit_date',
+            'sale_date': '$_id.sale_date',
+            'ticket_id': '$_id.ticket_id',
+            'orders': {'$size': '$order_ids'},
+            'tickets': 1,
+            'revenue': 1,
+            'updated_at': '$$NOW'
+        }},
+        {'$merge': {
+            'into': ROLLUP_COLLECTION,
+            'on': ['visit_date', 'sale_date', 'ticket_id'],
+            'whenMatched': 'replace',
+            'whenNotMatched': 'insert'
+        }}
+    ]
+
+async def rebuild(db, visit_from: str = None, visit_to: str = None) -> dict:
+    """Recompute the rollups for a visit-date range (everything by default) from orders.
+
+    Webhooks landing while a range is rebuilt may be counted twice or not at
+    all; run it off-peak, or again afterwards.
+    """
+    match = {}
+    if visit_from or visit_to:
+        match['visit_date'] = {}
+        if visit_from:
+            match['visit_date']['$gte'] = visit_from
+        if visit_to:
+            match['visit_date']['$lte'] = visit_to
+
+    started_at = datetime.utcnow()
+    removed = await db[ROLLUP_COLLECTION].delete_many(match)
+    await db.orders.aggregate(rebuild_pipeline(match, await archive_collections(db))).to_list(None)
+    rows = await db[ROLLUP_COLLECTION].count_documents(match)
+    logger.info('Daily sales rollups rebuilt', extra={'removed': removed.deleted_count, 'rows': rows})
+    return {
+        'removed': removed.deleted_count,
+        'rows': rows,
+        'seconds': round((datetime.utcnow() - started_at).total_seconds(), 2)
+    }
+
+def report_pipeline(by: str, start: str, end: str, group_by_ticket: bool) -> list:
+    match = {}
+    if start or end:
+        match[by] = {}
+        if start:
+            match[by]['$gte'] = start
+        if end:
+            match[by]['$lte'] = end
+    key = '$ticket_id' if group_by_ticket else f'${by}'
+    # `orders` counts orders containing a ticket type, so it only adds up per type
+    group = {'_id': key, 'tickets': {'$sum': '$tickets'}, 'revenue': {'$sum': '$revenue'}}
+    if group_by_ticket:
+        group['orders'] = {'$sum': '$orders'}
+    return [
+        {'$match': match},
+        {'$group': group},
+        {'$match': {'tickets': {'$ne': 0}}},
+        {'$sort': {'_id': 1}}
+    ]
+
+if __name__ == '__main__':
+    # python sales_rollups.py [visit_from] [visit_to]
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+    from pathlib import Path
+    import asyncio
+    import os
+    import sys
+
+    load_dotenv(Path(__file__).parent / '.env')
+
+    async def main():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        try:
+            result = await rebuild(client[os.environ['DB_NAME']], *sys.argv[1:3])
+            print(result)
+        finally:
+            client.close()
+
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta, timezone
+from pymongo.errors import CollectionInvalid
+from occupancy import PARK_TIMEZONE, PARK_TIMEZONE_NAME
+from metrics import scans
+import os
+import logging
+
+SCAN_EVENTS_COLLECTION = 'scan_events'
+SCAN_EVENTS_RETENTION_DAYS = int(os.getenv('SCAN_EVENTS_RETENTION_DAYS', '730'))
+# Every scan is already stored in scan_events; the log only needs a sample
+SCAN_LOG_SAMPLE_RATE = float(os.getenv('SCAN_LOG_SAMPLE_RATE', '0.01'))
+
+logger = logging.getLogger(__name__)
+
+OUTCOME_ACCEPTED = 'accepted'
+OUTCOME_NOT_FOUND = 'not_found'
+OUTCOME_ALREADY_USED = 'already_used'
+OUTCOME_PAYMENT_NOT_APPROVED = 'payment_not_approved'
+OUTCOME_OUTSIDE_SLOT = 'outside_slot'
+
+async def ensure_scan_events_collection(db):
+    try:
+        await db.create_collection(
+            SCAN_EVENTS_COLLECTION,
+            timeseries={'timeField': 'scanned_at', 'metaField': 'meta', 'granularity': 'seconds'},
+            expireAfterSeconds=SCAN_EVENTS_RETENTION_DAYS * 24 * 60 * 60
+        )
+    except CollectionInvalid:
+        pass  # Already exists
+
+async def record_scan(db, outcome: str, ticket_code: str, gate: str, staff: dict,
+                      order: dict = None, quantity: int = 0, scanned_at: datetime = None):
+    scans.inc(outcome, gate)
+    logger.info('Ticket scanned', extra={
+        'outcome': outcome, 'gate': gate, 'ticket_code': ticket_code,
+        'staff_id': staff['id'], 'sample_rate': SCAN_LOG_SAMPLE_RATE
+    })
+    await db[SCAN_EVENTS_COLLECTION].insert_one({
+        'scanned_at': scanned_at or datetime.utcnow(),
+        'meta': {'gate': gate, 'staff_id': staff['id'], 'outcome': outcome},
+        'staff_name': staff.get('name'),
+        'ticket_code': ticket_code,
+        'order_id': order.get('order_id') if order else None,
+        'quantity': quantity
+    })
+
+def parse_range(start: str, end: str):
+    """Parse ISO dates/datetimes given in park time into naive UTC bounds."""
+    bounds = []
+    for value in (start, end):
+        moment = datetime.fromisoformat(value)
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=PARK_TIMEZONE)
+        bounds.append(moment.astimezone(timezone.utc).replace(tzinfo=None))
+    if len(end) == 10:  # A plain date includes the whole day
+        bounds[1] += timedelta(days=1)
+    return bounds[0], bounds[1]
+
+def _bucket(interval_minutes: int) -> dict:
+    return {'$dateTrunc': {
+        'date': '$scanned_at',
+        'unit': 'minute',
+        'binSize': interval_minutes,
+        'timezone': PARK_TIMEZONE_NAME
+    }}
+
+def _match(start: datetime, end: datetime, gate: str = None) -> dict:
+    match = {'scanned_at': {'$gte': start, '$lt': end}}
+    if gate:
+        match['meta.gate'] = gate
+    return {'$match': match}
+
+def throughput_pipeline(start: datetime, end: datetime, interval_minutes: int, gate: str = None) -> list:
+    accepted = {'$eq': ['$meta.outcome', OUTCOME_ACCEPTED]}
+    return [
+        _match(start, end, gate),
+        {'$group': {
+            '_id': {'bucket': _bucket(interval_minutes), 'gate': '$meta.gate'},
+            'scans': {'$sum': 1},
+            'accepted': {'$sum': {'$cond': [accepted, 1, 0]}},
+            'entries': {'$sum': {'$cond': [accepted, '$quantity', 0]}}
+        }},
+        {'$project': {
+            '_id': 0,
+            'bucket': '$_id.bucket',
+            'gate': '$_id.gate',
+            'scans': 1,
+            'accepted': 1,
+            'rejected': {'$subtract': ['$scans', '$accepted']},
+            'entries': 1,
+            'rejection_rate': {'$divide': [{'$subtract': ['$scans', '$accepted']}, '$scans']}
+        }},
+        {'$sort': {'bucket': 1, 'gate': 1}}
+    ]
+
+def rejections_pipeline(start: datetime, end: datetime, interval_minutes: int, gate: str = None) -> list:
+    return [
+        _match(start, end, gate),
+        {'$match': {'meta.outcome': {'$ne': OUTCOME_ACCEPTED}}},
+        {'$group': {
+            '_id': {'bucket': _bucket(interval_minutes), 'outcome': '$meta.outcome'},
+            'count': {'$sum': 1}
+        }},
+        {'$group': {
+            '_id': '$_id.bucket',
+            'total': {'$sum': '$count'},
+            'by_outcome': {'$push': {'k': '$_id.outcome', 'v': '$count'}}
+        }},
+        {'$project': {'_id': 0, 'bucket': '$_id', 'total': 1, 'by_outcome': {'$arrayToObject': '$by_outcome'}}},
+        {'$sort': {'bucket': 1}}
+    ]
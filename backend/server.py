@@ -1,8 +1,10 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 from contextlib import asynccontextmanager
+import asyncio
 import os
 import logging
 from pathlib import Path
@@ -14,20 +16,58 @@ load_dotenv(ROOT_DIR / '.env')
 from routes import router as admin_router
 from customer_routes import router as customer_router
 from ticket_routes import router as ticket_router
+from voucher_routes import router as voucher_router, fail_stale_jobs
+from export_routes import router as export_router
+from report_routes import router as report_router
+from auth import token_versions, password_executor, calibrate_bcrypt_rounds
+from occupancy import occupancy
+from scan_events import ensure_scan_events_collection
+from vouchers import shutdown_voucher_pool
+from loop_monitor import loop_monitor
+from request_context import RequestContextMiddleware
+from metrics import MetricsMiddleware, registry
+from mongo_profiler import command_profiler
+from request_profiler import ProfilerMiddleware
+from indexes import ensure_indexes, check_query_plans
+from dashboard_counters import ensure_counters, reconcile_forever
+from load_shedding import LoadSheddingMiddleware
+from structured_logging import configure_logging, stop_logging
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    loop_monitor.start()
+    
     mongo_url = os.environ['MONGO_URL']
-    app.mongodb_client = AsyncIOMotorClient(mongo_url)
+    app.mongodb_client = AsyncIOMotorClient(mongo_url, event_listeners=[command_profiler])
     app.db = app.mongodb_client[os.environ['DB_NAME']]
     logging.info("MongoDB connected")
     
+    bcrypt_rounds = await password_executor.run(calibrate_bcrypt_rounds)
+    logging.info(f"bcrypt cost calibrated to {bcrypt_rounds} rounds")
+    
+    await token_versions.load(app.db)
+    await ensure_scan_events_collection(app.db)
+    await occupancy.refresh(app.db)
+    await ensure_indexes(app.db)
+    await check_query_plans(app.db)
+    await ensure_counters(app.db)
+    await fail_stale_jobs(app.db)
+    token_versions_task = asyncio.create_task(token_versions.refresh_forever(app.db))
+    counters_task = asyncio.create_task(reconcile_forever(app.db))
+    occupancy_task = asyncio.create_task(occupancy.refresh_forever(app.db))
+    
     yield
     
     # Shutdown
+    token_versions_task.cancel()
+    counters_task.cancel()
+    occupancy_task.cancel()
+    loop_monitor.stop()
+    shutdown_voucher_pool()
     app.mongodb_client.close()
     logging.info("MongoDB disconnected")
+    stop_logging()
 
 # Create the main app
 app = FastAPI(
@@ -41,6 +81,12 @@ app = FastAPI(
 app.include_router(admin_router)
 app.include_router(customer_router)
 app.include_router(ticket_router)
+app.include_router(voucher_router)
+app.include_router(export_router)
+app.include_router(report_router)
+
+# Innermost, so rejections still get CORS headers and show up in metrics
+app.add_middleware(LoadSheddingMiddleware)
 
 # CORS Configuration
 app.add_middleware(
@@ -49,15 +95,24 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(ProfilerMiddleware)
+app.add_middleware(RequestContextMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 @app.get("/api/health")
 async def health_check():
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy"}
+
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+@app.get("/metrics")
+async def prometheus_metrics(request: Request):
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        raise HTTPException(status_code=401, detail='Unauthorized')
+    return PlainTextResponse(registry.render(), media_type='text/plain; version=0.0.4')
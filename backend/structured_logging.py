@@ -0,0 +1,88 @@
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from request_context import request_id_var, current_route
+from metrics import registry
+import json
+import logging
+import os
+import queue
+import random
+import sys
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        request_id = request_id_var.get()
+        if request_id:
+            entry['request_id'] = request_id
+            entry['route'] = current_route()
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class SamplingFilter(logging.Filter):
+    """Keeps a record logged with extra={'sample_rate': r} with probability r."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = getattr(record, 'sample_rate', None)
+        return rate is None or random.random() < rate
+
+class DroppingQueueHandler(QueueHandler):
+    """Formats on the caller's thread (where the request context lives) and
+    never blocks it: when the writer falls behind, records are dropped and counted."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+queue_handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+queue_handler.setFormatter(JsonFormatter())
+queue_handler.addFilter(SamplingFilter())
+
+_listener = None
+
+def configure_logging():
+    """Routes every logger through the queue; a background thread writes to stdout."""
+    global _listener
+    if _listener is not None:
+        return
+
+    writer = logging.StreamHandler(sys.stdout)
+    writer.setFormatter(logging.Formatter('%(message)s'))
+    _listener = QueueListener(queue_handler.queue, writer)
+    _listener.start()
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()  # Flushes what is still queued
+        _listener = None
+
+registry.callback_gauge(
+    'log_records_dropped', 'Log records discarded because the writer queue was full',
+    lambda: {(): queue_handler.dropped}
+)
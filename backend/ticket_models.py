@@ -1,11 +1,22 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field, conint
+from typing import Optional, List
 from datetime import datetime, date
 
+class EntrySlot(BaseModel):
+    start: str  # HH:MM
+    capacity: int
+    tickets_sold: int = 0
+
+class EntrySlotCreate(BaseModel):
+    # slot_window() parses it with '%H:%M' at the gate
+    start: str = Field(pattern=r'^([01]\d|2[0-3]):[0-5]\d$')
+    capacity: conint(ge=1)
+
 class TicketAvailability(BaseModel):
     date: str  # YYYY-MM-DD
     total_tickets: int
     tickets_sold: int = 0
+    slots: List[EntrySlot] = []
     is_active: bool = True
     created_at: datetime = datetime.utcnow()
     updated_at: datetime = datetime.utcnow()
@@ -13,9 +24,11 @@ class TicketAvailability(BaseModel):
 class TicketAvailabilityCreate(BaseModel):
     date: str
     total_tickets: int
+    slots: List[EntrySlotCreate] = []
 
 class TicketAvailabilityUpdate(BaseModel):
     total_tickets: Optional[int] = None
+    slots: Optional[List[EntrySlotCreate]] = None
     is_active: Optional[bool] = None
 
 class TicketValidation(BaseModel):
@@ -40,4 +53,8 @@ class StaffUserCreate(BaseModel):
 
 class StaffLogin(BaseModel):
     email: str
-    password: str
\ No newline at end of file
+    password: str
+
+class VoucherJobCreate(BaseModel):
+    order_ids: List[str] = []
+    visit_date: Optional[str] = None
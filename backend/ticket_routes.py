@@ -1,12 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, Query, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from ticket_models import (
     TicketAvailability, TicketAvailabilityCreate, TicketAvailabilityUpdate,
     StaffUserCreate, StaffLogin, TicketValidation
 )
-from auth import verify_password, get_password_hash, create_access_token, decode_access_token
+from auth import (
+    verify_password_async, get_password_hash_async, upgrade_password_hash, create_access_token,
+    get_current_staff, get_current_admin_user, token_versions
+)
+from occupancy import occupancy, order_quantity, park_now, DEFAULT_GATE
+from order_schema import order_view
+from archive import find_order
+from scan_events import (
+    record_scan, parse_range, throughput_pipeline, rejections_pipeline,
+    OUTCOME_ACCEPTED, OUTCOME_NOT_FOUND, OUTCOME_ALREADY_USED, OUTCOME_PAYMENT_NOT_APPROVED,
+    OUTCOME_OUTSIDE_SLOT
+)
+from login_throttle import login_throttle, client_ip
+from pagination import paginate, set_next_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from availability import find_slot, slot_remaining, public_slots, merge_slots, slot_window
 from datetime import datetime, timedelta
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 import uuid
 
 router = APIRouter()
@@ -18,11 +34,26 @@ async def get_database(request: Request) -> AsyncIOMotorDatabase:
 
 @router.get('/api/admin/ticket-availability')
 async def get_ticket_availability(
+    response: Response,
+    cursor: str = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    date_from: str = None,
+    date_to: str = None,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    availabilities = await db.ticket_availability.find({}).sort('date', 1).to_list(100)
+    query = {}
+    if date_from or date_to:
+        query['date'] = {}
+        if date_from:
+            query['date']['$gte'] = date_from
+        if date_to:
+            query['date']['$lte'] = date_to
+    availabilities, next_cursor = await paginate(db.ticket_availability, query, 'date', 1, limit, cursor)
+    set_next_cursor(response, next_cursor)
     for item in availabilities:
         item['_id'] = str(item['_id'])
+        for slot in item.get('slots', []):
+            slot['remaining'] = slot_remaining(slot)
     return availabilities
 
 @router.post('/api/admin/ticket-availability')
@@ -30,18 +61,17 @@ async def create_ticket_availability(
     availability: TicketAvailabilityCreate,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    # Check if date already exists
-    existing = await db.ticket_availability.find_one({'date': availability.date})
-    if existing:
-        raise HTTPException(status_code=400, detail='Disponibilidade já existe para esta data')
-    
     availability_dict = availability.dict()
     availability_dict['tickets_sold'] = 0
+    availability_dict['slots'] = merge_slots(availability_dict['slots'], [])
     availability_dict['is_active'] = True
     availability_dict['created_at'] = datetime.utcnow()
     availability_dict['updated_at'] = datetime.utcnow()
     
-    result = await db.ticket_availability.insert_one(availability_dict)
+    try:
+        result = await db.ticket_availability.insert_one(availability_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail='Disponibilidade já existe para esta data')
     return {'id': str(result.inserted_id), 'message': 'Disponibilidade criada com sucesso'}
 
 @router.put('/api/admin/ticket-availability/{date}')
@@ -53,6 +83,12 @@ async def update_ticket_availability(
     update_data = {k: v for k, v in availability.dict().items() if v is not None}
     update_data['updated_at'] = datetime.utcnow()
     
+    if 'slots' in update_data:
+        existing = await db.ticket_availability.find_one({'date': date}, {'slots': 1})
+        if not existing:
+            raise HTTPException(status_code=404, detail='Disponibilidade não encontrada')
+        update_data['slots'] = merge_slots(update_data['slots'], existing.get('slots'))
+    
     result = await db.ticket_availability.update_one(
         {'date': date},
         {'$set': update_data}
@@ -80,6 +116,7 @@ async def delete_ticket_availability(
 async def check_availability(
     date: str,
     quantity: int,
+    entry_slot: str = None,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     availability = await db.ticket_availability.find_one({'date': date, 'is_active': True})
@@ -88,11 +125,18 @@ async def check_availability(
         return {'available': False, 'message': 'Não há disponibilidade configurada para esta data'}
     
     available_tickets = availability['total_tickets'] - availability['tickets_sold']
+    slots = public_slots(availability)
+    
+    if entry_slot:
+        slot = find_slot(availability, entry_slot)
+        if not slot:
+            return {'available': False, 'remaining': available_tickets, 'slots': slots, 'message': 'Horário de entrada inválido'}
+        available_tickets = min(available_tickets, slot_remaining(slot))
     
     if available_tickets >= quantity:
-        return {'available': True, 'remaining': available_tickets}
+        return {'available': True, 'remaining': available_tickets, 'slots': slots}
     else:
-        return {'available': False, 'remaining': available_tickets, 'message': f'Apenas {available_tickets} ingressos disponíveis'}
+        return {'available': False, 'remaining': available_tickets, 'slots': slots, 'message': f'Apenas {available_tickets} ingressos disponíveis'}
 
 # ============= STAFF MANAGEMENT (ADMIN) =============
 
@@ -101,29 +145,35 @@ async def create_staff(
     staff_data: StaffUserCreate,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    # Check if email already exists
-    existing = await db.staff_users.find_one({'email': staff_data.email})
-    if existing:
+    # Checked before hashing so duplicates cost no bcrypt work; the unique index
+    # still rejects the ones that race past it
+    if await db.staff_users.find_one({'email': staff_data.email}, {'_id': 1}):
         raise HTTPException(status_code=400, detail='Email já cadastrado')
     
     staff_dict = staff_data.dict()
-    staff_dict['hashed_password'] = get_password_hash(staff_data.password)
+    staff_dict['hashed_password'] = await get_password_hash_async(staff_data.password)
     del staff_dict['password']
     staff_dict['role'] = 'staff'
     staff_dict['is_active'] = True
     staff_dict['created_at'] = datetime.utcnow()
     
-    result = await db.staff_users.insert_one(staff_dict)
+    try:
+        result = await db.staff_users.insert_one(staff_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail='Email já cadastrado')
     return {'id': str(result.inserted_id), 'message': 'Funcionário criado com sucesso'}
 
 @router.get('/api/admin/staff')
 async def get_staff(
+    response: Response,
+    cursor: str = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    staff_list = await db.staff_users.find({}).to_list(100)
+    staff_list, next_cursor = await paginate(db.staff_users, {}, '_id', 1, limit, cursor, {'hashed_password': 0})
+    set_next_cursor(response, next_cursor)
     for staff in staff_list:
         staff['_id'] = str(staff['_id'])
-        del staff['hashed_password']
     return staff_list
 
 @router.delete('/api/admin/staff/{staff_id}')
@@ -136,6 +186,9 @@ async def delete_staff(
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail='Funcionário não encontrado')
     
+    # Tokens already issued to this staff member stop working immediately
+    await token_versions.revoke(db, 'staff', staff_id)
+    
     return {'message': 'Funcionário removido com sucesso'}
 
 # ============= STAFF LOGIN =============
@@ -143,10 +196,19 @@ async def delete_staff(
 @router.post('/api/staff/login')
 async def staff_login(
     login_data: StaffLogin,
+    request: Request,
+    background_tasks: BackgroundTasks,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
+    # Throttled before any lookup or bcrypt work
+    ip = client_ip(request)
+    account = f'staff:{login_data.email.lower()}'
+    await login_throttle.check(db, ip, account)
+    
     staff = await db.staff_users.find_one({'email': login_data.email})
-    if not staff or not verify_password(login_data.password, staff['hashed_password']):
+    valid, needs_rehash = await verify_password_async(login_data.password, staff['hashed_password']) if staff else (False, False)
+    if not valid:
+        await login_throttle.record_failure(db, ip, account)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail='Email ou senha incorretos'
@@ -158,7 +220,16 @@ async def staff_login(
             detail='Conta desativada'
         )
     
-    access_token = create_access_token(data={'sub': staff['email'], 'type': 'staff'})
+    await login_throttle.record_success(db, account)
+    if needs_rehash:
+        background_tasks.add_task(upgrade_password_hash, db.staff_users, staff['_id'], staff['hashed_password'], login_data.password)
+    access_token = create_access_token(data={
+        'sub': staff['email'],
+        'type': 'staff',
+        'id': str(staff['_id']),
+        'name': staff['name'],
+        'role': staff.get('role', 'staff')
+    })
     
     return {
         'access_token': access_token,
@@ -172,28 +243,11 @@ async def staff_login(
     }
 
 @router.get('/api/staff/me')
-async def get_staff_info(
-    request: Request,
-    db: AsyncIOMotorDatabase = Depends(get_database)
-):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        raise HTTPException(status_code=401, detail='Token não fornecido')
-    
-    token = auth_header.split(' ')[1]
-    payload = decode_access_token(token)
-    
-    if not payload or payload.get('type') != 'staff':
-        raise HTTPException(status_code=401, detail='Token inválido')
-    
-    staff = await db.staff_users.find_one({'email': payload['sub']})
-    if not staff:
-        raise HTTPException(status_code=404, detail='Funcionário não encontrado')
-    
+async def get_staff_info(staff: dict = Depends(get_current_staff)):
     return {
-        'id': str(staff['_id']),
+        'id': staff['id'],
         'name': staff['name'],
-        'email': staff['email'],
+        'email': staff['sub'],
         'role': staff.get('role', 'staff')
     }
 
@@ -202,33 +256,21 @@ async def get_staff_info(
 @router.post('/api/staff/validate-ticket')
 async def validate_ticket(
     validation_data: dict,
-    request: Request,
+    staff: dict = Depends(get_current_staff),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    # Get staff info
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        raise HTTPException(status_code=401, detail='Token não fornecido')
-    
-    token = auth_header.split(' ')[1]
-    payload = decode_access_token(token)
-    
-    if not payload or payload.get('type') != 'staff':
-        raise HTTPException(status_code=401, detail='Token inválido')
-    
-    staff = await db.staff_users.find_one({'email': payload['sub']})
-    if not staff:
-        raise HTTPException(status_code=404, detail='Funcionário não encontrado')
-    
     # Find order by ticket code
     ticket_code = validation_data.get('ticket_code')
-    order = await db.orders.find_one({'ticket_code': ticket_code})
+    gate = validation_data.get('gate') or DEFAULT_GATE
+    orders, order = await find_order(db, {'ticket_code': ticket_code})
     
     if not order:
+        await record_scan(db, OUTCOME_NOT_FOUND, ticket_code, gate, staff)
         raise HTTPException(status_code=404, detail='Ingresso não encontrado')
     
     # Check if already validated
     if order.get('validated', False):
+        await record_scan(db, OUTCOME_ALREADY_USED, ticket_code, gate, staff, order)
         return {
             'valid': False,
             'message': 'Ingresso já foi utilizado',
@@ -238,24 +280,47 @@ async def validate_ticket(
     
     # Check payment status
     if order.get('payment_status') != 'approved':
+        await record_scan(db, OUTCOME_PAYMENT_NOT_APPROVED, ticket_code, gate, staff, order)
         return {
             'valid': False,
             'message': f'Pagamento não aprovado. Status: {order.get("payment_status")}'
         }
     
-    # Validate ticket
-    await db.orders.update_one(
-        {'_id': order['_id']},
+    # Check the entry slot window
+    if order.get('entry_slot'):
+        opens_at, closes_at = slot_window(order['visit_date'], order['entry_slot'])
+        now = park_now()
+        if not opens_at <= now <= closes_at:
+            await record_scan(db, OUTCOME_OUTSIDE_SLOT, ticket_code, gate, staff, order)
+            return {
+                'valid': False,
+                'message': f'Fora do horário de entrada ({order["visit_date"]} {order["entry_slot"]})',
+                'entry_slot': order['entry_slot']
+            }
+    
+    # Validate ticket (conditional so concurrent scans only count once)
+    validated_at = datetime.utcnow()
+    result = await orders.update_one(
+        {'_id': order['_id'], 'validated': {'$ne': True}},
         {
             '$set': {
                 'validated': True,
-                'validated_at': datetime.utcnow(),
-                'validated_by': str(staff['_id']),
-                'validated_by_name': staff['name']
+                'validated_at': validated_at,
+                'validated_by': staff['id'],
+                'validated_by_name': staff['name'],
+                'validated_gate': gate
             }
         }
     )
     
+    if result.modified_count == 0:
+        await record_scan(db, OUTCOME_ALREADY_USED, ticket_code, gate, staff, order)
+        return {'valid': False, 'message': 'Ingresso já foi utilizado'}
+    
+    quantity = order_quantity(order)
+    await record_scan(db, OUTCOME_ACCEPTED, ticket_code, gate, staff, order, quantity, validated_at)
+    occupancy.record(gate, staff['id'], staff['name'], quantity, validated_at)
+    
     return {
         'valid': True,
         'message': 'Ingresso validado com sucesso!',
@@ -264,29 +329,18 @@ async def validate_ticket(
             'customer_name': order['customer']['name'],
             'visit_date': order['visit_date'],
             'total_amount': order['total_amount'],
-            'items': order['items']
+            'items': order_view(order)['items']
         }
     }
 
 @router.get('/api/staff/ticket-info/{ticket_code}')
 async def get_ticket_info(
     ticket_code: str,
-    request: Request,
+    staff: dict = Depends(get_current_staff),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    # Verify staff token
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        raise HTTPException(status_code=401, detail='Token não fornecido')
-    
-    token = auth_header.split(' ')[1]
-    payload = decode_access_token(token)
-    
-    if not payload or payload.get('type') != 'staff':
-        raise HTTPException(status_code=401, detail='Token inválido')
-    
     # Find order
-    order = await db.orders.find_one({'ticket_code': ticket_code})
+    _, order = await find_order(db, {'ticket_code': ticket_code})
     
     if not order:
         raise HTTPException(status_code=404, detail='Ingresso não encontrado')
@@ -301,5 +355,70 @@ async def get_ticket_info(
         'validated': order.get('validated', False),
         'validated_at': order.get('validated_at'),
         'validated_by_name': order.get('validated_by_name'),
-        'items': order['items']
-    }
\ No newline at end of file
+        'items': order_view(order)['items']
+    }
+
+# ============= OCCUPANCY (ADMIN) =============
+
+OCCUPANCY_HEARTBEAT_SECONDS = 15
+
+@router.get('/api/admin/occupancy')
+async def get_occupancy(current_user: dict = Depends(get_current_admin_user)):
+    return occupancy.snapshot()
+
+@router.get('/api/admin/occupancy/stream')
+async def stream_occupancy(
+    request: Request,
+    current_user: dict = Depends(get_current_admin_user)
+):
+    async def event_stream():
+        version = occupancy.version
+        yield f"data: {occupancy.payload()}\n\n"
+        while not await request.is_disconnected():
+            if await occupancy.wait_for_change(version, OCCUPANCY_HEARTBEAT_SECONDS):
+                version = occupancy.version
+                yield f"data: {occupancy.payload()}\n\n"
+            else:
+                yield ': keep-alive\n\n'
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# ============= SCAN ANALYTICS (ADMIN) =============
+
+def _scan_range(start: str, end: str, interval: int):
+    if interval < 1 or interval > 24 * 60:
+        raise HTTPException(status_code=400, detail='Intervalo inválido')
+    try:
+        return parse_range(start, end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail='Período inválido')
+
+@router.get('/api/admin/scan-analytics/throughput')
+async def get_scan_throughput(
+    start: str,
+    end: str,
+    interval: int = 5,
+    gate: str = None,
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    range_start, range_end = _scan_range(start, end, interval)
+    pipeline = throughput_pipeline(range_start, range_end, interval, gate)
+    return await db.scan_events.aggregate(pipeline).to_list(None)
+
+@router.get('/api/admin/scan-analytics/rejections')
+async def get_scan_rejections(
+    start: str,
+    end: str,
+    interval: int = 5,
+    gate: str = None,
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    range_start, range_end = _scan_range(start, end, interval)
+    pipeline = rejections_pipeline(range_start, range_end, interval, gate)
+    return await db.scan_events.aggregate(pipeline).to_list(None)
@@ -0,0 +1,197 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import FileResponse, Response
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from ticket_models import VoucherJobCreate
+from auth import get_current_admin_user
+from archive import find_order
+from vouchers import (
+    QR_MEDIA_TYPES, VOUCHER_DIR, VOUCHER_WORKERS, cached_qr,
+    render_voucher_pdf, voucher_from_order, get_voucher_pool
+)
+from datetime import datetime, timedelta
+import asyncio
+import logging
+import uuid
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+MAX_VOUCHER_ORDERS = 500
+VOUCHER_JOB_HEARTBEAT_SECONDS = 30
+# A running job without a heartbeat for this long died with its worker
+VOUCHER_JOB_STALE_AFTER = timedelta(minutes=2)
+
+async def get_database(request: Request) -> AsyncIOMotorDatabase:
+    return request.app.db
+
+# ============= QR CODES =============
+
+@router.get('/api/orders/{order_id}/qrcode')
+async def get_order_qrcode(
+    order_id: str,
+    format: str = 'png',
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    if format not in QR_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail='Formato inválido. Use png ou svg')
+    
+    _, order = await find_order(db, {'order_id': order_id}, {'ticket_code': 1})
+    if not order or not order.get('ticket_code'):
+        raise HTTPException(status_code=404, detail='Pedido não encontrado')
+    
+    content = await asyncio.to_thread(cached_qr, order['ticket_code'], format)
+    
+    return Response(
+        content,
+        media_type=QR_MEDIA_TYPES[format],
+        headers={'Cache-Control': 'private, max-age=86400'}
+    )
+
+# ============= VOUCHER JOBS (ADMIN) =============
+
+# Keeps running jobs referenced until they finish
+_running_jobs = set()
+
+async def fail_stale_jobs(db: AsyncIOMotorDatabase):
+    # Jobs whose worker stopped (restart, crash) would otherwise stay 'running'
+    cutoff = datetime.utcnow() - VOUCHER_JOB_STALE_AFTER
+    result = await db.voucher_jobs.update_many(
+        {'status': 'running', '$or': [
+            {'heartbeat_at': {'$lt': cutoff}},
+            {'heartbeat_at': {'$exists': False}, 'created_at': {'$lt': cutoff}}
+        ]},
+        {'$set': {'status': 'failed', 'error': 'Interrompido', 'finished_at': datetime.utcnow()}}
+    )
+    if result.modified_count:
+        logger.warning('Marked %d interrupted voucher jobs as failed', result.modified_count)
+
+async def _heartbeat(db: AsyncIOMotorDatabase, job_id: str):
+    while True:
+        await asyncio.sleep(VOUCHER_JOB_HEARTBEAT_SECONDS)
+        try:
+            await db.voucher_jobs.update_one({'job_id': job_id}, {'$set': {'heartbeat_at': datetime.utcnow()}})
+        except Exception:
+            logger.exception('Voucher job %s heartbeat failed', job_id)
+
+async def run_voucher_job(db: AsyncIOMotorDatabase, job_id: str, vouchers: list):
+    loop = asyncio.get_running_loop()
+    pool = get_voucher_pool()
+    job_dir = VOUCHER_DIR / job_id
+    
+    # Only as many renders in the pool as it has workers, so a failure stops
+    # the job before the rest are submitted
+    slots = asyncio.Semaphore(VOUCHER_WORKERS)
+    failed = asyncio.Event()
+    
+    async def render(voucher):
+        async with slots:
+            if failed.is_set():
+                return
+            output_path = str(job_dir / f"{voucher['order_id']}.pdf")
+            try:
+                await loop.run_in_executor(pool, render_voucher_pdf, voucher, output_path)
+            except Exception:
+                failed.set()
+                raise
+        await db.voucher_jobs.update_one(
+            {'job_id': job_id},
+            {'$push': {'files': voucher['order_id']}, '$inc': {'completed': 1}}
+        )
+    
+    # Waits for the renders already running, so nothing finishes after the job is marked
+    heartbeat = asyncio.create_task(_heartbeat(db, job_id))
+    try:
+        results = await asyncio.gather(*(render(voucher) for voucher in vouchers), return_exceptions=True)
+    finally:
+        heartbeat.cancel()
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        logger.error('Voucher job %s failed', job_id, exc_info=errors[0])
+        job_status = 'failed'
+    else:
+        job_status = 'completed'
+    
+    await db.voucher_jobs.update_one(
+        {'job_id': job_id},
+        {'$set': {'status': job_status, 'finished_at': datetime.utcnow()}}
+    )
+
+@router.post('/api/admin/voucher-jobs')
+async def create_voucher_job(
+    job_data: VoucherJobCreate,
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    query = {'payment_status': 'approved', 'ticket_code': {'$exists': True}}
+    if job_data.order_ids:
+        query['order_id'] = {'$in': job_data.order_ids}
+    elif job_data.visit_date:
+        query['visit_date'] = job_data.visit_date
+    else:
+        raise HTTPException(status_code=400, detail='Informe os pedidos ou a data da visita')
+    
+    projection = {'order_id': 1, 'ticket_code': 1, 'customer.name': 1, 'visit_date': 1, 'entry_slot': 1, 'v': 1, 'items': 1}
+    orders = await db.orders.find(query, projection).to_list(MAX_VOUCHER_ORDERS + 1)
+    if not orders:
+        raise HTTPException(status_code=404, detail='Nenhum pedido aprovado encontrado')
+    if len(orders) > MAX_VOUCHER_ORDERS:
+        raise HTTPException(status_code=400, detail=f'Máximo de {MAX_VOUCHER_ORDERS} pedidos por lote')
+    
+    tickets = await db.tickets.find({}, {'ticket_id': 1, 'name': 1}).to_list(None)
+    ticket_names = {ticket['ticket_id']: ticket['name'] for ticket in tickets}
+    vouchers = [voucher_from_order(order, ticket_names) for order in orders]
+    
+    job_id = uuid.uuid4().hex
+    await db.voucher_jobs.insert_one({
+        'job_id': job_id,
+        'status': 'running',
+        'order_ids': [voucher['order_id'] for voucher in vouchers],
+        'total': len(vouchers),
+        'completed': 0,
+        'files': [],
+        'created_by': current_user['email'],
+        'created_at': datetime.utcnow(),
+        'heartbeat_at': datetime.utcnow()
+    })
+    
+    task = asyncio.create_task(run_voucher_job(db, job_id, vouchers))
+    _running_jobs.add(task)
+    task.add_done_callback(_running_jobs.discard)
+    
+    return {'job_id': job_id, 'total': len(vouchers), 'message': 'Geração de vouchers iniciada'}
+
+@router.get('/api/admin/voucher-jobs/{job_id}')
+async def get_voucher_job(
+    job_id: str,
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    await fail_stale_jobs(db)
+    job = await db.voucher_jobs.find_one({'job_id': job_id})
+    if not job:
+        raise HTTPException(status_code=404, detail='Lote não encontrado')
+    job['_id'] = str(job['_id'])
+    return job
+
+@router.get('/api/admin/voucher-jobs/{job_id}/files/{order_id}')
+async def download_voucher(
+    job_id: str,
+    order_id: str,
+    current_user: dict = Depends(get_current_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    job = await db.voucher_jobs.find_one({'job_id': job_id, 'files': order_id}, {'_id': 1})
+    if not job:
+        raise HTTPException(status_code=404, detail='Voucher não encontrado')
+    
+    # Files live on the disk of the instance that rendered them and do not
+    # survive a redeploy; the job then has to be generated again
+    path = VOUCHER_DIR / job_id / f'{order_id}.pdf'
+    if not path.exists():
+        raise HTTPException(status_code=404, detail='Arquivo do voucher não encontrado. Gere o lote novamente')
+    
+    return FileResponse(
+        path,
+        media_type='application/pdf',
+        filename=f'voucher-{order_id}.pdf'
+    )
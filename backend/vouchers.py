@@ -0,0 +1,172 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import hashlib
+import io
+import multiprocessing
+import os
+import tempfile
+
+from order_schema import order_items
+
+import qrcode
+import qrcode.image.svg
+from PIL import Image, ImageDraw, ImageFont
+
+ROOT_DIR = Path(__file__).parent
+QR_CACHE_DIR = Path(os.getenv('QR_CACHE_DIR', ROOT_DIR / 'cache' / 'qrcodes'))
+VOUCHER_DIR = Path(os.getenv('VOUCHER_DIR', ROOT_DIR / 'cache' / 'vouchers'))
+VOUCHER_WORKERS = int(os.getenv('VOUCHER_WORKERS', '2'))
+# Pages held in memory at once while a voucher PDF is written (about 1 MB each)
+VOUCHER_PAGE_CHUNK = int(os.getenv('VOUCHER_PAGE_CHUNK', '20'))
+QR_BOX_SIZE = 10
+QR_RENDER_VERSION = '1'  # Bump to invalidate cached images after a layout change
+
+QR_MEDIA_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# A4 at 100 dpi, greyscale keeps large group vouchers small in memory
+PAGE_SIZE = (827, 1169)
+PARK_NAME = 'Acqua Park Prazeres da Serra'
+VOUCHER_FONT = os.getenv('VOUCHER_FONT', 'DejaVuSans.ttf')
+
+# ============= QR CODES =============
+
+def _build_qr(data: str) -> qrcode.QRCode:
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, box_size=QR_BOX_SIZE, border=4)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr
+
+def render_qr(data: str, fmt: str) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == 'svg':
+        _build_qr(data).make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffer)
+    else:
+        _build_qr(data).make_image(fill_color='black', back_color='white').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def qr_cache_path(data: str, fmt: str) -> Path:
+    digest = hashlib.sha256(f'{QR_RENDER_VERSION}:{QR_BOX_SIZE}:{fmt}:{data}'.encode()).hexdigest()
+    return QR_CACHE_DIR / digest[:2] / f'{digest}.{fmt}'
+
+def _write_atomic(path: Path, content: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as tmp:
+        tmp.write(content)
+    os.replace(tmp_path, path)
+
+def cached_qr(data: str, fmt: str) -> bytes:
+    """Return the QR image for `data` from the cache, rendering it on a miss.
+
+    Reads the file instead of returning its path, so a cache cleaned in
+    between is just another miss. Blocking; callers on the event loop run
+    it in a thread.
+    """
+    path = qr_cache_path(data, fmt)
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        content = render_qr(data, fmt)
+        _write_atomic(path, content)
+        return content
+
+# ============= VOUCHERS =============
+
+def _font(size: int):
+    # Pillow's bundled font has no accented glyphs (customer names, 'Horário')
+    try:
+        return ImageFont.truetype(VOUCHER_FONT, size)
+    except OSError:
+        return ImageFont.load_default(size=size)
+
+def _voucher_page(voucher: dict, qr_image: Image.Image, index: int, count: int) -> Image.Image:
+    page = Image.new('L', PAGE_SIZE, 255)
+    draw = ImageDraw.Draw(page)
+    width, _ = PAGE_SIZE
+    margin = 60
+
+    draw.text((margin, margin), PARK_NAME, font=_font(36), fill=0)
+    draw.text((margin, margin + 50), 'Voucher de entrada', font=_font(24), fill=0)
+    draw.line((margin, margin + 95, width - margin, margin + 95), fill=0, width=2)
+
+    lines = [
+        f"Pedido: {voucher['order_id']}",
+        f"Cliente: {voucher['customer_name']}",
+        f"Data da visita: {voucher['visit_date']}",
+    ]
+    if voucher.get('entry_slot'):
+        lines.append(f"Horário de entrada: {voucher['entry_slot']}")
+    lines.append(f'Ingresso {index} de {count}')
+    for position, line in enumerate(lines):
+        draw.text((margin, margin + 130 + position * 40), line, font=_font(24), fill=0)
+
+    qr_top = margin + 150 + len(lines) * 40
+    page.paste(qr_image, ((width - qr_image.width) // 2, qr_top))
+    code_top = qr_top + qr_image.height + 20
+    draw.text((width // 2, code_top), voucher['ticket_code'], font=_font(28), fill=0, anchor='mt')
+
+    items_top = code_top + 70
+    for position, item in enumerate(voucher['items']):
+        draw.text((margin, items_top + position * 32), f"{item['quantity']}x {item['name']}", font=_font(20), fill=0)
+    return page
+
+def render_voucher_pdf(voucher: dict, output_path: str) -> str:
+    """Render one page per ticket of an order into a PDF. Runs in a worker process."""
+    qr_image = _build_qr(voucher['ticket_code']).make_image(fill_color='black', back_color='white')
+    qr_image = qr_image.get_image().convert('L')
+
+    count = max(1, sum(item['quantity'] for item in voucher['items']))
+    path = Path(output_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    os.close(fd)
+    try:
+        # Pages are written in chunks appended to the same PDF, so a large
+        # group order never holds all of its pages in memory
+        for first in range(1, count + 1, VOUCHER_PAGE_CHUNK):
+            last = min(count, first + VOUCHER_PAGE_CHUNK - 1)
+            pages = [_voucher_page(voucher, qr_image, index, count) for index in range(first, last + 1)]
+            pages[0].save(
+                tmp_path, format='PDF', save_all=True, append_images=pages[1:],
+                append=first > 1, resolution=100
+            )
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return output_path
+
+def voucher_from_order(order: dict, ticket_names: dict) -> dict:
+    # Plain, picklable data for the worker process
+    return {
+        'order_id': order['order_id'],
+        'ticket_code': order['ticket_code'],
+        'customer_name': order['customer']['name'],
+        'visit_date': order['visit_date'],
+        'entry_slot': order.get('entry_slot'),
+        'items': [
+            {
+                'name': ticket_names.get(item['ticket_id']) or item['name'] or item['ticket_id'],
+                'quantity': item['quantity']
+            }
+            for item in order_items(order)
+        ]
+    }
+
+_voucher_pool = None
+
+def get_voucher_pool() -> ProcessPoolExecutor:
+    global _voucher_pool
+    if _voucher_pool is None:
+        # spawn: forked children would inherit the running event loop and Mongo sockets
+        _voucher_pool = ProcessPoolExecutor(
+            max_workers=VOUCHER_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _voucher_pool
+
+def shutdown_voucher_pool():
+    global _voucher_pool
+    if _voucher_pool is not None:
+        _voucher_pool.shutdown(wait=False, cancel_futures=True)
+        _voucher_pool = None
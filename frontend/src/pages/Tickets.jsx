@@ -30,6 +30,7 @@ export default function Tickets() {
     phone: '',
     document: '',
     visitDate: '',
+    entrySlot: '',
     acceptTerms: false
   });
 
@@ -86,16 +87,12 @@ export default function Tickets() {
     return Object.values(cart).reduce((sum, qty) => sum + qty, 0);
   };
 
-  const handleDateChange = async (date) => {
-    setFormData({ ...formData, visitDate: date });
-    setSelectedDateInfo(null);
-    
-    if (!date) return;
-    
+  const checkAvailability = async (date, entrySlot) => {
     setCheckingAvailability(true);
     try {
       const totalQty = getTotalQuantity();
-      const response = await axios.get(`${API}/check-availability/${date}?quantity=${totalQty}`);
+      const slotParam = entrySlot ? `&entry_slot=${encodeURIComponent(entrySlot)}` : '';
+      const response = await axios.get(`${API}/check-availability/${date}?quantity=${totalQty}${slotParam}`);
       setSelectedDateInfo(response.data);
       
       if (!response.data.available) {
@@ -112,6 +109,23 @@ export default function Tickets() {
     }
   };
 
+  const handleDateChange = async (date) => {
+    setFormData({ ...formData, visitDate: date, entrySlot: '' });
+    setSelectedDateInfo(null);
+    
+    if (!date) return;
+    
+    await checkAvailability(date);
+  };
+
+  // Dates with timed entry: the order must name one of the date's slots
+  const handleSlotChange = async (entrySlot) => {
+    setFormData({ ...formData, entrySlot });
+    await checkAvailability(formData.visitDate, entrySlot);
+  };
+
+  const dateSlots = selectedDateInfo?.slots || [];
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     
@@ -133,6 +147,15 @@ export default function Tickets() {
       return;
     }
 
+    if (dateSlots.length > 0 && !formData.entrySlot) {
+      toast({
+        title: 'Horário de entrada',
+        description: 'Por favor, selecione um horário de entrada',
+        variant: 'destructive'
+      });
+      return;
+    }
+
     setIsProcessing(true);
 
     try {
@@ -157,7 +180,8 @@ export default function Tickets() {
         },
         items: items,
         total_amount: calculateTotal(),
-        visit_date: formData.visitDate
+        visit_date: formData.visitDate,
+        entry_slot: formData.entrySlot || null
       });
 
       if (response.data.init_point) {
@@ -431,6 +455,26 @@ export default function Tickets() {
                       </select>
                     </div>
 
+                    {dateSlots.length > 0 && (
+                      <div className="mt-4">
+                        <Label htmlFor="entrySlot">Horário de entrada *</Label>
+                        <select
+                          id="entrySlot"
+                          value={formData.entrySlot}
+                          onChange={(e) => handleSlotChange(e.target.value)}
+                          required
+                          className="w-full mt-1 p-3 border rounded-md focus:ring-2 focus:ring-cyan-500"
+                        >
+                          <option value="">Selecione um horário</option>
+                          {dateSlots.map(slot => (
+                            <option key={slot.start} value={slot.start} disabled={slot.remaining < getTotalQuantity()}>
+                              {slot.start} ({slot.remaining} disponíveis)
+                            </option>
+                          ))}
+                        </select>
+                      </div>
+                    )}
+
                     {checkingAvailability && (
                       <div className="mt-3 flex items-center gap-2 text-gray-600">
                         <Loader2 className="h-4 w-4 animate-spin" />
@@ -534,7 +578,9 @@ export default function Tickets() {
                       {formData.visitDate && (
                         <div className="flex justify-between text-sm text-gray-600 border-t pt-2">
                           <span>Data da visita:</span>
-                          <span className="font-medium">{formatDate(formData.visitDate)}</span>
+                          <span className="font-medium">
+                            {formatDate(formData.visitDate)}{formData.entrySlot && ` às ${formData.entrySlot}`}
+                          </span>
                         </div>
                       )}
                     </div>
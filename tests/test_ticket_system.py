@@ -1,10 +1,19 @@
 """
 Backend API Tests for Ticket Management System
-Tests: Ticket Availability, Staff Management, Staff Login, Ticket Validation
+Tests: Ticket Availability, Staff Management, Staff Login, Ticket Validation,
+and the auth, order and operations features built on top of them
 """
 import pytest
 import requests
 import os
+import sys
+import time
+import uuid
+import asyncio
+import base64
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
@@ -159,6 +168,58 @@ class TestTicketAvailability:
         data = response.json()
         assert "available" in data
         print(f"✓ Availability check: {data}")
+    
+    def test_check_availability_with_entry_slots(self):
+        """Test per-slot remaining capacity on a timed-entry date"""
+        test_date = (datetime.now() + timedelta(days=33)).strftime("%Y-%m-%d")
+        
+        requests.post(f"{BASE_URL}/api/admin/ticket-availability",
+            headers=self.headers,
+            json={
+                "date": test_date,
+                "total_tickets": 100,
+                "slots": [{"start": "09:00", "capacity": 40}, {"start": "11:00", "capacity": 60}]
+            }
+        )
+        
+        response = requests.get(f"{BASE_URL}/api/check-availability/{test_date}",
+            params={"quantity": 50, "entry_slot": "09:00"}
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["available"] is False
+        assert [slot["start"] for slot in data["slots"]] == ["09:00", "11:00"]
+        print(f"✓ Slot availability check: {data['slots']}")
+        
+        requests.delete(f"{BASE_URL}/api/admin/ticket-availability/{test_date}", headers=self.headers)
+    
+    def test_checkout_requires_entry_slot(self):
+        """Orders for a timed-entry date must name one of its slots"""
+        test_date = (datetime.now() + timedelta(days=34)).strftime("%Y-%m-%d")
+        requests.post(f"{BASE_URL}/api/admin/ticket-availability",
+            headers=self.headers,
+            json={"date": test_date, "total_tickets": 100, "slots": [{"start": "09:00", "capacity": 40}]}
+        )
+        try:
+            payload = _test_order_payload("test_slot@acquapark.com", visit_in_days=34)
+            for entry_slot in [None, "10:00"]:
+                response = requests.post(f"{BASE_URL}/api/create-payment-preference",
+                    json={**payload, "entry_slot": entry_slot})
+                assert response.status_code == 400
+                assert response.json()["detail"] == "Selecione um horário de entrada válido"
+        finally:
+            requests.delete(f"{BASE_URL}/api/admin/ticket-availability/{test_date}", headers=self.headers)
+        print("✓ Checkout without a valid entry slot rejected")
+    
+    def test_invalid_entry_slot_rejected(self):
+        """Entry slots must start at HH:MM and hold at least one ticket"""
+        test_date = (datetime.now() + timedelta(days=33)).strftime("%Y-%m-%d")
+        for slot in [{"start": "9h", "capacity": 10}, {"start": "09:00", "capacity": 0}]:
+            response = requests.post(f"{BASE_URL}/api/admin/ticket-availability", headers=self.headers, json={
+                "date": test_date, "total_tickets": 100, "slots": [slot]
+            })
+            assert response.status_code == 422
+        print("✓ Invalid entry slots rejected")
 
 
 class TestStaffManagement:
@@ -299,6 +360,23 @@ class TestStaffLogin:
         assert data["email"] == TEST_STAFF_EMAIL
         print(f"✓ Staff /me endpoint works: {data['name']}")
 
+    def test_staff_token_rejected_on_admin_routes(self):
+        """Test that staff tokens carry their type and cannot reach admin routes"""
+        login_response = requests.post(f"{BASE_URL}/api/staff/login", json={
+            "email": TEST_STAFF_EMAIL,
+            "password": TEST_STAFF_PASSWORD
+        })
+        
+        if login_response.status_code != 200:
+            pytest.skip("Staff login failed")
+        
+        token = login_response.json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        response = requests.get(f"{BASE_URL}/api/auth/me", headers=headers)
+        assert response.status_code == 401
+        print("✓ Staff token rejected on admin route")
+
 
 class TestTicketValidation:
     """Ticket validation tests"""
@@ -362,6 +440,99 @@ class TestTicketValidation:
         print("✓ Unauthenticated validation correctly rejected")
 
 
+class TestOccupancy:
+    """Occupancy counter and scan analytics tests"""
+    
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Get admin token for authenticated requests"""
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": ADMIN_EMAIL,
+            "password": ADMIN_PASSWORD
+        })
+        if response.status_code == 200:
+            self.admin_token = response.json()["access_token"]
+            self.headers = {"Authorization": f"Bearer {self.admin_token}"}
+        else:
+            pytest.skip("Admin authentication failed")
+    
+    def test_get_occupancy_snapshot(self):
+        """Test fetching today's occupancy snapshot"""
+        response = requests.get(f"{BASE_URL}/api/admin/occupancy", headers=self.headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert "total_entries" in data
+        assert isinstance(data["by_gate"], dict)
+        assert isinstance(data["by_staff"], list)
+        print(f"✓ Occupancy for {data['date']}: {data['total_entries']} entries")
+    
+    def test_occupancy_counts_scans_from_every_worker(self):
+        """Accepted scans stored by any worker show up after the next refresh"""
+        db = _mongo_db()
+        gate = f"TEST_gate_{uuid.uuid4().hex[:8]}"
+        db.scan_events.insert_one({
+            "scanned_at": datetime.utcnow(),
+            "meta": {"gate": gate, "staff_id": "TEST_other_worker", "outcome": "accepted"},
+            "staff_name": "TEST Staff",
+            "ticket_code": "TKT-TEST",
+            "order_id": None,
+            "quantity": 3
+        })
+        try:
+            time.sleep(3)
+            response = requests.get(f"{BASE_URL}/api/admin/occupancy", headers=self.headers)
+            assert response.status_code == 200
+            assert response.json()["by_gate"].get(gate) == 3
+        finally:
+            db.scan_events.delete_many({"meta.gate": gate})
+        print("✓ Occupancy includes scans recorded elsewhere")
+    
+    def test_occupancy_requires_admin(self):
+        """Test occupancy endpoint without authentication"""
+        response = requests.get(f"{BASE_URL}/api/admin/occupancy")
+        assert response.status_code in [401, 403]
+        print("✓ Unauthenticated occupancy request rejected")
+    
+    def test_scan_throughput_analytics(self):
+        """Test bucketed scan throughput for today"""
+        today = datetime.now().strftime("%Y-%m-%d")
+        response = requests.get(f"{BASE_URL}/api/admin/scan-analytics/throughput",
+            headers=self.headers,
+            params={"start": today, "end": today, "interval": 5}
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert isinstance(data, list)
+        for bucket in data:
+            assert bucket["scans"] == bucket["accepted"] + bucket["rejected"]
+        print(f"✓ Got {len(data)} throughput buckets")
+    
+    def test_scan_analytics_invalid_range(self):
+        """Test scan analytics with a malformed range"""
+        response = requests.get(f"{BASE_URL}/api/admin/scan-analytics/rejections",
+            headers=self.headers,
+            params={"start": "not-a-date", "end": "2026-01-01"}
+        )
+        assert response.status_code == 400
+        print("✓ Malformed analytics range rejected")
+
+
+class TestQRCodes:
+    """Order QR code rendering tests"""
+    
+    def test_qrcode_nonexistent_order(self):
+        """Test QR code for an order that doesn't exist"""
+        response = requests.get(f"{BASE_URL}/api/orders/ORDER-NONEXISTENT/qrcode")
+        assert response.status_code == 404
+        print("✓ QR code for non-existent order returns 404")
+    
+    def test_qrcode_invalid_format(self):
+        """Test QR code with an unsupported format"""
+        response = requests.get(f"{BASE_URL}/api/orders/ORDER-NONEXISTENT/qrcode?format=gif")
+        assert response.status_code == 400
+        print("✓ Unsupported QR format rejected")
+
+
 class TestTicketTypes:
     """Ticket types CRUD tests"""
     
@@ -439,6 +610,975 @@ class TestTicketTypes:
         print(f"✓ Delete ticket type returned {response.status_code}")
 
 
+def _admin_headers():
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "email": ADMIN_EMAIL,
+        "password": ADMIN_PASSWORD
+    })
+    if response.status_code != 200:
+        pytest.skip("Admin authentication failed")
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def _backend_module(name):
+    """Import a backend module for in-process tests; skips without its dependencies."""
+    backend_dir = os.path.join(os.path.dirname(__file__), '..', 'backend')
+    if backend_dir not in sys.path:
+        sys.path.insert(0, backend_dir)
+    return pytest.importorskip(name)
+
+
+class TestPasswordExecutor:
+    """bcrypt runs on a bounded executor that sheds with 503 when saturated"""
+    
+    def test_saturated_executor_rejects_with_503(self):
+        """Calls beyond max_pending get a 503 with Retry-After instead of queueing"""
+        auth = _backend_module("auth")
+        executor = auth.PasswordExecutor(workers=1, max_pending=1)
+        release = threading.Event()
+        
+        async def scenario():
+            first = asyncio.ensure_future(executor.run(release.wait, 5))
+            await asyncio.sleep(0.05)
+            with pytest.raises(auth.HTTPException) as rejected:
+                await executor.run(lambda: None)
+            release.set()
+            await first
+            return rejected.value
+        
+        rejected = asyncio.run(scenario())
+        assert rejected.status_code == 503
+        assert rejected.headers["Retry-After"] == "1"
+        assert executor.stats()["rejected"] == 1
+        assert executor.stats()["pending"] == 0
+        print("✓ Saturated password executor answers 503")
+    
+    def test_login_burst_stays_within_max_pending(self):
+        """A burst of logins never queues more bcrypt calls than allowed"""
+        headers = _admin_headers()
+        
+        def login():
+            return requests.post(f"{BASE_URL}/api/auth/login", json={
+                "email": ADMIN_EMAIL,
+                "password": ADMIN_PASSWORD
+            })
+        
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            responses = list(pool.map(lambda _: login(), range(40)))
+        assert {response.status_code for response in responses} <= {200, 503}
+        for response in responses:
+            if response.status_code == 503:
+                assert "Retry-After" in response.headers
+        
+        stats = requests.get(f"{BASE_URL}/api/admin/metrics/password-hashing", headers=headers).json()
+        assert stats["max_pending_seen"] <= stats["max_pending"]
+        print(f"✓ Login burst: max pending {stats['max_pending_seen']}/{stats['max_pending']}")
+
+
+def _test_order_payload(email, quantity=2, visit_in_days=30):
+    return {
+        "customer": {
+            "name": "TEST_Order_Customer",
+            "email": email,
+            "phone": "11999990000",
+            "document": "123.456.789-09"
+        },
+        "items": [
+            {"ticketId": "TEST_ticket", "ticketName": "TEST Ingresso", "quantity": quantity, "unitPrice": 50.0}
+        ],
+        "total_amount": quantity * 50.0,
+        "visit_date": (datetime.now() + timedelta(days=visit_in_days)).strftime("%Y-%m-%d")
+    }
+
+
+def _mongo_db():
+    """Direct database access for states the public API cannot produce."""
+    pymongo = pytest.importorskip("pymongo")
+    if not os.environ.get("MONGO_URL") or not os.environ.get("DB_NAME"):
+        pytest.skip("MONGO_URL/DB_NAME not set")
+    return pymongo.MongoClient(os.environ["MONGO_URL"])[os.environ["DB_NAME"]]
+
+
+class TestOrderArchive:
+    """Archived orders stay readable, exportable and listed once"""
+    
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.headers = _admin_headers()
+        self.email = f"test_archive_{uuid.uuid4().hex[:8]}@acquapark.com"
+        response = requests.post(f"{BASE_URL}/api/orders", json=_test_order_payload(self.email, visit_in_days=-800))
+        assert response.status_code == 200
+        self.order_id = response.json()["order_id"]
+    
+    def _archive(self):
+        db = _mongo_db()
+        db.orders.update_one({"order_id": self.order_id}, {"$set": {"payment_status": "cancelled"}})
+        response = requests.post(f"{BASE_URL}/api/admin/archive/orders", headers=self.headers,
+            params={"older_than_days": 365})
+        assert response.status_code in [200, 409]
+        for _ in range(60):
+            run = requests.get(f"{BASE_URL}/api/admin/archive/orders", headers=self.headers).json()["run"]
+            if run.get("status") != "running" and db.orders.find_one({"order_id": self.order_id}) is None:
+                break
+            time.sleep(1)
+        assert db.orders.find_one({"order_id": self.order_id}) is None, "order was not archived"
+    
+    def test_search_include_archive_lists_each_order_once(self):
+        """include_archive returns hot orders too, and each exactly once"""
+        response = requests.get(f"{BASE_URL}/api/admin/orders/search", headers=self.headers,
+            params={"email": self.email, "include_archive": "true"})
+        assert response.status_code == 200
+        assert [order["order_id"] for order in response.json()] == [self.order_id]
+        print("✓ include_archive search returns each order once")
+    
+    def test_archived_order_is_read_and_exported(self):
+        """After archival the order, its QR code and the finance export still have it"""
+        self._archive()
+        
+        response = requests.get(f"{BASE_URL}/api/orders/{self.order_id}")
+        assert response.status_code == 200
+        assert response.json()["payment_status"] == "cancelled"
+        
+        response = requests.get(f"{BASE_URL}/api/orders/{self.order_id}/qrcode")
+        assert response.status_code == 200
+        
+        response = requests.get(f"{BASE_URL}/api/admin/exports/orders", headers=self.headers,
+            params={"format": "csv", "payment_status": "cancelled"})
+        assert response.status_code == 200
+        assert self.order_id in response.text
+        
+        response = requests.get(f"{BASE_URL}/api/admin/orders/search", headers=self.headers,
+            params={"email": self.email, "include_archive": "true"})
+        assert [order["order_id"] for order in response.json()] == [self.order_id]
+        print("✓ Archived order readable and exported")
+
+
+class TestOrderSchema:
+    """v1 and v2 order documents read the same through order_view"""
+    
+    def test_order_view_parity(self):
+        """A v1 order and its v2 form produce the same API view"""
+        schema = _backend_module("order_schema")
+        created_at = datetime(2025, 1, 10, 12, 0, 0)
+        payload = _test_order_payload("test_parity@acquapark.com")
+        v1 = {
+            **payload,
+            "_id": "abc",
+            "order_id": "ORDER-TEST",
+            "payment_status": "pending",
+            "validated": False,
+            "created_at": created_at,
+            "updated_at": created_at
+        }
+        v2 = schema.new_order_document(payload)
+        v2.update({"_id": "abc", "order_id": "ORDER-TEST", "payment_status": "pending", "created_at": created_at})
+        
+        view = schema.order_view(v2)
+        assert view["items"] == schema.order_view(v1)["items"]
+        assert schema.order_items(v1) == schema.order_items(v2)
+        assert view["validated"] is False
+        assert view["updated_at"] == created_at
+        assert view["customer"]["document"] == "12345678909"
+        assert "v" not in view
+        print("✓ order_view gives v1 and v2 the same shape")
+    
+    def test_new_order_read_keeps_v1_shape(self):
+        """Orders stored compactly are returned with the original field names"""
+        email = f"test_schema_{uuid.uuid4().hex[:8]}@acquapark.com"
+        payload = _test_order_payload(email)
+        order_id = requests.post(f"{BASE_URL}/api/orders", json=payload).json()["order_id"]
+        response = requests.get(f"{BASE_URL}/api/orders/{order_id}")
+        assert response.status_code == 200
+        order = response.json()
+        assert order["items"] == payload["items"]
+        assert order["customer"]["name"] == payload["customer"]["name"]
+        assert order["customer"]["email"] == email
+        assert order["validated"] is False
+        assert "v" not in order
+        print("✓ Order returned in v1 shape")
+    
+    def test_v2_migration_pipeline(self):
+        """Migrating a v1 document compacts it, normalises the CPF and drops
+        an updated_at written alongside created_at"""
+        schema = _backend_module("order_schema")
+        db = _mongo_db()
+        created_at = datetime.utcnow()
+        order_id = f"ORDER-T{uuid.uuid4().hex[:7].upper()}"
+        payload = _test_order_payload(f"test_v1_{uuid.uuid4().hex[:8]}@acquapark.com")
+        inserted = db.orders.insert_one({
+            **payload,
+            "order_id": order_id,
+            "ticket_code": f"TKT-{uuid.uuid4().hex[:12].upper()}",
+            "payment_status": "pending",
+            "validated": False,
+            "created_at": created_at,
+            "updated_at": created_at + timedelta(milliseconds=300)
+        })
+        try:
+            db.orders.update_one({"_id": inserted.inserted_id}, schema._v2_pipeline(None))
+            stored = db.orders.find_one({"_id": inserted.inserted_id})
+            assert stored["v"] == 2
+            assert stored["customer"]["document"] == "12345678909"
+            assert stored["items"] == [{"t": "TEST_ticket", "n": "TEST Ingresso", "q": 2, "p": 50.0}]
+            assert "updated_at" not in stored and "validated" not in stored
+            
+            response = requests.get(f"{BASE_URL}/api/orders/{order_id}")
+            assert response.json()["items"] == payload["items"]
+        finally:
+            db.orders.delete_one({"_id": inserted.inserted_id})
+        print("✓ v1 -> v2 pipeline")
+
+
+class TestMigrations:
+    """Data migration status and dry runs"""
+    
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.headers = _admin_headers()
+    
+    def test_migration_status(self):
+        """Every registered migration is listed with its status"""
+        response = requests.get(f"{BASE_URL}/api/admin/migrations", headers=self.headers)
+        assert response.status_code == 200
+        names = [migration["name"] for migration in response.json()]
+        assert "orders_v2" in names and "orders_ticket_code" in names
+        print(f"✓ {len(names)} migrations registered")
+    
+    def test_migration_dry_run(self):
+        """Dry run (the default) reports counts and an estimate without writing"""
+        before = requests.get(f"{BASE_URL}/api/admin/migrations", headers=self.headers).json()
+        response = requests.post(f"{BASE_URL}/api/admin/migrations/orders_v2", headers=self.headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["migration"] == "orders_v2"
+        assert data["pending"] >= 0
+        assert data["batches"] >= 0
+        assert data["estimated_seconds"] >= 0
+        after = requests.get(f"{BASE_URL}/api/admin/migrations", headers=self.headers).json()
+        assert before == after
+        print(f"✓ Dry run: {data['pending']} pending, ~{data['estimated_seconds']}s")
+    
+    def test_unknown_migration(self):
+        response = requests.post(f"{BASE_URL}/api/admin/migrations/does_not_exist", headers=self.headers)
+        assert response.status_code == 404
+        print("✓ Unknown migration rejected")
+    
+    def test_migrations_require_admin(self):
+        response = requests.get(f"{BASE_URL}/api/admin/migrations")
+        assert response.status_code in [401, 403]
+        print("✓ Migrations require admin")
+
+
+class TestDuplicateRejection:
+    """Duplicates are rejected with 400, before any password hashing"""
+    
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.headers = _admin_headers()
+    
+    def test_duplicate_customer_register(self):
+        """Same email, and the same CPF typed differently, are both rejected"""
+        suffix = uuid.uuid4().hex[:8]
+        cpf = f"{int(suffix, 16) % 10**11:011d}"
+        customer = {
+            "name": "TEST_Customer",
+            "email": f"test_customer_{suffix}@acquapark.com",
+            "phone": "11999990000",
+            "document": cpf,
+            "password": "TestCustomer123"
+        }
+        response = requests.post(f"{BASE_URL}/api/customers/register", json=customer)
+        assert response.status_code == 200
+        
+        response = requests.post(f"{BASE_URL}/api/customers/register", json=customer)
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Email já cadastrado"
+        
+        formatted = f"{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}"
+        response = requests.post(f"{BASE_URL}/api/customers/register", json={
+            **customer, "email": f"test_customer_{suffix}_2@acquapark.com", "document": formatted
+        })
+        assert response.status_code == 400
+        assert response.json()["detail"] == "CPF já cadastrado"
+        print("✓ Duplicate customer email and CPF rejected")
+    
+    def test_duplicate_staff(self):
+        """Creating a staff member twice with the same email returns 400"""
+        staff = {
+            "name": TEST_STAFF_NAME,
+            "email": TEST_STAFF_EMAIL,
+            "password": TEST_STAFF_PASSWORD
+        }
+        requests.post(f"{BASE_URL}/api/admin/staff", headers=self.headers, json=staff)
+        response = requests.post(f"{BASE_URL}/api/admin/staff", headers=self.headers, json=staff)
+        assert response.status_code == 400
+        print("✓ Duplicate staff rejected")
+    
+    def test_duplicate_availability(self):
+        """Creating availability twice for one date returns 400"""
+        test_date = (datetime.now() + timedelta(days=33)).strftime("%Y-%m-%d")
+        availability = {"date": test_date, "total_tickets": 100}
+        try:
+            requests.post(f"{BASE_URL}/api/admin/ticket-availability", headers=self.headers, json=availability)
+            response = requests.post(f"{BASE_URL}/api/admin/ticket-availability", headers=self.headers, json=availability)
+            assert response.status_code == 400
+        finally:
+            requests.delete(f"{BASE_URL}/api/admin/ticket-availability/{test_date}", headers=self.headers)
+        print("✓ Duplicate availability rejected")
+    
+    def test_orders_get_distinct_ticket_codes(self):
+        """Every order gets its own ticket code (the unique index holds)"""
+        email = f"test_codes_{uuid.uuid4().hex[:8]}@acquapark.com"
+        order_ids = [
+            requests.post(f"{BASE_URL}/api/orders", json=_test_order_payload(email)).json()["order_id"]
+            for _ in range(3)
+        ]
+        codes = {
+            requests.get(f"{BASE_URL}/api/orders/{order_id}").json()["ticket_code"]
+            for order_id in order_ids
+        }
+        assert len(codes) == len(order_ids)
+        print("✓ Ticket codes are unique")
+    
+    def test_index_health(self):
+        """The admin index check lists registry indexes missing from the database"""
+        response = requests.get(f"{BASE_URL}/api/admin/indexes", headers=self.headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["healthy"] == (data["missing"] == [])
+        for index in data["missing"]:
+            print(f"  missing {index['collection']}.{index['index']}: {index['error']}")
+        
+        response = requests.get(f"{BASE_URL}/api/admin/indexes")
+        assert response.status_code in [401, 403]
+        print(f"✓ Index check: healthy={data['healthy']}")
+
+
+class TestOrderPagination:
+    """Keyset pagination of the admin order list and search"""
+    
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.headers = _admin_headers()
+        self.email = f"test_orders_{uuid.uuid4().hex[:8]}@acquapark.com"
+        self.order_ids = []
+        for _ in range(3):
+            response = requests.post(f"{BASE_URL}/api/orders", json=_test_order_payload(self.email))
+            assert response.status_code == 200
+            self.order_ids.append(response.json()["order_id"])
+    
+    def test_keyset_pagination(self):
+        """Pages follow X-Next-Cursor without repeating or skipping orders"""
+        seen = []
+        cursor = None
+        for _ in range(3):
+            params = {"email": self.email, "limit": 1}
+            if cursor:
+                params["cursor"] = cursor
+            response = requests.get(f"{BASE_URL}/api/admin/orders/search", headers=self.headers, params=params)
+            assert response.status_code == 200
+            page = response.json()
+            assert len(page) == 1
+            seen.append(page[0]["order_id"])
+            cursor = response.headers.get("X-Next-Cursor")
+        assert sorted(seen) == sorted(self.order_ids)
+        
+        # Newest first, and the last page carries no cursor
+        response = requests.get(f"{BASE_URL}/api/admin/orders/search", headers=self.headers,
+            params={"email": self.email, "limit": 3})
+        assert [order["order_id"] for order in response.json()] == seen
+        assert "X-Next-Cursor" not in response.headers
+        print("✓ Keyset pagination walks every order once")
+    
+    def test_list_pagination_header(self):
+        """The admin order list sets X-Next-Cursor while more orders exist"""
+        response = requests.get(f"{BASE_URL}/api/admin/orders", headers=self.headers, params={"limit": 1})
+        assert response.status_code == 200
+        assert len(response.json()) == 1
+        cursor = response.headers.get("X-Next-Cursor")
+        assert cursor
+        
+        next_page = requests.get(f"{BASE_URL}/api/admin/orders", headers=self.headers,
+            params={"limit": 1, "cursor": cursor})
+        assert next_page.status_code == 200
+        assert next_page.json()[0]["_id"] != response.json()[0]["_id"]
+        print("✓ Admin order list paginates by cursor")
+    
+    def test_invalid_cursor(self):
+        """A malformed cursor is a 400, not a 500"""
+        response = requests.get(f"{BASE_URL}/api/admin/orders", headers=self.headers,
+            params={"cursor": "not-a-cursor"})
+        assert response.status_code == 400
+        print("✓ Invalid cursor rejected")
+
+
+class TestOrderSearch:
+    """Admin order search by id, email prefix and CPF"""
+    
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.headers = _admin_headers()
+        self.email = f"test_orders_{uuid.uuid4().hex[:8]}@acquapark.com"
+        self.order_ids = []
+        for _ in range(3):
+            response = requests.post(f"{BASE_URL}/api/orders", json=_test_order_payload(self.email))
+            assert response.status_code == 200
+            self.order_ids.append(response.json()["order_id"])
+    
+    def test_search_by_order_id_and_prefix(self):
+        """Exact order_id search, email prefix search and the prefix minimum"""
+        response = requests.get(f"{BASE_URL}/api/admin/orders/search", headers=self.headers,
+            params={"order_id": self.order_ids[0].lower()})
+        assert response.status_code == 200
+        assert [order["order_id"] for order in response.json()] == [self.order_ids[0]]
+        
+        response = requests.get(f"{BASE_URL}/api/admin/orders/search", headers=self.headers,
+            params={"email": self.email[:-len("@acquapark.com")], "prefix": "true"})
+        assert response.status_code == 200
+        assert {order["order_id"] for order in response.json()} == set(self.order_ids)
+        
+        response = requests.get(f"{BASE_URL}/api/admin/orders/search", headers=self.headers,
+            params={"email": "te", "prefix": "true"})
+        assert response.status_code == 400
+        print("✓ Order search by id and prefix")
+    
+    def test_search_by_document_variants(self):
+        """Bare and formatted CPF find the same orders"""
+        bare = requests.get(f"{BASE_URL}/api/admin/orders/search", headers=self.headers,
+            params={"document": "12345678909", "email": self.email})
+        formatted = requests.get(f"{BASE_URL}/api/admin/orders/search", headers=self.headers,
+            params={"document": "123.456.789-09", "email": self.email})
+        assert bare.status_code == 200 and formatted.status_code == 200
+        assert {order["order_id"] for order in bare.json()} == set(self.order_ids)
+        assert bare.json() == formatted.json()
+        print("✓ CPF variants match")
+
+
+class TestContactInbox:
+    """Contact status changes and the retention of archived messages"""
+    
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.headers = _admin_headers()
+        response = requests.post(f"{BASE_URL}/api/contact", json={
+            "name": "TEST_Contact",
+            "email": "test_contact@acquapark.com",
+            "subject": "TEST assunto",
+            "message": "TEST mensagem"
+        })
+        assert response.status_code == 200
+        self.contact_id = response.json()["id"]
+    
+    def _set_status(self, status):
+        return requests.patch(f"{BASE_URL}/api/admin/contacts/{self.contact_id}/status",
+            headers=self.headers, json={"status": status})
+    
+    def _contact(self, status):
+        response = requests.get(f"{BASE_URL}/api/admin/contacts", headers=self.headers,
+            params={"status": status, "limit": 100})
+        return next(contact for contact in response.json() if contact["_id"] == self.contact_id)
+    
+    def test_only_archived_messages_expire(self):
+        """Replied is a working status; archiving schedules the deletion, reopening cancels it"""
+        assert self._set_status("replied").status_code == 200
+        assert "resolved_at" not in self._contact("replied")
+        
+        assert self._set_status("archived").status_code == 200
+        assert self._contact("archived")["resolved_at"]
+        
+        assert self._set_status("read").status_code == 200
+        assert "resolved_at" not in self._contact("read")
+        self._set_status("archived")
+        print("✓ Only archived contacts carry resolved_at")
+    
+    def test_unknown_status_rejected(self):
+        """Statuses outside the contract are a 400"""
+        response = self._set_status("resolved")
+        assert response.status_code == 400
+        self._set_status("archived")
+        print("✓ Unknown contact status rejected")
+
+
+class TestCustomerAuth:
+    """Customer tokens carry identity only; the profile comes from the database"""
+    
+    def test_token_has_no_personal_data(self):
+        """The JWT holds sub/id/type/ver, and /me still returns the full profile"""
+        suffix = uuid.uuid4().hex[:8]
+        customer = {
+            "name": "TEST_Customer",
+            "email": f"test_customer_{suffix}@acquapark.com",
+            "phone": "11999990000",
+            "document": f"{int(suffix, 16) % 10**11:011d}",
+            "password": "TestCustomer123"
+        }
+        response = requests.post(f"{BASE_URL}/api/customers/register", json=customer)
+        assert response.status_code == 200
+        
+        response = requests.post(f"{BASE_URL}/api/customers/login",
+            json={"email": customer["email"], "password": customer["password"]})
+        assert response.status_code == 200
+        token = response.json()["access_token"]
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        assert set(claims) <= {"sub", "id", "type", "ver", "exp"}
+        
+        response = requests.get(f"{BASE_URL}/api/customers/me", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200
+        profile = response.json()
+        assert profile["email"] == customer["email"]
+        assert profile["phone"] == customer["phone"]
+        assert profile["document"] == customer["document"]
+        print("✓ Customer token carries no phone or CPF")
+
+
+class TestRequestProfiler:
+    """Admin request profiler sessions and stored profiles"""
+    
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.headers = _admin_headers()
+        yield
+        requests.delete(f"{BASE_URL}/api/admin/profiler", headers=self.headers)
+    
+    def test_profile_is_stored(self):
+        """A profiled request is answered normally and its profile saved in the background"""
+        route = "GET /api/tickets"
+        response = requests.post(f"{BASE_URL}/api/admin/profiler", headers=self.headers,
+            json={"routes": [route], "duration_seconds": 60, "max_profiles": 1})
+        assert response.status_code == 200
+        assert response.json()["enabled"] is True
+        
+        assert requests.get(f"{BASE_URL}/api/tickets").status_code == 200
+        
+        profiles = []
+        for _ in range(10):
+            time.sleep(0.2)
+            profiles = requests.get(f"{BASE_URL}/api/admin/profiler/profiles", headers=self.headers,
+                params={"route": route}).json()
+            if profiles:
+                break
+        assert profiles and profiles[0]["status"] == 200
+        
+        response = requests.get(f"{BASE_URL}/api/admin/profiler/profiles/{profiles[0]['profile_id']}",
+            headers=self.headers)
+        assert response.status_code == 200
+        print(f"✓ Profile stored with {profiles[0]['samples']} samples")
+    
+    def test_invalid_session_rejected(self):
+        """A session needs routes or a sampling percentage"""
+        response = requests.post(f"{BASE_URL}/api/admin/profiler", headers=self.headers, json={})
+        assert response.status_code == 400
+        print("✓ Empty profiler session rejected")
+
+
+class TestVoucherJobs:
+    """Voucher job status and downloads after the worker or its files are gone"""
+    
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.headers = _admin_headers()
+        self.db = _mongo_db()
+        self.job_id = f"test{uuid.uuid4().hex}"
+        yield
+        self.db.voucher_jobs.delete_one({"job_id": self.job_id})
+    
+    def _insert_job(self, **fields):
+        self.db.voucher_jobs.insert_one({
+            "job_id": self.job_id,
+            "order_ids": ["ORDER-TEST"],
+            "total": 1,
+            "completed": 0,
+            "files": [],
+            "created_by": ADMIN_EMAIL,
+            "created_at": datetime.utcnow(),
+            **fields
+        })
+    
+    def test_interrupted_job_marked_failed(self):
+        """A running job whose heartbeat stopped is reported as failed"""
+        self._insert_job(status="running", heartbeat_at=datetime.utcnow() - timedelta(hours=1))
+        response = requests.get(f"{BASE_URL}/api/admin/voucher-jobs/{self.job_id}", headers=self.headers)
+        assert response.status_code == 200
+        assert response.json()["status"] == "failed"
+        print("✓ Interrupted voucher job marked failed")
+    
+    def test_missing_voucher_file_is_404(self):
+        """A listed voucher whose file is gone is a 404, not a 500"""
+        self._insert_job(status="completed", completed=1, files=["ORDER-TEST"])
+        response = requests.get(f"{BASE_URL}/api/admin/voucher-jobs/{self.job_id}/files/ORDER-TEST",
+            headers=self.headers)
+        assert response.status_code == 404
+        print("✓ Missing voucher file returns 404")
+
+
+class TestMemorySnapshots:
+    """tracemalloc snapshots, stored in Mongo so any worker can serve them"""
+    
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.headers = _admin_headers()
+        yield
+        requests.post(f"{BASE_URL}/api/admin/memory/stop", headers=self.headers)
+    
+    def _wait_for_top(self, snapshot_id):
+        # Queued snapshots are taken by the traced worker within a few seconds
+        for _ in range(30):
+            response = requests.get(f"{BASE_URL}/api/admin/memory/snapshots/{snapshot_id}/top",
+                headers=self.headers, params={"group_by": "package", "limit": 5})
+            if response.status_code != 409:
+                return response
+            time.sleep(0.5)
+        return response
+    
+    def test_snapshot_top_and_diff(self):
+        """Snapshots taken while tracing can be listed, shown and compared"""
+        response = requests.post(f"{BASE_URL}/api/admin/memory/start", headers=self.headers, params={"frames": 1})
+        assert response.status_code == 200
+        assert response.json()["tracing_worker"]
+        
+        snapshot_ids = []
+        for _ in range(2):
+            response = requests.post(f"{BASE_URL}/api/admin/memory/snapshots", headers=self.headers)
+            assert response.status_code == 200
+            snapshot_ids.append(response.json()["snapshot_id"])
+        
+        for snapshot_id in snapshot_ids:
+            response = self._wait_for_top(snapshot_id)
+            assert response.status_code == 200
+            assert len(response.json()) <= 5
+        
+        response = requests.get(f"{BASE_URL}/api/admin/memory/diff", headers=self.headers,
+            params={"base": snapshot_ids[0], "target": snapshot_ids[1]})
+        assert response.status_code == 200
+        
+        status = requests.get(f"{BASE_URL}/api/admin/memory", headers=self.headers).json()
+        assert set(snapshot_ids) <= {snapshot["snapshot_id"] for snapshot in status["snapshots"]}
+        print(f"✓ Memory snapshots traced on {status['tracing_worker']}")
+    
+    def test_snapshot_requires_tracing(self):
+        """Without an active trace a snapshot is a 409 and unknown ids a 404"""
+        requests.post(f"{BASE_URL}/api/admin/memory/stop", headers=self.headers)
+        response = requests.post(f"{BASE_URL}/api/admin/memory/snapshots", headers=self.headers)
+        assert response.status_code == 409
+        
+        response = requests.get(f"{BASE_URL}/api/admin/memory/snapshots/unknown/top", headers=self.headers)
+        assert response.status_code == 404
+        print("✓ Memory snapshot errors")
+
+
+class TestLoginThrottle:
+    """Repeated login failures are turned away with 429 before any bcrypt work"""
+    
+    def test_account_lockout(self):
+        """After the allowed failures an account gets 429 with Retry-After"""
+        email = f"test_throttle_{uuid.uuid4().hex[:8]}@acquapark.com"
+        # A fresh address keeps the per-IP budget of the other tests untouched
+        headers = {"X-Forwarded-For": f"10.{uuid.uuid4().int % 250}.{uuid.uuid4().int % 250}.1"}
+        statuses = []
+        for _ in range(6):
+            response = requests.post(f"{BASE_URL}/api/customers/login", headers=headers,
+                json={"email": email, "password": "wrong-password"})
+            statuses.append(response.status_code)
+        assert statuses[:5] == [401] * 5
+        assert statuses[5] == 429
+        assert int(response.headers["Retry-After"]) > 0
+        print("✓ Login locked out after 5 failures")
+
+
+class TestPasswordRehash:
+    """Hashes below the calibrated bcrypt cost are upgraded on login"""
+    
+    def test_weak_hash_upgraded_on_login(self):
+        """A customer stored with cost 4 logs in and gets a stronger hash"""
+        passlib_hash = pytest.importorskip("passlib.hash")
+        db = _mongo_db()
+        suffix = uuid.uuid4().hex[:8]
+        email = f"test_rehash_{suffix}@acquapark.com"
+        password = "TestRehash123"
+        old_hash = passlib_hash.bcrypt.using(rounds=4).hash(password)
+        inserted = db.customers.insert_one({
+            "name": "TEST_Rehash",
+            "email": email,
+            "phone": "11999990000",
+            "document": f"{int(suffix, 16) % 10**11:011d}",
+            "hashed_password": old_hash,
+            "created_at": datetime.utcnow()
+        })
+        try:
+            response = requests.post(f"{BASE_URL}/api/customers/login", json={"email": email, "password": password})
+            assert response.status_code == 200
+            
+            new_hash = old_hash
+            for _ in range(20):
+                new_hash = db.customers.find_one({"_id": inserted.inserted_id})["hashed_password"]
+                if new_hash != old_hash:
+                    break
+                time.sleep(0.25)
+            assert new_hash != old_hash
+            assert int(new_hash.split("$")[2]) >= 10
+            
+            response = requests.post(f"{BASE_URL}/api/customers/login", json={"email": email, "password": password})
+            assert response.status_code == 200
+        finally:
+            db.customers.delete_one({"_id": inserted.inserted_id})
+        print(f"✓ Hash upgraded to cost {new_hash.split('$')[2]}")
+
+
+class TestEventLoopMonitor:
+    """Event-loop lag statistics"""
+    
+    def test_event_loop_stats(self):
+        """Lag samples and stalls by route are reported to admins"""
+        response = requests.get(f"{BASE_URL}/api/admin/metrics/event-loop", headers=_admin_headers())
+        assert response.status_code == 200
+        data = response.json()
+        assert data["threshold_ms"] > 0
+        assert isinstance(data["blocked_by_route"], dict)
+        assert isinstance(data["recent_blocks"], list)
+        if data["p95_lag_ms"] is not None:
+            assert data["p95_lag_ms"] <= data["max_lag_ms"]
+        
+        response = requests.get(f"{BASE_URL}/api/admin/metrics/event-loop")
+        assert response.status_code in [401, 403]
+        print(f"✓ Event loop p95 lag: {data['p95_lag_ms']} ms")
+
+
+class TestPrometheusMetrics:
+    """Prometheus exposition of request and domain metrics"""
+    
+    def test_metrics_exposition(self):
+        """Routed requests are counted under their route template"""
+        requests.get(f"{BASE_URL}/api/orders/ORDER-DOES-NOT-EXIST")
+        token = os.environ.get("METRICS_TOKEN")
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        response = requests.get(f"{BASE_URL}/metrics", headers=headers)
+        assert response.status_code == 200
+        assert response.headers["Content-Type"].startswith("text/plain")
+        body = response.text
+        assert 'http_requests_total{route="GET /api/orders/{order_id}",status="404"}' in body
+        assert "http_request_duration_seconds_bucket" in body
+        assert "ORDER-DOES-NOT-EXIST" not in body
+        print("✓ Metrics exposed by route template")
+
+
+class TestMongoProfiler:
+    """Per-shape MongoDB command statistics"""
+    
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.headers = _admin_headers()
+    
+    def test_command_report(self):
+        """Commands are grouped by collection and shape, with the routes that ran them"""
+        requests.get(f"{BASE_URL}/api/orders/ORDER-DOES-NOT-EXIST")
+        response = requests.get(f"{BASE_URL}/api/admin/metrics/mongodb", headers=self.headers, params={"limit": 500})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["slow_ms"] > 0
+        orders = [row for row in data["commands"] if row["collection"] == "orders" and row["command"] == "find"]
+        assert orders
+        assert any("GET /api/orders/{order_id}" in row["routes"] for row in orders)
+        assert all("ORDER-DOES-NOT-EXIST" not in row["shape"] for row in data["commands"])
+        print(f"✓ {len(data['commands'])} command shapes profiled")
+    
+    def test_report_reset(self):
+        response = requests.delete(f"{BASE_URL}/api/admin/metrics/mongodb", headers=self.headers)
+        assert response.status_code == 200
+        response = requests.get(f"{BASE_URL}/api/admin/metrics/mongodb", headers=self.headers, params={"limit": 500})
+        # Background tasks may have run commands since; no request has
+        assert all("GET /api/orders/{order_id}" not in row["routes"] for row in response.json()["commands"])
+        print("✓ MongoDB report reset")
+
+
+class TestRequestLogging:
+    """Request correlation ids and the non-blocking log writer"""
+    
+    def test_request_id_echoed(self):
+        """A well-formed X-Request-ID is kept; anything else is replaced"""
+        request_id = f"test-{uuid.uuid4().hex}"
+        response = requests.get(f"{BASE_URL}/api/health", headers={"X-Request-ID": request_id})
+        assert response.headers["X-Request-ID"] == request_id
+        
+        response = requests.get(f"{BASE_URL}/api/health", headers={"X-Request-ID": "bad id\" injected"})
+        assert response.headers["X-Request-ID"] != "bad id\" injected"
+        assert len(response.headers["X-Request-ID"]) == 32
+        print("✓ X-Request-ID echoed or generated")
+    
+    def test_dropped_records_exposed(self):
+        """Records dropped by a full log queue are counted in /metrics"""
+        token = os.environ.get("METRICS_TOKEN")
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        response = requests.get(f"{BASE_URL}/metrics", headers=headers)
+        assert response.status_code == 200
+        assert "\nlog_records_dropped " in response.text
+        print("✓ Dropped log records exposed")
+
+
+class TestLoadShedding:
+    """Adaptive per-group concurrency limits"""
+    
+    def test_burst_is_served_or_shed(self):
+        """Under a burst every request is answered or shed with 503, never queued past the limit"""
+        headers = _admin_headers()
+        with ThreadPoolExecutor(max_workers=50) as pool:
+            responses = list(pool.map(lambda _: requests.get(f"{BASE_URL}/api/tickets"), range(200)))
+        assert {response.status_code for response in responses} <= {200, 503}
+        for response in responses:
+            if response.status_code == 503:
+                assert "Retry-After" in response.headers
+        
+        response = requests.get(f"{BASE_URL}/api/admin/metrics/concurrency", headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["in_flight"] <= data["max_in_flight"]
+        assert data["groups"]["staff"]["priority"] < data["groups"]["public"]["priority"]
+        for group in data["groups"].values():
+            assert group["limit"] >= 1
+        shed = sum(response.status_code == 503 for response in responses)
+        print(f"✓ Burst: {shed} shed, public limit {data['groups']['public']['limit']}")
+
+
+class TestExports:
+    """Streaming CSV and NDJSON exports"""
+    
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.headers = _admin_headers()
+        self.marker = uuid.uuid4().hex[:8]
+        self.subject = f"=HYPERLINK(\"http://example.com/{self.marker}\")"
+        response = requests.post(f"{BASE_URL}/api/contact", json={
+            "name": "TEST_Export",
+            "email": "test_export@acquapark.com",
+            "subject": self.subject,
+            "message": "TEST mensagem"
+        })
+        assert response.status_code == 200
+        self.today = datetime.now().strftime("%Y-%m-%d")
+    
+    def test_csv_escapes_formulas(self):
+        """A cell starting with = is exported as text, not as a formula"""
+        response = requests.get(f"{BASE_URL}/api/admin/exports/contacts", headers=self.headers,
+            params={"format": "csv", "start": self.today, "end": self.today})
+        assert response.status_code == 200
+        assert response.headers["Content-Type"].startswith("text/csv")
+        line = next(line for line in response.text.splitlines() if self.marker in line)
+        assert "'=HYPERLINK" in line
+        print("✓ CSV export escapes formula cells")
+    
+    def test_ndjson_keeps_values(self):
+        """NDJSON rows carry the stored value unchanged"""
+        response = requests.get(f"{BASE_URL}/api/admin/exports/contacts", headers=self.headers,
+            params={"format": "ndjson", "start": self.today, "end": self.today})
+        assert response.status_code == 200
+        rows = [json.loads(line) for line in response.text.splitlines() if line]
+        assert self.subject in [row["subject"] for row in rows]
+        print("✓ NDJSON export keeps values")
+    
+    def test_invalid_format(self):
+        response = requests.get(f"{BASE_URL}/api/admin/exports/contacts", headers=self.headers,
+            params={"format": "xlsx"})
+        assert response.status_code == 400
+        print("✓ Unknown export format rejected")
+
+
+class TestDashboardCounters:
+    """Dashboard stats read from counters kept by the write paths"""
+    
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.headers = _admin_headers()
+    
+    def _stats(self):
+        response = requests.get(f"{BASE_URL}/api/admin/dashboard-stats", headers=self.headers)
+        assert response.status_code == 200
+        return response.json()
+    
+    def test_counters_follow_writes(self):
+        """New orders and contacts, and contact status changes, move the counters at once"""
+        before = self._stats()
+        requests.post(f"{BASE_URL}/api/orders", json=_test_order_payload(f"test_counters_{uuid.uuid4().hex[:8]}@acquapark.com"))
+        contact_id = requests.post(f"{BASE_URL}/api/contact", json={
+            "name": "TEST_Counters",
+            "email": "test_counters@acquapark.com",
+            "subject": "TEST assunto",
+            "message": "TEST mensagem"
+        }).json()["id"]
+        after = self._stats()
+        assert after["total_orders"] == before["total_orders"] + 1
+        assert after["total_contacts"] == before["total_contacts"] + 1
+        assert after["new_contacts"] == before["new_contacts"] + 1
+        
+        requests.patch(f"{BASE_URL}/api/admin/contacts/{contact_id}/status",
+            headers=self.headers, json={"status": "archived"})
+        assert self._stats()["new_contacts"] == before["new_contacts"]
+        print("✓ Dashboard counters follow writes")
+    
+    def test_reconcile(self):
+        """Reconciling recounts every counter and reports the drift"""
+        response = requests.post(f"{BASE_URL}/api/admin/dashboard-stats/reconcile", headers=self.headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert set(data["counters"]) == {"total_attractions", "total_tickets", "total_orders", "total_contacts", "new_contacts"}
+        
+        stats = self._stats()
+        for name, value in data["counters"].items():
+            assert stats[name] == value
+        print(f"✓ Counters reconciled, drift {data['drift']}")
+
+
+class TestSalesRollups:
+    """Daily sales rollups and the reports read from them"""
+    
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.headers = _admin_headers()
+    
+    def test_rebuild_and_report(self):
+        """Rebuilding a visit-date range picks up approved orders and drops removed ones"""
+        db = _mongo_db()
+        payload = _test_order_payload(f"test_rollup_{uuid.uuid4().hex[:8]}@acquapark.com", quantity=3, visit_in_days=400)
+        ticket_id = f"TEST_rollup_{uuid.uuid4().hex[:8]}"
+        payload["items"][0]["ticketId"] = ticket_id
+        visit_date = payload["visit_date"]
+        inserted = db.orders.insert_one({
+            **payload,
+            "order_id": f"ORDER-T{uuid.uuid4().hex[:7].upper()}",
+            "ticket_code": f"TKT-{uuid.uuid4().hex[:12].upper()}",
+            "payment_status": "approved",
+            "created_at": datetime.utcnow()
+        })
+        range_params = {"visit_from": visit_date, "visit_to": visit_date}
+        report_params = {"by": "visit_date", "start": visit_date, "end": visit_date}
+        try:
+            response = requests.post(f"{BASE_URL}/api/admin/reports/daily-sales/rebuild",
+                headers=self.headers, params=range_params)
+            assert response.status_code == 200
+            
+            rows = requests.get(f"{BASE_URL}/api/admin/reports/ticket-types",
+                headers=self.headers, params=report_params).json()
+            row = next(row for row in rows if row["ticket_id"] == ticket_id)
+            assert row["orders"] == 1 and row["tickets"] == 3 and row["revenue"] == 150.0
+            
+            daily = requests.get(f"{BASE_URL}/api/admin/reports/daily-sales",
+                headers=self.headers, params=report_params).json()
+            assert daily[0]["date"] == visit_date and daily[0]["tickets"] >= 3
+        finally:
+            db.orders.delete_one({"_id": inserted.inserted_id})
+            requests.post(f"{BASE_URL}/api/admin/reports/daily-sales/rebuild", headers=self.headers, params=range_params)
+        
+        rows = requests.get(f"{BASE_URL}/api/admin/reports/ticket-types",
+            headers=self.headers, params=report_params).json()
+        assert ticket_id not in [row["ticket_id"] for row in rows]
+        print("✓ Rollups rebuilt for one visit date")
+    
+    def test_invalid_grouping(self):
+        response = requests.get(f"{BASE_URL}/api/admin/reports/daily-sales", headers=self.headers,
+            params={"by": "created_at"})
+        assert response.status_code == 400
+        print("✓ Unknown report grouping rejected")
+
+
 class TestCleanup:
     """Cleanup test data"""
     